@@ -1,10 +1,26 @@
+import threading
 from pathlib import Path
 
-from flask import Flask
-from flask_socketio import SocketIO
+from .config import SERVER_MODE
+from .green import monkey_patch
 
+monkey_patch(SERVER_MODE)
 
-socketio = SocketIO(cors_allowed_origins="*")
+_socketio_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # ``from app import socketio`` creates the server on first use, so
+    # processes that never serve (the station agent) don't load Flask,
+    # Socket.IO or psycopg2 by importing an app module
+    if name != "socketio":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _socketio_lock:
+        if "socketio" not in globals():
+            from .mq import TimedSocketIO
+
+            globals()["socketio"] = TimedSocketIO(cors_allowed_origins="*")
+    return globals()["socketio"]
 
 
 def create_app():
@@ -12,6 +28,10 @@ def create_app():
 
     Keeps template/static folders at repo root for compatibility.
     """
+    from flask import Flask
+
+    from . import socketio
+
     base_dir = Path(__file__).resolve().parent.parent
     app = Flask(
         __name__,
@@ -24,13 +44,57 @@ def create_app():
 
     app.config["SECRET_KEY"] = SECRET_KEY
 
-    # Initialize SocketIO extension
-    socketio.init_app(app)
+    # Initialize SocketIO extension; with a message queue every server
+    # process (and app.scanner) reaches every browser
+    from .config import SOCKETIO_MESSAGE_QUEUE
+    from .mq import make_client_manager
+
+    socketio.init_app(
+        app,
+        async_mode=SERVER_MODE,
+        client_manager=make_client_manager(SOCKETIO_MESSAGE_QUEUE),
+    )
 
     # Register blueprints
+    from .routes.agent import agent_bp
     from .routes.api import api_bp
+    from .routes.stats import stats_bp
 
     app.register_blueprint(api_bp)
+    app.register_blueprint(stats_bp)
+    app.register_blueprint(agent_bp)
+
+    # Per-route timing (/metrics) and slow-request log
+    import time
+
+    from flask import g, request
+
+    from .config import LOG_SLOW_MS
+    from .logs import log_event
+    from .metrics import HTTP_SECONDS
+
+    @app.before_request
+    def _start_timer():
+        g.started = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        started = g.pop("started", None)
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            endpoint = request.endpoint or "unmatched"
+            HTTP_SECONDS.observe(
+                elapsed, endpoint=endpoint, method=request.method, status=response.status_code
+            )
+            if elapsed * 1000 >= LOG_SLOW_MS:
+                log_event(
+                    "slow_request",
+                    endpoint=endpoint,
+                    path=request.path,
+                    status=response.status_code,
+                    ms=round(elapsed * 1000, 2),
+                )
+        return response
 
     # Basic routes
     @app.route("/")
@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import http.client
+import json
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import urlencode, urlsplit
+
+from .cache import MISSING, TTLCache
+from .config import (
+    AGENT_BATCH_SIZE,
+    AGENT_SERVER_URL,
+    AGENT_TIMEOUT_SEC,
+    AGENT_TOKEN,
+    JOURNAL_MAX_ATTEMPTS,
+    JOURNAL_RETRY_SEC,
+    NAME_CACHE_SIZE,
+    NAME_CACHE_TTL_SEC,
+    SCAN_LOG_BATCH,
+    SCAN_LOG_FLUSH_SEC,
+    SCAN_LOG_QUEUE_MAX,
+    STATION_ID,
+)
+from .journal import OfflineJournal, get_journal
+from .logs import setup_logging
+from .scanlog import ScanEventWriter
+from .station import get_stations, start_scan_threads, start_stations
+
+
+class UplinkError(Exception):
+    """The central server could not be reached or answered 5xx (retry later)."""
+
+
+class Uplink:
+    """JSON over one persistent HTTP/1.1 keep-alive connection to the server.
+
+    Not thread-safe by design: each agent component owns its own Uplink, so a
+    slow batch upload never delays a name lookup. A request that fails on a
+    reused connection (server closed it while idle) is retried once on a
+    fresh one; anything else surfaces as ``UplinkError``.
+    """
+
+    def __init__(self, base_url: str, token: str = "", timeout: float = AGENT_TIMEOUT_SEC):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"AGENT_SERVER_URL が不正です: {base_url!r}")
+        self._cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._host = parts.hostname
+        self._port = parts.port
+        self._prefix = parts.path.rstrip("/")
+        self._headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        if token:
+            self._headers["Authorization"] = f"Bearer {token}"
+        self.timeout = timeout
+        self._conn: http.client.HTTPConnection | None = None
+        self.requests = 0
+        self.reconnects = 0
+
+    def request(self, method: str, path: str, payload: dict | None = None) -> dict:
+        body = None if payload is None else json.dumps(payload, ensure_ascii=False).encode()
+        for attempt in (1, 2):
+            fresh = self._conn is None
+            if fresh:
+                self._conn = self._cls(self._host, self._port, timeout=self.timeout)
+                self.reconnects += 1
+            try:
+                self._conn.request(method, self._prefix + path, body=body, headers=self._headers)
+                resp = self._conn.getresponse()
+                data = resp.read()
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                if fresh or attempt == 2:
+                    raise UplinkError(str(e)) from e
+                continue
+            self.requests += 1
+            if resp.will_close:
+                self.close()
+            try:
+                result = json.loads(data) if data else {}
+            except ValueError:
+                result = {"error": data[:200].decode(errors="replace")}
+            if resp.status >= 500:
+                raise UplinkError(f"HTTP {resp.status}: {result.get('error', '')}")
+            if resp.status >= 400:
+                raise ValueError(f"HTTP {resp.status}: {result.get('error', '')}")
+            return result
+        raise AssertionError("unreachable")
+
+    def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+
+class PairForwarder:
+    """Uploads journaled scan pairs to ``/api/agent/pairs`` in tap order.
+
+    Every pair goes to the station's SQLite journal first, so nothing is lost
+    while the server or network is down; the forwarder sends up to
+    ``batch_size`` pending pairs per request and removes them once the server
+    has answered. A pair the server rejects counts against it and is parked
+    in ``failed`` after ``max_attempts`` (like the DB replayer).
+    """
+
+    def __init__(
+        self,
+        journal: OfflineJournal,
+        uplink: Uplink,
+        batch_size: int = AGENT_BATCH_SIZE,
+        retry_sec: float = JOURNAL_RETRY_SEC,
+        max_attempts: int = JOURNAL_MAX_ATTEMPTS,
+    ):
+        self.journal = journal
+        self.uplink = uplink
+        self.batch_size = max(1, batch_size)
+        self.retry_sec = retry_sec
+        self.max_attempts = max_attempts
+        self.labels: dict[str, str] = {}  # idempotency key -> UI station label
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.server_reachable = True
+        self.batches = 0
+        self.sent = 0
+
+    def start(self) -> "PairForwarder":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def nudge(self) -> None:
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.retry_sec)
+            self._wakeup.clear()
+            self.forward_pending()
+
+    def forward_pending(self) -> int:
+        forwarded = 0
+        while True:
+            batch = self.journal.peek(self.batch_size)
+            if not batch:
+                return forwarded
+            pairs = [
+                {
+                    "idempotency_key": e["idempotency_key"],
+                    "user_uid": e["user_uid"],
+                    "tool_uid": e["tool_uid"],
+                    "station_id": e["station_id"],
+                    "scanned_at": e["scanned_at"].isoformat(),
+                    "label": self.labels.get(e["idempotency_key"]),
+                }
+                for e in batch
+            ]
+            try:
+                response = self.uplink.request("POST", "/api/agent/pairs", {"pairs": pairs})
+            except UplinkError as e:
+                if self.server_reachable:
+                    print(f"⚠️ 中央サーバーに送信できません（{len(batch)}件保留）: {e}")
+                self.server_reachable = False
+                return forwarded
+            except ValueError as e:
+                # Whole batch refused (auth/config): retry later, loudly
+                print(f"❌ 中央サーバーが受付を拒否: {e}")
+                self.server_reachable = False
+                return forwarded
+            self.server_reachable = True
+            self.batches += 1
+            errors = {r["key"]: r["error"] for r in response.get("results", []) if "error" in r}
+            done = {r["key"] for r in response.get("results", [])}
+            for entry in batch:
+                key = entry["idempotency_key"]
+                if key in errors:
+                    if self.journal.record_failure(entry["seq"], errors[key], self.max_attempts):
+                        print(f"❌ 取引の送信を断念: {key} ({errors[key]})")
+                    return forwarded  # keep tap order: nothing after it goes first
+                if key not in done:
+                    return forwarded
+                self.journal.remove(entry["seq"])
+                self.labels.pop(key, None)
+                forwarded += 1
+                self.sent += 1
+
+    def stats(self) -> dict:
+        return {
+            "server_reachable": self.server_reachable,
+            "batches": self.batches,
+            "sent": self.sent,
+            "requests": self.uplink.requests,
+            "reconnects": self.uplink.reconnects,
+            **self.journal.stats(),
+        }
+
+
+class EventRelay:
+    """Forwards UI events (scan_update, state_reset, error) to the server.
+
+    Has the ``emit(event, data)`` interface of a Socket.IO server so scan
+    stations can use it unchanged. Events are queued and sent in batches by a
+    daemon thread; they only matter while fresh, so a failed batch is dropped.
+    """
+
+    def __init__(self, uplink: Uplink, max_queue: int = 1000, batch_size: int = 50):
+        self.uplink = uplink
+        self.batch_size = batch_size
+        self._queue: queue.Queue[dict] = queue.Queue(maxsize=max_queue)
+        self._thread: threading.Thread | None = None
+        self.dropped = 0
+
+    def start(self) -> "EventRelay":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def emit(self, event: str, data: dict | None = None, **_kwargs) -> None:
+        try:
+            self._queue.put_nowait({"event": event, "data": data or {}})
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            events = [self._queue.get()]
+            while len(events) < self.batch_size:
+                try:
+                    events.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.uplink.request("POST", "/api/agent/emit", {"events": events})
+            except (UplinkError, ValueError):
+                self.dropped += len(events)
+
+
+class Agent:
+    """Station-side wiring: readers and scan stations, no database.
+
+    Scan pairs complete into the journal and are forwarded by
+    ``PairForwarder``; scan_events rows go through a ``ScanEventWriter``
+    whose flush posts to ``/api/agent/scans``; names come from the server
+    (cached) and fall back to the UID while it is unreachable.
+    """
+
+    def __init__(self, server_url: str = AGENT_SERVER_URL, token: str = AGENT_TOKEN):
+        if not server_url:
+            raise SystemExit("AGENT_SERVER_URL が未設定です（例: http://192.168.1.10:8501）")
+        self.relay = EventRelay(Uplink(server_url, token))
+        self.forwarder = PairForwarder(get_journal(), Uplink(server_url, token))
+        self._scan_uplink = Uplink(server_url, token)
+        self.scan_writer = ScanEventWriter(
+            self._post_scans,
+            max_queue=SCAN_LOG_QUEUE_MAX,
+            batch_size=SCAN_LOG_BATCH,
+            flush_interval=SCAN_LOG_FLUSH_SEC,
+        )
+        self._names_uplink = Uplink(server_url, token, timeout=min(AGENT_TIMEOUT_SEC, 1.0))
+        self._names_lock = threading.Lock()
+        self.names = TTLCache(NAME_CACHE_SIZE, NAME_CACHE_TTL_SEC)
+
+    def _post_scans(self, rows: list[tuple]) -> None:
+        payload = [[ts.isoformat(), sid, uid, role] for ts, sid, uid, role in rows]
+        self._scan_uplink.request("POST", "/api/agent/scans", {"rows": payload})
+
+    def lookup_name(self, kind: str, uid: str) -> str:
+        cached = self.names.get((kind, uid))
+        if cached is not MISSING:
+            return cached
+        try:
+            with self._names_lock:
+                name = self._names_uplink.request(
+                    "GET", "/api/agent/names?" + urlencode({"kind": kind, "uid": uid})
+                )["name"]
+        except (UplinkError, ValueError, KeyError):
+            return uid
+        self.names.set((kind, uid), name)
+        return name
+
+    def log_scan(self, uid: str, role: str | None, station_id: str) -> bool:
+        return self.scan_writer.submit(uid, role, station_id=station_id)
+
+    def complete(self, sio, user_uid: str, tool_uid: str, station_id: str, label: str) -> str:
+        key = uuid.uuid4().hex
+        self.forwarder.labels[key] = label
+        self.forwarder.journal.append(
+            key, user_uid, tool_uid, station_id, datetime.now(timezone.utc)
+        )
+        self.forwarder.nudge()
+        print(f"📤 送信待ちに追加: {tool_uid} / {user_uid}")
+        return "queued"
+
+    def complete_many(self, sio, pairs: list[tuple[str, str, str, str]]) -> list[str]:
+        # Already batched: the forwarder posts whatever is journaled at once
+        return [self.complete(sio, *pair) for pair in pairs]
+
+    def start(self) -> list[threading.Thread]:
+        for station in get_stations():
+            station.lookup_name = self.lookup_name
+            station.log_scan = self.log_scan
+            station.complete = self.complete
+            station.complete_many = self.complete_many
+        self.relay.start()
+        self.scan_writer.start()
+        self.forwarder.start().nudge()  # pairs left over from the last run
+        workers = start_scan_threads(sock=self.relay)
+        start_stations()
+        return workers
+
+
+def main() -> None:
+    setup_logging()
+    agent = Agent()
+    workers = agent.start()
+    print(f"📡 ステーションエージェント開始 ({STATION_ID}, リーダー{len(workers)}台) → {AGENT_SERVER_URL}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        agent.scan_writer.stop()
+
+
+if __name__ == "__main__":
+    main()
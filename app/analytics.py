@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import threading
+import time
+from datetime import date
+
+from .config import ANALYTICS_REFRESH_SEC, ANALYTICS_TZ, OVERDUE_AFTER_HOURS
+from .metrics import timed_query
+from .scheduler import PeriodicJob
+
+
+# pg_try_advisory_xact_lock key: one refresh at a time across all stations
+REFRESH_LOCK_ID = 7_262_002
+
+# Duration of a returned loan in seconds (NULL while open; aggregates skip it)
+_DURATION = "extract(epoch FROM l.returned_at - l.loaned_at)"
+
+_ROLLUP_COLUMNS = f"""
+    count(*),
+    count(l.returned_at),
+    COALESCE(sum({_DURATION}), 0),
+    percentile_cont(0.95) WITHIN GROUP (ORDER BY {_DURATION})
+"""
+
+
+# A bucket's overdue count is a snapshot at its end (or now, while it is
+# current): loans started before then, still open then, and past their due
+# time (per-tool-name limit, else OVERDUE_AFTER_HOURS). Open loans and loans
+# returned after the snapshot are read separately so each side uses an index.
+_OVERDUE_LOANS = """
+    SELECT b.bucket, b.at, l.*
+      FROM b JOIN loans_all l ON l.returned_at IS NULL AND l.loaned_at < b.at
+    UNION ALL
+    SELECT b.bucket, b.at, l.*
+      FROM b JOIN loans_all l
+        ON l.returned_at IS NOT NULL
+       AND COALESCE(l.returned_at, l.loaned_at) >= b.at
+       AND l.loaned_at < b.at
+"""
+
+
+def _rebuild(
+    cur, table: str, bucket: str, key_column: str, key: str, buckets: list,
+    since: str, until: str, tz: str | None = None,
+) -> None:
+    """Replace ``buckets`` of ``table`` with rows recomputed from ``loans_all``.
+
+    ``since`` / ``until`` are SQL for the bounds of bucket ``x``; ``key`` is
+    the expression over ``l`` stored in ``key_column``. Keys with overdue
+    loans but no loan started in the bucket get a row too.
+    """
+    bucket_type = "date" if bucket == "day" else "timestamptz"
+    cur.execute(f"DELETE FROM {table} WHERE {bucket} = ANY(%s)", (buckets,))
+    cur.execute(
+        f"""
+        WITH b AS (
+            SELECT x AS bucket, {since} AS since, {until} AS until,
+                   LEAST({until}, now()) AS at
+              FROM unnest(%(buckets)s::{bucket_type}[]) AS x
+        ), started(bucket, k, loans, returned, total_sec, p95_sec) AS (
+            SELECT b.bucket, {key}, {_ROLLUP_COLUMNS}
+              FROM b JOIN loans_all l ON l.loaned_at >= b.since AND l.loaned_at < b.until
+          GROUP BY b.bucket, {key}
+        ), overdue(bucket, k, n) AS (
+            SELECT l.bucket, {key}, count(*)
+              FROM ({_OVERDUE_LOANS}) l
+         LEFT JOIN tools t ON t.uid=l.tool_uid
+         LEFT JOIN tool_master m ON m.name=t.name
+             WHERE l.loaned_at + COALESCE(m.loan_limit_hours, %(after)s) * interval '1 hour' < l.at
+          GROUP BY l.bucket, {key}
+        )
+        INSERT INTO {table}({bucket}, {key_column}, loans, returned, total_sec, p95_sec, overdue)
+        SELECT COALESCE(s.bucket, o.bucket), COALESCE(s.k, o.k),
+               COALESCE(s.loans, 0), COALESCE(s.returned, 0), COALESCE(s.total_sec, 0),
+               s.p95_sec, COALESCE(o.n, 0)
+          FROM started s FULL JOIN overdue o ON o.bucket = s.bucket AND o.k = s.k
+        """,
+        {"buckets": buckets, "tz": tz, "after": OVERDUE_AFTER_HOURS},
+    )
+
+
+@timed_query("refresh_rollups")
+def refresh_rollups(conn, tz: str = ANALYTICS_TZ) -> dict:
+    """Recompute the rollup buckets touched since the last refresh.
+
+    process_scan_pair marks the loan-start hour of every loan it changes in
+    stats_dirty_hours; only those hours (station/hour) and the days that
+    contain them (tool/day, user/day) are rebuilt from ``loans_all`` (loans
+    plus loans_archive), via range scans on loaned_at. The current and the
+    previous hour are always rebuilt too, so each bucket's overdue snapshot
+    (loans open past their due time at its end) follows the clock even when
+    nothing is scanned. A dirty mark is cleared only if it was not bumped
+    again while the refresh ran, so concurrent scans are never lost.
+    """
+    started = time.perf_counter()
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (REFRESH_LOCK_ID,))
+        if not cur.fetchone()[0]:
+            return {"skipped": True, "hours": 0, "days": 0, "ms": 0.0}
+        cur.execute("SELECT hour, changes FROM stats_dirty_hours")
+        dirty = cur.fetchall()
+        cur.execute(
+            """
+            SELECT array_agg(DISTINCT h), array_agg(DISTINCT (h AT TIME ZONE %s)::date)
+              FROM (SELECT unnest(%s::timestamptz[])
+                    UNION SELECT date_trunc('hour', now()) - interval '1 hour'
+                    UNION SELECT date_trunc('hour', now())) AS t(h)
+            """,
+            (tz, [h for h, _changes in dirty]),
+        )
+        hours, days = cur.fetchone()
+
+        _rebuild(
+            cur, "stats_station_hourly", "hour", "station_id", "COALESCE(l.station_id, '')",
+            hours, since="x", until="x + interval '1 hour'",
+        )
+        for table, key in (("stats_tool_daily", "tool_uid"), ("stats_user_daily", "borrower_uid")):
+            _rebuild(
+                cur, table, "day", key, f"l.{key}", days,
+                since="x::timestamp AT TIME ZONE %(tz)s",
+                until="(x + 1)::timestamp AT TIME ZONE %(tz)s",
+                tz=tz,
+            )
+
+        cur.execute(
+            """
+            DELETE FROM stats_dirty_hours s
+             USING unnest(%s::timestamptz[], %s::bigint[]) AS seen(hour, changes)
+             WHERE s.hour = seen.hour AND s.changes = seen.changes
+            """,
+            ([h for h, _c in dirty], [c for _h, c in dirty]),
+        )
+    return {
+        "skipped": False,
+        "hours": len(hours),
+        "days": len(days),
+        "ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def _ranked(conn, table: str, key: str, names_sql: str, since: date, until: date, limit: int):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT s.{key}, COALESCE(({names_sql}), upper(encode(s.{key}, 'hex'))),
+                   sum(s.loans), sum(s.returned), sum(s.total_sec), max(s.p95_sec),
+                   count(*) FILTER (WHERE s.overdue > 0), max(s.overdue)
+              FROM {table} s
+             WHERE s.day >= %s AND s.day < %s
+          GROUP BY s.{key}
+          ORDER BY sum(s.loans) DESC, s.{key}
+             LIMIT %s
+            """,
+            (since, until, limit),
+        )
+        return cur.fetchall()
+
+
+def _serialize_ranked(rows, key: str) -> list[dict]:
+    return [
+        {
+            key: r[0],
+            "name": r[1],
+            "loans": r[2],
+            "returned": r[3],
+            "total_sec": r[4],
+            "avg_sec": r[4] / r[3] if r[3] else None,
+            # Percentiles don't add up across days: the worst daily p95
+            "p95_sec_max": r[5],
+            # Days that ended with a loan of this key overdue, and the most at once
+            "overdue_days": r[6],
+            "overdue_max": r[7],
+        }
+        for r in rows
+    ]
+
+
+def tool_stats(conn, since: date, until: date, limit: int = 50) -> list[dict]:
+    """Most-borrowed tools in [since, until) with borrow durations."""
+    rows = _ranked(
+        conn, "stats_tool_daily", "tool_uid",
+        "SELECT name FROM tools WHERE uid=s.tool_uid", since, until, limit,
+    )
+    return _serialize_ranked(rows, "tool_uid")
+
+
+def user_stats(conn, since: date, until: date, limit: int = 50) -> list[dict]:
+    """Most active borrowers in [since, until)."""
+    rows = _ranked(
+        conn, "stats_user_daily", "borrower_uid",
+        "SELECT full_name FROM users WHERE uid=s.borrower_uid", since, until, limit,
+    )
+    return _serialize_ranked(rows, "borrower_uid")
+
+
+def station_stats(
+    conn, since: date, until: date, station: str | None = None, tz: str = ANALYTICS_TZ
+) -> list[dict]:
+    """Hourly loans and end-of-hour overdue per station in [since, until) (``tz`` days)."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT hour, station_id, loans, returned, total_sec, p95_sec, overdue
+              FROM stats_station_hourly
+             WHERE hour >= %(since)s::timestamp AT TIME ZONE %(tz)s
+               AND hour < %(until)s::timestamp AT TIME ZONE %(tz)s
+               AND (%(station)s::text IS NULL OR station_id = %(station)s)
+          ORDER BY hour, station_id
+            """,
+            {"since": since, "until": until, "tz": tz, "station": station},
+        )
+        rows = cur.fetchall()
+    return [
+        {
+            "hour": r[0].isoformat(),
+            "station_id": r[1],
+            "loans": r[2],
+            "returned": r[3],
+            "total_sec": r[4],
+            "p95_sec": r[5],
+            "overdue": r[6],
+        }
+        for r in rows
+    ]
+
+
+def daily_totals(conn, since: date, until: date) -> list[dict]:
+    """Loans started per day across all tools (chart series)."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT day, sum(loans), sum(returned), sum(total_sec), max(p95_sec), sum(overdue)
+              FROM stats_tool_daily
+             WHERE day >= %s AND day < %s
+          GROUP BY day ORDER BY day
+            """,
+            (since, until),
+        )
+        rows = cur.fetchall()
+    return [
+        {
+            "day": r[0].isoformat(),
+            "loans": r[1],
+            "returned": r[2],
+            "total_sec": r[3],
+            "p95_sec_max": r[4],
+            # Loans open past their due time at the end of the day
+            "overdue": r[5],
+        }
+        for r in rows
+    ]
+
+
+def overdue_summary(conn, after_hours: float = OVERDUE_AFTER_HOURS) -> dict:
+    """Open and overdue loan counts (per-tool-name limits), live from open loans."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT count(*),
+                   count(*) FILTER (
+                       WHERE l.loaned_at < now()
+                             - COALESCE(m.loan_limit_hours, %s) * interval '1 hour'
+                   )
+              FROM loans l
+         LEFT JOIN tools t ON t.uid=l.tool_uid
+         LEFT JOIN tool_master m ON m.name=t.name
+             WHERE l.returned_at IS NULL
+            """,
+            (after_hours,),
+        )
+        open_now, overdue_now = cur.fetchone()
+        cur.execute("SELECT count(*), min(hour) FROM stats_dirty_hours")
+        pending_hours, oldest_pending = cur.fetchone()
+    return {
+        "open_now": open_now,
+        "overdue_now": overdue_now,
+        "overdue_after_hours": after_hours,
+        "pending_hours": pending_hours,
+        "oldest_pending_hour": oldest_pending.isoformat() if oldest_pending else None,
+    }
+
+
+def _refresh_with_pool() -> dict:
+    from .db import get_conn
+
+    with get_conn() as conn:
+        return refresh_rollups(conn)
+
+
+_refresher: PeriodicJob | None = None
+_refresher_lock = threading.Lock()
+
+
+def get_refresher() -> PeriodicJob:
+    """Process-wide rollup refresh job (thread started by main.run)."""
+    global _refresher
+    if _refresher is None:
+        with _refresher_lock:
+            if _refresher is None:
+                _refresher = PeriodicJob("集計の更新", _refresh_with_pool, ANALYTICS_REFRESH_SEC)
+    return _refresher
@@ -1,167 +1,259 @@
 from __future__ import annotations
 
+import json
 import threading
-import time
+import uuid
+from datetime import datetime, timezone
 
 from flask_socketio import SocketIO
 
 from . import socketio as socketio_ext
-from .config import SCAN_DEBOUNCE_SEC, SCAN_POLL_TIMEOUT_SEC
+from .cache import MISSING, tool_names, user_names
+from .config import STATION_ID
 from .db import (
-    borrow_or_return,
-    fetch_open_loans,
-    fetch_recent_history,
+    DB_OUTAGE_ERRORS,
     get_conn,
-    insert_scan,
+    is_db_outage,
+    loan_delta,
     name_of_tool,
     name_of_user,
+    process_scan_pair,
+    process_scan_pairs,
 )
-from .nfc import read_one_uid
+from .journal import JournalReplayer, get_journal
+from .nfc import FakeReader, get_session
+from .scanlog import get_scan_writer
+from .station import (
+    WAITING_MESSAGE,
+    reset_stations,
+    scanner_here,
+    start_stations,
+    stop_stations,
+)
+
+
+# NOTIFY channel carrying start/stop/reset (and fake taps) from web processes
+# to the process that owns the readers (see app.scanner).
+# Payload: {"cmd": "start"|"stop"|"reset"|"tap", "message": ..., "reader": ..., "uid": ...,
+#           "scanner": <lock key of the target host, see app.scanner>}
+SCAN_CONTROL_CHANNEL = "scan_control"
+
+
+def apply_scan_control(payload: str) -> None:
+    """Run a scan-control command in the scanning process."""
+    data = json.loads(payload)
+    cmd = data.get("cmd")
+    message = data.get("message") or ""
+    if cmd == "start":
+        start_stations(message or WAITING_MESSAGE)
+    elif cmd == "stop":
+        stop_stations(message)
+    elif cmd == "reset":
+        reset_stations(message)
+    elif cmd == "tap":
+        reader = get_session(data.get("reader") or None).reader
+        if isinstance(reader, FakeReader) and data.get("uid"):
+            reader.tap(data["uid"])
+    else:
+        print(f"⚠️ 不明なスキャン制御コマンド: {cmd!r}")
+
+
+def scan_control(cmd: str, **fields) -> None:
+    """Apply a scan-control command here, or hand it to the scanner process."""
+    payload = json.dumps({"cmd": cmd, **fields}, ensure_ascii=False)
+    if scanner_here():
+        apply_scan_control(payload)
+        return
+    from .scanner import SCANNER_KEY_SQL, scanner_key_params
+
+    # addressed to this host's scanner: other kiosks on the DB ignore it
+    with get_conn() as conn, conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT pg_notify(%s, jsonb_set(%s::jsonb, '{scanner}', "
+            f"to_jsonb({SCANNER_KEY_SQL}))::text)",
+            (SCAN_CONTROL_CHANNEL, payload, *scanner_key_params()),
+        )
 
 
-scan_state = {
-    "active": False,
-    "user_uid": "",
-    "tool_uid": "",
-    "last_scanned_uid": "",
-    "last_scan_time": 0.0,
-    "message": "",
-}
+def _log_scan(uid: str, role: str | None, station_id: str) -> bool:
+    return get_scan_writer().submit(uid, role, station_id=station_id)
 
 
-def scan_monitor(sock: SocketIO | None = None):
-    """Background NFC scan loop.
+def lookup_name(kind: str, uid: str) -> str:
+    """UID -> name from the cache; falls back to the UID while the DB is down."""
+    cached = (user_names if kind == "user" else tool_names).get(uid)
+    if cached is not MISSING:
+        return cached or uid
+    try:
+        with get_conn() as conn:
+            return name_of_user(conn, uid) if kind == "user" else name_of_tool(conn, uid)
+    except DB_OUTAGE_ERRORS:
+        return uid
 
-    Emits Socket.IO events to update UI.
+
+def _complete_transaction(
+    sio, user_uid: str, tool_uid: str, station_id: str = STATION_ID, label: str = STATION_ID
+) -> str:
+    """Borrow/return for a scan pair; journals it locally if the DB is unreachable.
+
+    Returns the action: "borrow", "return", "queued" (journaled) or
+    "duplicate" (same pair again within PAIR_DEDUP_SEC; nothing changed).
+
+    ``station_id`` identifies the reader that read the tool, ``label`` the
+    station shown in Socket.IO payloads.
     """
-    sio = sock or socketio_ext
-    global scan_state
+    scanned_at = datetime.now(timezone.utc)
+    key = uuid.uuid4().hex
+    result = None
+    # While older pairs wait in the journal, new ones queue behind them:
+    # loans toggle, so replay order must match tap order
+    if get_journal().depth() == 0:
+        try:
+            with get_conn() as conn:
+                result = process_scan_pair(
+                    conn, user_uid, tool_uid, station_id=station_id, idempotency_key=key
+                )
+        except DB_OUTAGE_ERRORS as e:
+            print(f"⚠️ DB接続不可のためオフライン記録に切替: {e}")
 
-    while True:
-        if not scan_state["active"]:
-            time.sleep(0.5)
-            continue
+    if result is None:
+        return _journal_pair(sio, key, user_uid, tool_uid, station_id, label, scanned_at)
 
+    announce_transaction(sio, result, user_uid, tool_uid, station_id, label)
+    return "duplicate" if result["duplicate"] else result["action"]
+
+
+def _complete_transactions(sio, pairs: list[tuple[str, str, str, str]]) -> list[str]:
+    """_complete_transaction for a batch of session taps, in one transaction.
+
+    ``pairs`` are ``(user_uid, tool_uid, station_id, label)`` in tap order;
+    returns one action per pair. If the DB is unreachable (or the journal
+    is not empty) the whole batch is journaled, keeping tap order.
+    """
+    scanned_at = datetime.now(timezone.utc)
+    keys = [uuid.uuid4().hex for _ in pairs]
+    results = None
+    if get_journal().depth() == 0:
         try:
-            uid = read_one_uid(timeout=int(SCAN_POLL_TIMEOUT_SEC))
-            if uid:
-                # Debounce same UID for a short period
-                now = time.time()
-                if (
-                    uid == scan_state["last_scanned_uid"]
-                    and (now - scan_state["last_scan_time"]) < SCAN_DEBOUNCE_SEC
-                ):
-                    continue
-
-                scan_state["last_scanned_uid"] = uid
-                scan_state["last_scan_time"] = now
-
-                conn = get_conn()
-                try:
-                    if not scan_state["user_uid"]:
-                        scan_state["user_uid"] = uid
-                        scan_state["message"] = (
-                            f"👤 ユーザー読取: {name_of_user(conn, uid)} ({uid})"
-                        )
-                        insert_scan(conn, uid, "user")
-
-                        sio.emit(
-                            "scan_update",
-                            {
-                                "user_uid": scan_state["user_uid"],
-                                "user_name": name_of_user(conn, uid),
-                                "tool_uid": scan_state["tool_uid"],
-                                "tool_name": "",
-                                "message": scan_state["message"],
-                            },
-                        )
+            with get_conn() as conn:
+                results = process_scan_pairs(
+                    conn,
+                    [
+                        {"user_uid": u, "tool_uid": t, "station_id": sid, "idempotency_key": key}
+                        for (u, t, sid, _label), key in zip(pairs, keys)
+                    ],
+                )
+        except DB_OUTAGE_ERRORS as e:
+            print(f"⚠️ DB接続不可のためオフライン記録に切替: {e}")
+
+    if results is None:
+        return [
+            _journal_pair(sio, key, u, t, sid, label, scanned_at)
+            for (u, t, sid, label), key in zip(pairs, keys)
+        ]
+    actions = []
+    for (u, t, sid, label), result in zip(pairs, results):
+        announce_transaction(sio, result, u, t, sid, label)
+        actions.append("duplicate" if result["duplicate"] else result["action"])
+    return actions
+
+
+def _journal_pair(
+    sio, key: str, user_uid: str, tool_uid: str, station_id: str, label: str, scanned_at
+) -> str:
+    """Keep a scan pair in the offline journal and tell the screen so."""
+    journal = get_journal()
+    journal.append(key, user_uid, tool_uid, station_id, scanned_at)
+    get_replayer(sio).nudge()
+    user_name = lookup_name("user", user_uid)
+    tool_name = lookup_name("tool", tool_uid)
+    message = f"📝 オフライン記録：{tool_name} / {user_name}（DB復旧後に反映）"
+    sio.emit(
+        "transaction_complete",
+        {
+            "station_id": label,
+            "user_uid": user_uid,
+            "user_name": user_name,
+            "tool_uid": tool_uid,
+            "tool_name": tool_name,
+            "message": message,
+            "action": "queued",
+        },
+    )
+    print(f"📝 オフライン記録（待ち {journal.depth()}件）: {tool_uid} / {user_uid}")
+    return "queued"
+
+
+def announce_transaction(
+    sio, result: dict, user_uid: str, tool_uid: str, station_id: str, label: str
+) -> None:
+    """Emit ``transaction_complete`` and ``loan_delta`` for a processed scan pair."""
+    action = result["action"]
+    if result["duplicate"]:
+        done = "貸出" if action == "borrow" else "返却"
+        message = f"⏭️ 処理済み：{result['tool_name']} は直前に{done}されています（二重タップ）"
+        action = "duplicate"
+    elif action == "borrow":
+        message = f"✅ 貸出：{result['tool_name']} → {result['user_name']}"
+    else:
+        message = (
+            f"✅ 返却：{result['tool_name']} by {result['user_name']}"
+            f"（借用者: {result['prev_user_name']}）"
+        )
+
+    sio.emit(
+        "transaction_complete",
+        {
+            "station_id": label,
+            "user_uid": user_uid,
+            "user_name": result["user_name"],
+            "tool_uid": tool_uid,
+            "tool_name": result["tool_name"],
+            "message": message,
+            "action": action,
+        },
+    )
+    # Dashboards patch their tables from the delta
+    # instead of re-fetching full snapshots
+    if not result["duplicate"]:
+        sio.emit("loan_delta", loan_delta(result, station_id))
 
-                    elif not scan_state["tool_uid"]:
-                        scan_state["tool_uid"] = uid
-                        scan_state["message"] = (
-                            f"🛠️ 工具読取: {name_of_tool(conn, uid)} ({uid})"
+    print(f"✅ 処理完了: {message}")
+
+
+_replayer: JournalReplayer | None = None
+_replayer_lock = threading.Lock()
+
+
+def get_replayer(sock: SocketIO | None = None) -> JournalReplayer:
+    """Process-wide journal replayer (started on first use)."""
+    global _replayer
+    if _replayer is None:
+        with _replayer_lock:
+            if _replayer is None:
+                sio = sock or socketio_ext
+
+                def _process(entry: dict) -> dict:
+                    with get_conn() as conn:
+                        return process_scan_pair(
+                            conn,
+                            entry["user_uid"],
+                            entry["tool_uid"],
+                            station_id=entry["station_id"],
+                            idempotency_key=entry["idempotency_key"],
+                            scanned_at=entry["scanned_at"],
                         )
-                        insert_scan(conn, uid, "tool")
-
-                        try:
-                            action, info = borrow_or_return(
-                                conn, scan_state["user_uid"], scan_state["tool_uid"]
-                            )
-                            open_loans = [
-                                {
-                                    "tool": row[0],
-                                    "borrower": row[1],
-                                    "loaned_at": row[2].isoformat(),
-                                }
-                                for row in fetch_open_loans(conn)
-                            ]
-                            history = [
-                                {
-                                    "action": row[0],
-                                    "tool": row[1],
-                                    "borrower": row[2],
-                                    "loaned_at": row[3].isoformat(),
-                                    "returned_at": row[4].isoformat() if row[4] else None,
-                                }
-                                for row in fetch_recent_history(conn)
-                            ]
-                            if action == "borrow":
-                                message = (
-                                    f"✅ 貸出：{name_of_tool(conn, scan_state['tool_uid'])} → "
-                                    f"{name_of_user(conn, scan_state['user_uid'])}"
-                                )
-                            else:
-                                message = (
-                                    f"✅ 返却：{name_of_tool(conn, scan_state['tool_uid'])} by "
-                                    f"{name_of_user(conn, scan_state['user_uid'])}"
-                                    f"（借用者: {name_of_user(conn, info.get('prev_user', ''))}）"
-                                )
-
-                            sio.emit(
-                                "transaction_complete",
-                                {
-                                    "user_uid": scan_state["user_uid"],
-                                    "user_name": name_of_user(conn, scan_state["user_uid"]),
-                                    "tool_uid": scan_state["tool_uid"],
-                                    "tool_name": name_of_tool(conn, scan_state["tool_uid"]),
-                                    "message": message,
-                                    "action": action,
-                                    "open_loans": open_loans,
-                                    "history": history,
-                                },
-                            )
-
-                            print(f"✅ 処理完了: {message}")
-
-                            def _reset():
-                                time.sleep(3)
-                                scan_state["user_uid"] = ""
-                                scan_state["tool_uid"] = ""
-                                scan_state["last_scanned_uid"] = ""
-                                scan_state["last_scan_time"] = 0.0
-                                scan_state["message"] = (
-                                    "📡 スキャン待機中... ユーザータグをかざしてください"
-                                )
-                                sio.emit("state_reset", {"message": scan_state["message"]})
-                                print("🔄 次の処理待ち")
-
-                            threading.Thread(target=_reset, daemon=True).start()
-                        except Exception as e:  # noqa: BLE001
-                            error_msg = f"❌ エラー: {e}"
-                            print(error_msg)
-                            sio.emit("error", {"message": error_msg})
-                finally:
-                    conn.close()
-
-        except Exception as e:  # noqa: BLE001
-            if "Time-out" not in str(e) and "Command timeout" not in str(e):
-                print(f"スキャンループエラー: {e}")
-            time.sleep(1)
-
-        time.sleep(0.1)
-
-
-def start_scan_thread(sock: SocketIO | None = None) -> threading.Thread:
-    t = threading.Thread(target=scan_monitor, kwargs={"sock": sock}, daemon=True)
-    t.start()
-    return t
+
+                def _replayed(entry: dict, result: dict) -> None:
+                    label = "重複" if result["duplicate"] else result["action"]
+                    print(
+                        f"🔁 オフライン記録を反映 ({label}): "
+                        f"{result['tool_name']} / {result['user_name']}"
+                    )
+                    if not result["duplicate"]:
+                        sio.emit("loan_delta", loan_delta(result, entry["station_id"]))
+
+                _replayer = JournalReplayer(
+                    get_journal(), _process, is_db_outage, on_replayed=_replayed
+                ).start()
+    return _replayer
@@ -0,0 +1,360 @@
+"""Bulk import/export of users, tools and tool_master.
+
+    python -m app.bulk import users badges.csv [--dry-run]
+    python -m app.bulk import tools tools.json --batch-size 5000
+    python -m app.bulk export tools -o tools.csv
+
+CSV files have a header row (``uid,full_name`` / ``uid,name`` / ``name``);
+JSON is an array of objects or one object per line. Rows are validated one by
+one (missing fields, malformed UIDs, duplicates within the file, tool names
+not in tool_master) and written with one multi-row upsert and one transaction
+per batch, so a bad row is reported without aborting the import.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import sys
+from typing import IO, Iterable, Iterator
+
+from psycopg2.extras import execute_values
+
+from .cache import NAME_CACHE_CHANNEL, clear_names
+from .config import BULK_BATCH_SIZE, NAME_CACHE_NOTIFY
+from .db import bump_versions, connect, ensure_tables
+from .uid import Uid
+
+
+# kind -> (columns, upsert SQL for execute_values, version to bump, COPY query)
+KINDS: dict[str, tuple[tuple[str, ...], str, str, str]] = {
+    "users": (
+        ("uid", "full_name"),
+        """
+        INSERT INTO users(uid, full_name) VALUES %s
+        ON CONFLICT(uid) DO UPDATE SET full_name=EXCLUDED.full_name
+        """,
+        "users",
+        "SELECT upper(encode(uid, 'hex')) AS uid, full_name FROM users ORDER BY uid",
+    ),
+    "tools": (
+        ("uid", "name"),
+        """
+        INSERT INTO tools(uid, name) VALUES %s
+        ON CONFLICT(uid) DO UPDATE SET name=EXCLUDED.name
+        """,
+        "tools",
+        "SELECT upper(encode(uid, 'hex')) AS uid, name FROM tools ORDER BY uid",
+    ),
+    "tool_names": (
+        ("name",),
+        "INSERT INTO tool_master(name) VALUES %s ON CONFLICT(name) DO NOTHING",
+        "tool_names",
+        "SELECT name FROM tool_master ORDER BY name",
+    ),
+}
+
+FORMATS = ("csv", "json")
+
+
+def guess_format(filename: str | None, default: str = "csv") -> str:
+    if filename and filename.lower().endswith((".json", ".jsonl", ".ndjson")):
+        return "json"
+    if filename and filename.lower().endswith(".csv"):
+        return "csv"
+    return default
+
+
+_JSON_CHUNK = 64 * 1024
+
+
+def read_records(stream: IO[str], fmt: str) -> Iterator[dict]:
+    """Records from a CSV (with header) or JSON (array or lines) text stream.
+
+    Both are read incrementally, so the file is never held in memory as a
+    whole. Malformed input raises ValueError.
+    """
+    if fmt == "csv":
+        try:
+            yield from csv.DictReader(stream)
+        except csv.Error as e:
+            raise ValueError(f"CSV の形式が不正です: {e}") from None
+        return
+    if fmt != "json":
+        raise ValueError(f"unknown format: {fmt!r}")
+    first = ""
+    while not first:
+        line = stream.readline()
+        if not line:
+            return
+        first = line.strip()
+    if first.startswith("["):
+        yield from _iter_json_array(stream, first[1:])
+        return
+    yield json.loads(first)
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _iter_json_array(stream: IO[str], buf: str) -> Iterator:
+    """Elements of a JSON array whose ``[`` was already consumed, one by one."""
+    decoder = json.JSONDecoder()
+    eof = False
+    first = True  # nothing read yet: "]" closes an empty array
+    expect_value = True  # after "[" or ","
+    while True:
+        buf = buf.lstrip()
+        if not buf or (expect_value and not eof and len(buf) < _JSON_CHUNK // 2):
+            # Keep at least half a chunk ahead so an element is rarely split
+            chunk = "" if eof else stream.read(_JSON_CHUNK)
+            eof = not chunk
+            if not buf and eof:
+                raise ValueError("JSON 配列が閉じられていません")
+            buf += chunk
+            continue
+        if buf[0] == "]" and (first or not expect_value):
+            return
+        if expect_value:
+            try:
+                value, end = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = stream.read(_JSON_CHUNK)  # element split across chunks
+                eof = not chunk
+                buf += chunk
+                continue
+            yield value
+            buf = buf[end:]
+            first = expect_value = False
+        elif buf[0] == ",":
+            buf = buf[1:]
+            expect_value = True
+        else:
+            raise ValueError(f"JSON 配列の区切りが不正です: {buf[:20]!r}")
+
+
+class BulkImport:
+    """Validates records and upserts them in batches for one ``kind``."""
+
+    def __init__(
+        self, conn, kind: str, dry_run: bool = False, batch_size: int = BULK_BATCH_SIZE
+    ):
+        if kind not in KINDS:
+            raise ValueError(f"unknown kind: {kind!r} (users / tools / tool_names)")
+        self.conn = conn
+        self.kind = kind
+        self.columns, self._sql, self._version, _ = KINDS[kind]
+        self.dry_run = dry_run
+        self.batch_size = max(1, batch_size)
+        self.total = 0
+        self.valid = 0
+        self.written = 0
+        self.batches = 0
+        self.errors: list[dict] = []
+        self._seen: dict[str, int] = {}
+        self._tool_names: set[str] | None = None
+        if kind == "tools":
+            with conn.cursor() as cur:
+                cur.execute("SELECT name FROM tool_master")
+                self._tool_names = {r[0] for r in cur.fetchall()}
+            conn.rollback()
+
+    def _validate(self, line: int, record) -> tuple | None:
+        if not isinstance(record, dict):
+            self.errors.append({"row": line, "error": "オブジェクトではありません"})
+            return None
+        if self.kind == "users" and "full_name" not in record and "name" in record:
+            record = {**record, "full_name": record["name"]}  # same key as register_user
+        values = []
+        for col in self.columns:
+            value = record.get(col)
+            value = value.strip() if isinstance(value, str) else value
+            if not value:
+                self.errors.append({"row": line, "error": f"{col} は必須です"})
+                return None
+            if not isinstance(value, str):
+                self.errors.append({"row": line, "error": f"{col} は文字列で指定してください"})
+                return None
+            values.append(value)
+        if self.kind != "tool_names":
+            try:
+                # Canonical form, so "04:a1:..." and "04A1..." are one tag
+                values[0] = Uid(values[0])
+            except ValueError as e:
+                self.errors.append({"row": line, "error": str(e)})
+                return None
+        key = values[0]
+        if key in self._seen:
+            self.errors.append(
+                {"row": line, "error": f"{self.columns[0]} '{key}' が重複しています（{self._seen[key]}行目）"}
+            )
+            return None
+        self._seen[key] = line
+        if self._tool_names is not None and values[1] not in self._tool_names:
+            self.errors.append({"row": line, "error": f"工具名 '{values[1]}' が工具名マスタにありません"})
+            return None
+        return tuple(values)
+
+    def _flush(self, batch: list[tuple[int, tuple]]) -> None:
+        if not batch or self.dry_run:
+            return
+        try:
+            with self.conn, self.conn.cursor() as cur:
+                execute_values(cur, self._sql, [values for _line, values in batch], page_size=len(batch))
+                bump_versions(cur, self._version)
+                if self.kind != "tool_names" and NAME_CACHE_NOTIFY:
+                    cur.execute("SELECT pg_notify(%s, '*')", (NAME_CACHE_CHANNEL,))
+        except Exception as e:  # noqa: BLE001
+            # The whole batch rolled back: report it row by row
+            message = str(e).strip().splitlines()[0]
+            self.errors.extend({"row": line, "error": message} for line, _values in batch)
+            self.valid -= len(batch)
+            return
+        self.written += len(batch)
+        self.batches += 1
+
+    def run(self, records: Iterable) -> dict:
+        batch: list[tuple[int, tuple]] = []
+        # Line numbers count data rows from 1 (CSV: the row after the header)
+        for line, record in enumerate(records, start=1):
+            self.total += 1
+            values = self._validate(line, record)
+            if values is None:
+                continue
+            self.valid += 1
+            batch.append((line, values))
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        self._flush(batch)
+        if self.written and self.kind != "tool_names":
+            clear_names()
+        return self.summary()
+
+    def summary(self) -> dict:
+        return {
+            "kind": self.kind,
+            "dry_run": self.dry_run,
+            "total": self.total,
+            "valid": self.valid,
+            "written": self.written,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+
+def import_records(
+    conn, kind: str, records: Iterable, dry_run: bool = False, batch_size: int = BULK_BATCH_SIZE
+) -> dict:
+    return BulkImport(conn, kind, dry_run=dry_run, batch_size=batch_size).run(records)
+
+
+def export_csv(conn, kind: str, out: IO[bytes]) -> None:
+    """Write ``kind`` as CSV with header via COPY (one round trip)."""
+    if kind not in KINDS:
+        raise ValueError(f"unknown kind: {kind!r} (users / tools / tool_names)")
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY ({KINDS[kind][3]}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+    conn.rollback()
+
+
+def export_csv_chunks(conn, kind: str, itersize: int = BULK_BATCH_SIZE) -> Iterator[str]:
+    """Yield ``kind`` as CSV with header, ``itersize`` rows at a time.
+
+    For streaming over HTTP: rows come from a server-side cursor, so memory
+    stays flat however large the table (``export_csv`` is one COPY, for files).
+    """
+    if kind not in KINDS:
+        raise ValueError(f"unknown kind: {kind!r} (users / tools / tool_names)")
+    columns, _sql, _version, query = KINDS[kind]
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(columns)
+    with conn.cursor(name=f"bulk_csv_{kind}") as cur:
+        cur.itersize = itersize
+        cur.execute(query)
+        while True:
+            rows = cur.fetchmany(itersize)
+            writer.writerows(rows)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            if not rows:
+                break
+    conn.rollback()
+
+
+def export_json(conn, kind: str, itersize: int = BULK_BATCH_SIZE) -> Iterator[str]:
+    """Yield a JSON array of ``kind`` in chunks, reading with a server-side cursor."""
+    if kind not in KINDS:
+        raise ValueError(f"unknown kind: {kind!r} (users / tools / tool_names)")
+    columns, _sql, _version, query = KINDS[kind]
+    with conn.cursor(name=f"bulk_export_{kind}") as cur:
+        cur.itersize = itersize
+        cur.execute(query)
+        yield "["
+        sep = ""
+        for row in cur:
+            yield sep + json.dumps(dict(zip(columns, row)), ensure_ascii=False)
+            sep = ",\n"
+        yield "]\n"
+    conn.rollback()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.bulk", description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    imp = sub.add_parser("import", help="CSV/JSON を取り込む")
+    imp.add_argument("kind", choices=sorted(KINDS))
+    imp.add_argument("path", help="入力ファイル（- で標準入力）")
+    imp.add_argument("--format", choices=FORMATS)
+    imp.add_argument("--dry-run", action="store_true", help="検証のみ（書き込まない）")
+    imp.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+
+    exp = sub.add_parser("export", help="CSV/JSON で書き出す")
+    exp.add_argument("kind", choices=sorted(KINDS))
+    exp.add_argument("-o", "--output", default="-", help="出力ファイル（既定: 標準出力）")
+    exp.add_argument("--format", choices=FORMATS)
+
+    args = parser.parse_args(argv)
+    ensure_tables()
+    conn = connect()
+    try:
+        if args.command == "import":
+            fmt = args.format or guess_format(args.path)
+            stream = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8-sig", newline="")
+            with stream:
+                result = import_records(
+                    conn, args.kind, read_records(stream, fmt),
+                    dry_run=args.dry_run, batch_size=args.batch_size,
+                )
+            for err in result["errors"]:
+                print(f"❌ {err['row']}行目: {err['error']}", file=sys.stderr)
+            label = "検証" if args.dry_run else "取込"
+            print(
+                f"📥 {args.kind} {label}: {result['total']}件中 有効 {result['valid']}件 / "
+                f"書込 {result['written']}件（{result['batches']}バッチ） / エラー {len(result['errors'])}件",
+                file=sys.stderr,
+            )
+            return 1 if result["errors"] else 0
+
+        fmt = args.format or guess_format(args.output)
+        out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        with out:
+            if fmt == "csv":
+                export_csv(conn, args.kind, out)
+            else:
+                for chunk in export_json(conn, args.kind):
+                    out.write(chunk.encode())
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
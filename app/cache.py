@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from .config import NAME_CACHE_SIZE, NAME_CACHE_TTL_SEC
+
+
+MISSING = object()
+
+# PostgreSQL NOTIFY channel used to keep name caches coherent across stations.
+# Payload: "user:<uid>" / "tool:<uid>" / "*" (drop everything)
+NAME_CACHE_CHANNEL = "name_cache"
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire ``ttl`` seconds after insertion."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 600.0):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires = item
+            if self.ttl and expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+# UID -> registered name (None = known to be unregistered)
+user_names = TTLCache(NAME_CACHE_SIZE, NAME_CACHE_TTL_SEC)
+tool_names = TTLCache(NAME_CACHE_SIZE, NAME_CACHE_TTL_SEC)
+
+_CACHES = {"user": user_names, "tool": tool_names}
+
+
+def invalidate_name(kind: str, uid: str) -> None:
+    cache = _CACHES.get(kind)
+    if cache is not None:
+        cache.invalidate(uid)
+
+
+def clear_names() -> None:
+    for cache in _CACHES.values():
+        cache.clear()
+
+
+def apply_name_notification(payload: str) -> None:
+    """Handle a NOTIFY payload from another station (or ourselves)."""
+    kind, sep, uid = payload.partition(":")
+    if not sep:
+        clear_names()
+        return
+    invalidate_name(kind, uid)
+
+
+def name_cache_stats() -> dict:
+    return {kind: cache.stats() for kind, cache in _CACHES.items()}
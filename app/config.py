@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 
 try:
     from dotenv import load_dotenv  # type: ignore
@@ -19,6 +20,13 @@ def _get_env(name: str, default: str | None = None) -> str:
     return value
 
 
+def _get_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 # Secret key
 SECRET_KEY = _get_env("SECRET_KEY", "change-me")
 
@@ -26,9 +34,53 @@ SECRET_KEY = _get_env("SECRET_KEY", "change-me")
 HOST = _get_env("HOST", "0.0.0.0")
 PORT = int(_get_env("PORT", "8501") or 8501)
 
+# Serving: "threading" (development server), "eventlet" or "gevent"
+# (production; the NFC scan loop then runs in `python -m app.scanner`)
+SERVER_MODE = _get_env("SERVER_MODE", "threading").strip().lower()
+# Socket.IO message queue shared by several server processes:
+# "" (single process), "postgresql" (LISTEN/NOTIFY on the app DB),
+# "redis://host:6379/0" or any kombu URL ("amqp://...")
+SOCKETIO_MESSAGE_QUEUE = _get_env("SOCKETIO_MESSAGE_QUEUE", "").strip()
+# Run the NFC scan loop inside the web process (single-process setups)
+RUN_SCANNER = _get_bool("RUN_SCANNER", SERVER_MODE == "threading")
+# "deferred": serve the UI at once and bring up the DB, caches and readers in
+# the background (GET /api/ready tells when); "blocking": before serving
+STARTUP_MODE = _get_env("STARTUP_MODE", "deferred").strip().lower()
+# Wait between startup attempts while the DB is unreachable
+STARTUP_RETRY_SEC = float(_get_env("STARTUP_RETRY_SEC", "5"))
+
+# Station identity (recorded in scan_events.station_id)
+STATION_ID = _get_env("STATION_ID", "pi1")
+# Processes sharing this key run one NFC scan loop between them (web server
+# vs app.scanner on one Pi). "" = this host (DB client address + hostname),
+# so every kiosk on a shared database scans on its own
+SCANNER_LOCK_KEY = _get_env("SCANNER_LOCK_KEY", "").strip()
+
 # NFC / scan
+# A tag read again at the same station within this window is a duplicate
+# (double tap / reader bounce), however many other tags were read meanwhile
 SCAN_DEBOUNCE_SEC = float(_get_env("SCAN_DEBOUNCE_SEC", "2"))
+# Max (station, UID) pairs remembered for that window
+SCAN_DEDUP_SIZE = int(_get_env("SCAN_DEDUP_SIZE", "4096") or 4096)
+# The same user + tool pair again within this window (any station) returns
+# the first outcome instead of toggling the loan back; 0 disables
+PAIR_DEDUP_SEC = float(_get_env("PAIR_DEDUP_SEC", "5"))
 SCAN_POLL_TIMEOUT_SEC = float(_get_env("SCAN_POLL_TIMEOUT_SEC", "1"))
+# How long a finished transaction stays on screen before the station resets
+SCAN_RESET_SEC = float(_get_env("SCAN_RESET_SEC", "3"))
+# Bulk lending: a user tap opens a session in which every tool tap is a
+# borrow/return for that user, until this many seconds pass without a tap or
+# a badge is read again; 0 = one user + one tool per transaction
+SCAN_SESSION_SEC = float(_get_env("SCAN_SESSION_SEC", "0"))
+# Max tool taps of a session committed in one transaction
+SCAN_SESSION_BATCH = int(_get_env("SCAN_SESSION_BATCH", "20") or 20)
+# "pcsc" (pyscard + pcscd) or "fake" (no hardware; tags via FakeReader.tap / /api/debug/tap)
+NFC_BACKEND = _get_env("NFC_BACKEND", "pcsc").strip().lower()
+# Substring of the PC/SC reader name to use (default: first reader found)
+NFC_READER = _get_env("NFC_READER", "")
+# Multiple readers per process: "" (single reader), "all", or
+# "name1[=user|tool],name2[=user|tool]" (see app.nfc.reader_specs)
+NFC_READERS = _get_env("NFC_READERS", "")
 
 # Database
 DB_CONFIG = dict(
@@ -37,4 +89,80 @@ DB_CONFIG = dict(
     dbname=_get_env("DB_NAME", "sensordb"),
     user=_get_env("DB_USER", "app"),
     password=_get_env("DB_PASSWORD", "app"),
+    # Fail fast when the DB host is unreachable (offline journal takes over)
+    connect_timeout=int(_get_env("DB_CONNECT_TIMEOUT_SEC", "3") or 3),
+)
+
+# Connection pool (per process)
+DB_POOL_MIN = int(_get_env("DB_POOL_MIN", "1") or 1)
+DB_POOL_MAX = int(_get_env("DB_POOL_MAX", "5") or 5)
+DB_POOL_TIMEOUT_SEC = float(_get_env("DB_POOL_TIMEOUT_SEC", "5"))
+DB_POOL_IDLE_SEC = float(_get_env("DB_POOL_IDLE_SEC", "300"))
+DB_POOL_CHECK_SEC = float(_get_env("DB_POOL_CHECK_SEC", "30"))
+
+# UID -> name cache
+NAME_CACHE_SIZE = int(_get_env("NAME_CACHE_SIZE", "20000") or 20000)
+NAME_CACHE_TTL_SEC = float(_get_env("NAME_CACHE_TTL_SEC", "600"))
+# Keep caches coherent across stations via PostgreSQL LISTEN/NOTIFY
+NAME_CACHE_NOTIFY = _get_bool("NAME_CACHE_NOTIFY", True)
+
+# Rendered JSON bodies of read endpoints, keyed by ETag (resource versions)
+HTTP_CACHE_SIZE = int(_get_env("HTTP_CACHE_SIZE", "256") or 256)
+HTTP_CACHE_TTL_SEC = float(_get_env("HTTP_CACHE_TTL_SEC", "600"))
+
+# Rows per transaction for bulk import (app.bulk / /api/bulk/*)
+BULK_BATCH_SIZE = int(_get_env("BULK_BATCH_SIZE", "1000") or 1000)
+
+# Analytics rollups (app.analytics): refresh interval (0 = only on demand),
+# time zone of the daily buckets, and when an open loan counts as overdue
+ANALYTICS_REFRESH_SEC = float(_get_env("ANALYTICS_REFRESH_SEC", "300"))
+ANALYTICS_TZ = _get_env("ANALYTICS_TZ", "Asia/Tokyo")
+OVERDUE_AFTER_HOURS = float(_get_env("OVERDUE_AFTER_HOURS", "24"))
+# Overdue detector interval (0 = disabled); per-tool-name limits live in
+# tool_master.loan_limit_hours and default to OVERDUE_AFTER_HOURS
+OVERDUE_CHECK_SEC = float(_get_env("OVERDUE_CHECK_SEC", "60"))
+
+# Retention (app.retention): scan_events is partitioned by month (UTC);
+# partitions older than SCAN_RETENTION_MONTHS are written to gzip CSV in
+# SCAN_ARCHIVE_DIR (empty: not kept) and dropped. Closed loans older than
+# LOAN_ARCHIVE_MONTHS move to loans_archive. 0 disables either policy.
+RETENTION_CHECK_SEC = float(_get_env("RETENTION_CHECK_SEC", "3600"))
+SCAN_PARTITIONS_AHEAD = int(_get_env("SCAN_PARTITIONS_AHEAD", "2") or 2)
+SCAN_RETENTION_MONTHS = int(_get_env("SCAN_RETENTION_MONTHS", "12") or 0)
+SCAN_ARCHIVE_DIR = _get_env(
+    "SCAN_ARCHIVE_DIR", str(Path(__file__).resolve().parent.parent / "data" / "archive")
+)
+LOAN_ARCHIVE_MONTHS = int(_get_env("LOAN_ARCHIVE_MONTHS", "12") or 0)
+LOAN_ARCHIVE_BATCH = int(_get_env("LOAN_ARCHIVE_BATCH", "5000") or 5000)
+# Idempotency keys of processed scan pairs (offline/agent replays) kept this long
+PAIR_REQUEST_KEEP_DAYS = float(_get_env("PAIR_REQUEST_KEEP_DAYS", "30"))
+
+# Background scan_events writer
+SCAN_LOG_QUEUE_MAX = int(_get_env("SCAN_LOG_QUEUE_MAX", "10000") or 10000)
+SCAN_LOG_BATCH = int(_get_env("SCAN_LOG_BATCH", "200") or 200)
+SCAN_LOG_FLUSH_SEC = float(_get_env("SCAN_LOG_FLUSH_SEC", "1"))
+
+# Offline journal (scan pairs recorded while PostgreSQL is unreachable)
+JOURNAL_PATH = _get_env(
+    "JOURNAL_PATH",
+    str(Path(__file__).resolve().parent.parent / "data" / "offline_journal.sqlite3"),
 )
+JOURNAL_RETRY_SEC = float(_get_env("JOURNAL_RETRY_SEC", "5"))
+JOURNAL_MAX_ATTEMPTS = int(_get_env("JOURNAL_MAX_ATTEMPTS", "5") or 5)
+
+# Station agent (python -m app.agent): forwards scan pairs to a central server
+# instead of talking to PostgreSQL. The central server accepts agents only
+# when AGENT_TOKEN is set (sent as "Authorization: Bearer <token>")
+AGENT_SERVER_URL = _get_env("AGENT_SERVER_URL", "").strip().rstrip("/")
+AGENT_TOKEN = _get_env("AGENT_TOKEN", "")
+AGENT_BATCH_SIZE = int(_get_env("AGENT_BATCH_SIZE", "50") or 50)
+AGENT_TIMEOUT_SEC = float(_get_env("AGENT_TIMEOUT_SEC", "5"))
+
+# Structured logs (app.logs): "json" or "text"; LOG_FILE rotates by size
+LOG_FORMAT = _get_env("LOG_FORMAT", "json").strip().lower()
+LOG_LEVEL = _get_env("LOG_LEVEL", "INFO").strip().upper()
+LOG_FILE = _get_env("LOG_FILE", "")
+LOG_MAX_BYTES = int(_get_env("LOG_MAX_BYTES", str(10 * 1024 * 1024)) or 10 * 1024 * 1024)
+LOG_BACKUP_COUNT = int(_get_env("LOG_BACKUP_COUNT", "5") or 5)
+# DB calls / requests slower than this are logged as slow_query / slow_request
+LOG_SLOW_MS = float(_get_env("LOG_SLOW_MS", "200"))
@@ -1,17 +1,112 @@
 from __future__ import annotations
 
+import base64
+import binascii
+import json
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
 import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
 
-from .config import DB_CONFIG
+from .cache import MISSING, NAME_CACHE_CHANNEL, invalidate_name, tool_names, user_names
+from .config import (
+    DB_CONFIG,
+    DB_POOL_CHECK_SEC,
+    DB_POOL_IDLE_SEC,
+    DB_POOL_MAX,
+    DB_POOL_MIN,
+    DB_POOL_TIMEOUT_SEC,
+    NAME_CACHE_NOTIFY,
+    PAIR_DEDUP_SEC,
+    STATION_ID,
+)
+from .metrics import timed_query
+from .migrations import LATEST_VERSION, apply_migrations, schema_version
+from .pool import ConnectionPool
+from .uid import Uid
 
 
-def get_conn():
+# Errors meaning "PostgreSQL is unreachable" (as opposed to a bad query)
+DB_OUTAGE_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+# UIDs are bytea columns (migration 10): Uid values are sent as their raw
+# bytes, and bytea comes back as Uid (UIDs are the only bytea in the schema)
+psycopg2.extensions.register_adapter(Uid, lambda uid: psycopg2.Binary(uid.bytes))
+psycopg2.extensions.register_type(
+    psycopg2.extensions.new_type(
+        psycopg2.BINARY.values,
+        "UID",
+        lambda value, cur: None if value is None else Uid.from_bytes(psycopg2.BINARY(value, cur)),
+    )
+)
+
+
+def _uid(value) -> Uid | None:
+    """UID parameter for a query: a plain str would be stored as its text."""
+    return None if value is None else Uid(value)
+
+
+def is_db_outage(exc: BaseException) -> bool:
+    return isinstance(exc, DB_OUTAGE_ERRORS)
+
+
+def connect():
+    """Open a new, unpooled connection (pool factory / dedicated listeners)."""
     return psycopg2.connect(**DB_CONFIG)
 
 
-def ensure_tables():
-    conn = get_conn()
-    try:
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(
+                    connect,
+                    minconn=DB_POOL_MIN,
+                    maxconn=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT_SEC,
+                    idle_timeout=DB_POOL_IDLE_SEC,
+                    check_after=DB_POOL_CHECK_SEC,
+                    is_disconnect=is_db_outage,
+                )
+                pool.fill()
+                _pool = pool
+    return _pool
+
+
+@contextmanager
+def get_conn():
+    """Check out a pooled connection: ``with get_conn() as conn: ...``.
+
+    The connection goes back to the pool on exit (any open transaction is
+    rolled back); connections that failed with a disconnect are dropped.
+    """
+    with get_pool().connection() as conn:
+        yield conn
+
+
+def pool_stats() -> dict:
+    return get_pool().stats()
+
+
+def ensure_tables() -> bool:
+    """Create/migrate the schema; returns False if it was already current.
+
+    A database at ``LATEST_VERSION`` costs two reads and no DDL (which would
+    take locks and wait behind other sessions' transactions).
+    """
+    with get_conn() as conn:
+        with conn, conn.cursor() as cur:
+            if schema_version(cur) == LATEST_VERSION:
+                return False
         with conn, conn.cursor() as cur:
             cur.execute(
                 """
@@ -60,38 +155,141 @@ def ensure_tables():
                 )
                 """
             )
-    finally:
-        conn.close()
+            # Loans-feed version before migration 4 (now resource_versions)
+            cur.execute("CREATE SEQUENCE IF NOT EXISTS loan_version_seq")
+            applied = apply_migrations(cur)
+        if applied:
+            print(f"🧱 スキーマ移行を適用: {applied}")
+    return True
 
 
+@timed_query("name_of_user")
 def name_of_user(conn, uid: str) -> str:
-    with conn.cursor() as cur:
-        cur.execute("SELECT full_name FROM users WHERE uid=%s", (uid,))
-        r = cur.fetchone()
-    return r[0] if r else uid
+    uid = _uid(uid)
+    cached = user_names.get(uid)
+    if cached is MISSING:
+        with conn.cursor() as cur:
+            cur.execute("SELECT full_name FROM users WHERE uid=%s", (uid,))
+            r = cur.fetchone()
+        cached = r[0] if r else None
+        user_names.set(uid, cached)
+    return cached or uid
 
 
+@timed_query("name_of_tool")
 def name_of_tool(conn, uid: str) -> str:
+    uid = _uid(uid)
+    cached = tool_names.get(uid)
+    if cached is MISSING:
+        with conn.cursor() as cur:
+            cur.execute("SELECT name FROM tools WHERE uid=%s", (uid,))
+            r = cur.fetchone()
+        cached = r[0] if r else None
+        tool_names.set(uid, cached)
+    return cached or uid
+
+
+@timed_query("warm_name_cache")
+def warm_name_cache(conn) -> int:
+    """Preload the UID->name caches from users/tools; returns rows loaded."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT uid, full_name FROM users")
+        users = cur.fetchall()
+        cur.execute("SELECT uid, name FROM tools")
+        tools = cur.fetchall()
+    for uid, name in users:
+        user_names.set(uid, name)
+    for uid, name in tools:
+        tool_names.set(uid, name)
+    return len(users) + len(tools)
+
+
+def bump_versions(cur, *resources: str) -> None:
+    """Advance resource_versions inside the caller's transaction."""
+    cur.execute(
+        "UPDATE resource_versions SET version=version+1 WHERE resource = ANY(%s)",
+        (list(resources),),
+    )
+
+
+def mark_stats_dirty(cur, hours_sql: str, params: tuple = ()) -> None:
+    """Queue loan-start hours for the next analytics refresh (same transaction)."""
+    cur.execute(
+        f"""
+        INSERT INTO stats_dirty_hours(hour) {hours_sql}
+        ON CONFLICT (hour) DO UPDATE SET changes=stats_dirty_hours.changes+1
+        """,
+        params,
+    )
+
+
+@timed_query("fetch_versions")
+def fetch_versions(conn, *resources: str) -> dict[str, int]:
+    """Current versions of ``resources`` (missing ones read as 0)."""
     with conn.cursor() as cur:
-        cur.execute("SELECT name FROM tools WHERE uid=%s", (uid,))
-        r = cur.fetchone()
-    return r[0] if r else uid
+        cur.execute(
+            "SELECT resource, version FROM resource_versions WHERE resource = ANY(%s)",
+            (list(resources),),
+        )
+        found = dict(cur.fetchall())
+    return {r: found.get(r, 0) for r in resources}
+
+
+@timed_query("upsert_user")
+def upsert_user(conn, uid: str, full_name: str) -> None:
+    uid = _uid(uid)
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO users(uid, full_name)
+            VALUES(%s,%s)
+            ON CONFLICT(uid) DO UPDATE SET full_name=EXCLUDED.full_name
+            """,
+            (uid, full_name),
+        )
+        bump_versions(cur, "users")
+        if NAME_CACHE_NOTIFY:
+            cur.execute("SELECT pg_notify(%s, %s)", (NAME_CACHE_CHANNEL, f"user:{uid}"))
+    invalidate_name("user", uid)
+
+
+@timed_query("upsert_tool")
+def upsert_tool(conn, uid: str, name: str) -> None:
+    uid = _uid(uid)
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO tools(uid, name)
+            VALUES(%s,%s)
+            ON CONFLICT(uid) DO UPDATE SET name=EXCLUDED.name
+            """,
+            (uid, name),
+        )
+        bump_versions(cur, "tools")
+        if NAME_CACHE_NOTIFY:
+            cur.execute("SELECT pg_notify(%s, %s)", (NAME_CACHE_CHANNEL, f"tool:{uid}"))
+    invalidate_name("tool", uid)
 
 
+@timed_query("list_tool_names")
 def list_tool_names(conn) -> list[str]:
     with conn.cursor() as cur:
         cur.execute("SELECT name FROM tool_master ORDER BY name ASC")
         return [r[0] for r in cur.fetchall()]
 
 
+@timed_query("add_tool_name")
 def add_tool_name(conn, name: str) -> None:
     with conn, conn.cursor() as cur:
         cur.execute(
             "INSERT INTO tool_master(name) VALUES(%s) ON CONFLICT(name) DO NOTHING",
             (name,),
         )
+        if cur.rowcount:
+            bump_versions(cur, "tool_names")
 
 
+@timed_query("delete_tool_name")
 def delete_tool_name(conn, name: str) -> None:
     with conn, conn.cursor() as cur:
         cur.execute("SELECT 1 FROM tools WHERE name=%s LIMIT 1", (name,))
@@ -100,17 +298,37 @@ def delete_tool_name(conn, name: str) -> None:
                 "この工具名は '工具' に割当済みです。先に tools 側を変更/削除してください。"
             )
         cur.execute("DELETE FROM tool_master WHERE name=%s", (name,))
+        if cur.rowcount:
+            bump_versions(cur, "tool_names")
 
 
-def insert_scan(conn, uid: str, role: str | None = None) -> None:
+@timed_query("insert_scan")
+def insert_scan(
+    conn, uid: str, role: str | None = None, station_id: str = STATION_ID
+) -> None:
     with conn, conn.cursor() as cur:
         cur.execute(
-            "INSERT INTO scan_events(tag_uid, role_hint) VALUES (%s,%s)", (uid, role)
+            "INSERT INTO scan_events(station_id, tag_uid, role_hint) VALUES (%s,%s,%s)",
+            (station_id, _uid(uid), role),
         )
 
 
+@timed_query("insert_scans")
+def insert_scans(conn, rows: list[tuple]) -> None:
+    """Bulk insert (ts, station_id, tag_uid, role_hint) rows in one statement."""
+    with conn, conn.cursor() as cur:
+        execute_values(
+            cur,
+            "INSERT INTO scan_events(ts, station_id, tag_uid, role_hint) VALUES %s",
+            [(ts, station_id, _uid(uid), role) for ts, station_id, uid, role in rows],
+            page_size=max(len(rows), 1),
+        )
+
+
+@timed_query("borrow_or_return")
 def borrow_or_return(conn, user_uid: str, tool_uid: str):
     """貸出中なら返却、未貸出なら貸出を登録"""
+    user_uid, tool_uid = _uid(user_uid), _uid(tool_uid)
     with conn, conn.cursor() as cur:
         cur.execute(
             """
@@ -131,6 +349,10 @@ def borrow_or_return(conn, user_uid: str, tool_uid: str):
                 """,
                 (user_uid, loan_id),
             )
+            bump_versions(cur, "loans")
+            mark_stats_dirty(
+                cur, "SELECT date_trunc('hour', loaned_at) FROM loans WHERE id=%s", (loan_id,)
+            )
             return "return", {"prev_user": prev_user}
         else:  # 新規貸出
             cur.execute(
@@ -139,21 +361,279 @@ def borrow_or_return(conn, user_uid: str, tool_uid: str):
                 """,
                 (tool_uid, user_uid),
             )
+            bump_versions(cur, "loans")
+            mark_stats_dirty(cur, "SELECT date_trunc('hour', now())")
             return "borrow", {}
 
 
-def fetch_open_loans(conn, limit: int = 100):
+_PROCESS_SCAN_PAIR_SQL = """
+WITH prior AS (
+    SELECT p.action, p.loan_id, l.borrower_uid, l.loaned_at, l.returned_at
+      FROM scan_pair_requests p
+      LEFT JOIN loans l ON l.id=p.loan_id
+     WHERE p.idempotency_key=%(key)s
+        OR (%(window)s > 0
+            AND p.tool_uid=%(tool)s AND p.user_uid=%(user)s
+            AND p.scanned_at BETWEEN COALESCE(%(ts)s, now()) - make_interval(secs => %(window)s)
+                                 AND COALESCE(%(ts)s, now()) + make_interval(secs => %(window)s))
+     ORDER BY p.idempotency_key=%(key)s DESC, p.scanned_at DESC
+     LIMIT 1
+), open_loan AS (
+    SELECT id, borrower_uid FROM loans
+     WHERE tool_uid=%(tool)s AND returned_at IS NULL
+       AND NOT EXISTS (SELECT 1 FROM prior)
+     ORDER BY loaned_at DESC LIMIT 1
+       FOR UPDATE
+), scan AS (
+    INSERT INTO scan_events(ts, station_id, tag_uid, role_hint)
+    SELECT COALESCE(%(ts)s, now()), %(station)s, %(tool)s, 'tool'
+     WHERE NOT EXISTS (SELECT 1 FROM prior)
+), returned AS (
+    UPDATE loans l
+       SET returned_at=GREATEST(COALESCE(%(ts)s, now()), l.loaned_at),
+           return_user_uid=%(user)s,
+           return_station_id=%(station)s
+      FROM open_loan o
+     WHERE l.id=o.id
+ RETURNING l.id, o.borrower_uid, l.loaned_at, l.returned_at
+), borrowed AS (
+    INSERT INTO loans(tool_uid, borrower_uid, loaned_at, station_id)
+    SELECT %(tool)s, %(user)s, COALESCE(%(ts)s, now()), %(station)s
+     WHERE NOT EXISTS (SELECT 1 FROM open_loan)
+       AND NOT EXISTS (SELECT 1 FROM prior)
+ RETURNING id, loaned_at
+), outcome AS (
+    SELECT COALESCE(p.action, CASE WHEN r.id IS NULL THEN 'borrow' ELSE 'return' END) AS action,
+           COALESCE(p.loan_id, r.id, b.id) AS loan_id,
+           CASE WHEN p.action IS NULL THEN r.borrower_uid
+                WHEN p.action='return' THEN p.borrower_uid END AS prev_user,
+           COALESCE(p.loaned_at, r.loaned_at, b.loaned_at) AS loaned_at,
+           CASE WHEN p.action IS NULL THEN r.returned_at
+                WHEN p.action='return' THEN p.returned_at END AS returned_at,
+           p.action IS NOT NULL AS duplicate
+      FROM (SELECT 1) AS one
+      LEFT JOIN prior p ON true
+      LEFT JOIN returned r ON true
+      LEFT JOIN borrowed b ON true
+), request AS (
+    INSERT INTO scan_pair_requests(
+        idempotency_key, loan_id, action, user_uid, tool_uid, station_id, scanned_at
+    )
+    SELECT %(key)s, loan_id, action, %(user)s, %(tool)s, %(station)s, COALESCE(%(ts)s, now())
+      FROM outcome
+     WHERE NOT duplicate
+), bump AS (
+    UPDATE resource_versions SET version=version+1
+     WHERE resource='loans' AND NOT EXISTS (SELECT 1 FROM prior)
+ RETURNING version
+), dirty AS (
+    -- The loan-start hour, plus (for a replayed scan) every hour since the
+    -- scan that the refresh does not rebuild anyway: their overdue counts
+    INSERT INTO stats_dirty_hours(hour)
+    SELECT date_trunc('hour', loaned_at) FROM outcome WHERE NOT duplicate
+     UNION
+    SELECT generate_series(
+               date_trunc('hour', COALESCE(returned_at, loaned_at)),
+               date_trunc('hour', now()) - interval '2 hours',
+               interval '1 hour'
+           )
+      FROM outcome WHERE NOT duplicate
+    ON CONFLICT (hour) DO UPDATE SET changes=stats_dirty_hours.changes+1
+)
+SELECT o.action,
+       o.loan_id,
+       o.prev_user,
+       (SELECT full_name FROM users WHERE uid=%(user)s),
+       (SELECT name FROM tools WHERE uid=%(tool)s),
+       (SELECT full_name FROM users WHERE uid=o.prev_user),
+       o.loaned_at,
+       o.returned_at,
+       (SELECT version FROM bump),
+       o.duplicate
+  FROM outcome o
+"""
+
+
+def _scan_pair_params(
+    user_uid: str,
+    tool_uid: str,
+    station_id: str = STATION_ID,
+    idempotency_key: str | None = None,
+    scanned_at=None,
+) -> dict:
+    return {
+        "user": _uid(user_uid),
+        "tool": _uid(tool_uid),
+        "station": station_id,
+        "key": idempotency_key or uuid.uuid4().hex,
+        "ts": scanned_at,
+        "window": PAIR_DEDUP_SEC,
+    }
+
+
+def _scan_pair_result(row: tuple, params: dict) -> dict:
+    (
+        action,
+        loan_id,
+        prev_user,
+        user_name,
+        tool_name,
+        prev_name,
+        loaned_at,
+        returned_at,
+        version,
+        duplicate,
+    ) = row
+    user_uid, tool_uid = params["user"], params["tool"]
+
+    # The statement already resolved the names: keep the caches hot for free
+    user_names.set(user_uid, user_name)
+    tool_names.set(tool_uid, tool_name)
+    if prev_user:
+        user_names.set(prev_user, prev_name)
+
+    return {
+        "action": action,
+        "loan_id": loan_id,
+        "prev_user_uid": prev_user,
+        "user_name": user_name or user_uid,
+        "tool_name": tool_name or tool_uid,
+        "prev_user_name": (prev_name or prev_user) if prev_user else None,
+        "loaned_at": loaned_at,
+        "returned_at": returned_at,
+        "version": version,
+        "duplicate": duplicate,
+    }
+
+
+# Runs of _PROCESS_SCAN_PAIR_SQL before a conflict or deadlock is given up on
+_SCAN_PAIR_ATTEMPTS = 3
+
+
+@timed_query("process_scan_pair")
+def process_scan_pair(
+    conn,
+    user_uid: str,
+    tool_uid: str,
+    station_id: str = STATION_ID,
+    idempotency_key: str | None = None,
+    scanned_at=None,
+) -> dict:
+    """工具スキャンの記録と貸出/返却トグルを1ステートメント（1往復）で実行
+
+    Runs as a single autocommitted statement, so no BEGIN/COMMIT round trips.
+    Returns action ('borrow'/'return'), loan_id, prev_user_uid, the names
+    of the user, tool and previous borrower (falling back to the UID), the
+    loan timestamps and the new loans-feed ``version``.
+
+    With ``idempotency_key`` a repeated call returns the original outcome with
+    ``duplicate=True`` (and ``version=None``) instead of toggling again. So
+    does the same user and tool again within ``PAIR_DEDUP_SEC`` of a
+    processed pair (a double tap must not turn a borrow into a return); the
+    repeat is not written to scan_events either.
+    ``scanned_at`` backdates the scan/loan when replaying an offline journal.
+    """
+    params = _scan_pair_params(user_uid, tool_uid, station_id, idempotency_key, scanned_at)
+    conn.rollback()  # no-op unless a read transaction is open
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for attempt in range(_SCAN_PAIR_ATTEMPTS):
+                try:
+                    cur.execute(_PROCESS_SCAN_PAIR_SQL, params)
+                    break
+                except (psycopg2.errors.UniqueViolation, psycopg2.errors.DeadlockDetected):
+                    # Another station borrowed the same tool concurrently
+                    # (loans_open_tool_uidx) or the same key is being
+                    # processed: re-run, which now sees the open loan / the
+                    # prior request. A deadlock with a bulk-lending batch
+                    # (process_scan_pairs) rolled back only this statement
+                    if attempt == _SCAN_PAIR_ATTEMPTS - 1:
+                        raise
+            row = cur.fetchone()
+    finally:
+        conn.autocommit = autocommit
+    return _scan_pair_result(row, params)
+
+
+def process_scan_pairs(conn, pairs: list[dict]) -> list[dict]:
+    """process_scan_pair for several pairs, in order, with one COMMIT.
+
+    ``pairs`` holds process_scan_pair's keyword arguments. For a bulk-lending
+    session: each statement sees the loans of the ones before it, and the
+    batch costs one WAL flush instead of one per tool. A pair racing another
+    station for its tool is re-run from a savepoint (sent with the statement,
+    no extra round trip). Should two stations' batches deadlock on each
+    other's loans, the batch is rolled back and its pairs run one by one.
+    """
+    if len(pairs) == 1:
+        return [process_scan_pair(conn, **pairs[0])]  # autocommit: no BEGIN/COMMIT
+    try:
+        return _process_scan_pair_batch(conn, pairs)
+    except psycopg2.errors.DeadlockDetected:
+        return [process_scan_pair(conn, **pair) for pair in pairs]
+
+
+@timed_query("process_scan_pairs")
+def _process_scan_pair_batch(conn, pairs: list[dict]) -> list[dict]:
+    params = [_scan_pair_params(**pair) for pair in pairs]
+    conn.rollback()
+    rows = []
+    with conn, conn.cursor() as cur:
+        for p in params:
+            try:
+                cur.execute("SAVEPOINT scan_pair;" + _PROCESS_SCAN_PAIR_SQL, p)
+            except psycopg2.errors.UniqueViolation:
+                cur.execute("ROLLBACK TO SAVEPOINT scan_pair")
+                cur.execute(_PROCESS_SCAN_PAIR_SQL, p)
+            rows.append(cur.fetchone())
+    return [_scan_pair_result(row, p) for row, p in zip(rows, params)]
+
+
+def loan_delta(result: dict, station_id: str = STATION_ID) -> dict:
+    """Socket.IO ``loan_delta`` payload for a process_scan_pair result.
+
+    ``loan`` carries the same fields as one ``history`` row of /api/loans.
+    """
+    returned = result["action"] == "return"
+    return {
+        "version": result["version"],
+        "op": result["action"],
+        "station_id": station_id,
+        "loan": {
+            "id": result["loan_id"],
+            "action": "返却" if returned else "貸出",
+            "tool": result["tool_name"],
+            "borrower": result["prev_user_name"] if returned else result["user_name"],
+            "loaned_at": result["loaned_at"].isoformat(),
+            "returned_at": result["returned_at"].isoformat() if returned else None,
+        },
+    }
+
+
+def fetch_loans_version(conn) -> int:
+    """Current loans-feed version (0 before the first transaction).
+
+    Timed as fetch_versions, the query it runs.
+    """
+    return fetch_versions(conn, "loans")["loans"]
+
+
+@timed_query("fetch_recent_history")
+def fetch_recent_history(conn, limit: int = 50):
     with conn.cursor() as cur:
         cur.execute(
             """
-            SELECT COALESCE(t.name, l.tool_uid) AS tool,
-                   COALESCE(u.full_name, l.borrower_uid) AS borrower,
-                   l.loaned_at
+            SELECT l.id,
+                   CASE WHEN l.returned_at IS NULL THEN '貸出' ELSE '返却' END AS action,
+                   COALESCE(t.name, upper(encode(l.tool_uid, 'hex'))) AS tool,
+                   COALESCE(u.full_name, upper(encode(l.borrower_uid, 'hex'))) AS borrower,
+                   l.loaned_at, l.returned_at
               FROM loans l
          LEFT JOIN tools t ON t.uid=l.tool_uid
          LEFT JOIN users u ON u.uid=l.borrower_uid
-             WHERE l.returned_at IS NULL
-          ORDER BY l.loaned_at DESC
+          ORDER BY COALESCE(l.returned_at, l.loaned_at) DESC
              LIMIT %s
             """,
             (limit,),
@@ -161,21 +641,144 @@ def fetch_open_loans(conn, limit: int = 100):
         return cur.fetchall()
 
 
-def fetch_recent_history(conn, limit: int = 50):
+LOAN_PAGE_MAX = 500
+
+
+def encode_loan_cursor(sort_ts, loan_id: int) -> str:
+    """Opaque keyset cursor for the history order (activity time, id)."""
+    raw = json.dumps([sort_ts.isoformat(), loan_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_loan_cursor(cursor: str) -> tuple[datetime, int]:
+    """Inverse of encode_loan_cursor; raises ValueError on a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, loan_id = json.loads(raw)
+        return datetime.fromisoformat(ts), int(loan_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+
+def _loan_filters(
+    user: str | None = None,
+    tool: str | None = None,
+    tool_name: str | None = None,
+    station: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> tuple[str, dict]:
+    """SQL conditions (ANDed, prefixed with AND) for the /api/loans filters.
+
+    ``since``/``until`` bound the activity time COALESCE(returned_at,
+    loaned_at) as a half-open range [since, until).
+    """
+    conds = []
+    if user:
+        conds.append("l.borrower_uid=%(user)s")
+    if tool:
+        conds.append("l.tool_uid=%(tool)s")
+    if tool_name:
+        conds.append("l.tool_uid IN (SELECT uid FROM tools WHERE name=%(tool_name)s)")
+    if station:
+        conds.append("%(station)s IN (l.station_id, l.return_station_id)")
+    if since:
+        conds.append("COALESCE(l.returned_at, l.loaned_at) >= %(since)s")
+    if until:
+        conds.append("COALESCE(l.returned_at, l.loaned_at) < %(until)s")
+    params = {
+        "user": _uid(user) if user else None,
+        "tool": _uid(tool) if tool else None,
+        "tool_name": tool_name,
+        "station": station,
+        "since": since,
+        "until": until,
+    }
+    return "".join(f" AND {c}" for c in conds), params
+
+
+@timed_query("fetch_open_loans")
+def fetch_open_loans(conn, limit: int = 100, **filters):
+    """Open loans, newest first; ``filters`` as in _loan_filters."""
+    where, params = _loan_filters(**filters)
+    params["limit"] = limit
     with conn.cursor() as cur:
         cur.execute(
-            """
-            SELECT CASE WHEN l.returned_at IS NULL THEN '貸出' ELSE '返却' END AS action,
-                   COALESCE(t.name, l.tool_uid) AS tool,
-                   COALESCE(u.full_name, l.borrower_uid) AS borrower,
-                   l.loaned_at, l.returned_at
+            f"""
+            SELECT l.id,
+                   COALESCE(t.name, upper(encode(l.tool_uid, 'hex'))) AS tool,
+                   COALESCE(u.full_name, upper(encode(l.borrower_uid, 'hex'))) AS borrower,
+                   l.loaned_at
               FROM loans l
          LEFT JOIN tools t ON t.uid=l.tool_uid
          LEFT JOIN users u ON u.uid=l.borrower_uid
-          ORDER BY COALESCE(l.returned_at, l.loaned_at) DESC
-             LIMIT %s
+             WHERE l.returned_at IS NULL{where}
+          ORDER BY l.loaned_at DESC
+             LIMIT %(limit)s
             """,
-            (limit,),
+            params,
         )
         return cur.fetchall()
 
+
+@timed_query("fetch_loans_page")
+def fetch_loans_page(
+    conn, cursor: str | None = None, limit: int = 50, archived: bool = False, **filters
+) -> tuple[list, str | None]:
+    """One page of loan history, newest activity first, plus the next cursor.
+
+    Keyset pagination on (COALESCE(returned_at, loaned_at), id): every page
+    is an index range scan from the cursor, so page N costs the same as page
+    1 (no OFFSET). Rows have the fetch_recent_history shape; the returned
+    cursor is None on the last page. ``archived`` also reads loans_archive
+    (both tables have the history indexes, merged in order).
+    """
+    where, params = _loan_filters(**filters)
+    if cursor:
+        params["after_ts"], params["after_id"] = decode_loan_cursor(cursor)
+        where += " AND (COALESCE(l.returned_at, l.loaned_at), l.id) < (%(after_ts)s, %(after_id)s)"
+    params["limit"] = max(1, min(limit, LOAN_PAGE_MAX)) + 1
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT l.id,
+                   CASE WHEN l.returned_at IS NULL THEN '貸出' ELSE '返却' END AS action,
+                   COALESCE(t.name, upper(encode(l.tool_uid, 'hex'))) AS tool,
+                   COALESCE(u.full_name, upper(encode(l.borrower_uid, 'hex'))) AS borrower,
+                   l.loaned_at, l.returned_at,
+                   COALESCE(l.returned_at, l.loaned_at) AS activity_at
+              FROM {"loans_all" if archived else "loans"} l
+         LEFT JOIN tools t ON t.uid=l.tool_uid
+         LEFT JOIN users u ON u.uid=l.borrower_uid
+             WHERE true{where}
+          ORDER BY COALESCE(l.returned_at, l.loaned_at) DESC, l.id DESC
+             LIMIT %(limit)s
+            """,
+            params,
+        )
+        rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) == params["limit"]:
+        rows = rows[:-1]
+        next_cursor = encode_loan_cursor(rows[-1][6], rows[-1][0])
+    return [row[:6] for row in rows], next_cursor
+
+
+def serialize_open_loan(row) -> dict:
+    return {
+        "id": row[0],
+        "tool": row[1],
+        "borrower": row[2],
+        "loaned_at": row[3].isoformat(),
+    }
+
+
+def serialize_history(row) -> dict:
+    return {
+        "id": row[0],
+        "action": row[1],
+        "tool": row[2],
+        "borrower": row[3],
+        "loaned_at": row[4].isoformat(),
+        "returned_at": row[5].isoformat() if row[5] else None,
+    }
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+
+def monkey_patch(mode: str) -> None:
+    """Make blocking stdlib (and psycopg2, if psycogreen is installed) cooperative.
+
+    Imported by app/__init__ before Flask/Socket.IO so the patch happens
+    before anything else creates threads, locks or sockets.
+    """
+    if mode == "eventlet":
+        import eventlet
+
+        eventlet.monkey_patch()
+    elif mode == "gevent":
+        from gevent import monkey
+
+        monkey.patch_all()
+    else:
+        return
+    try:
+        if mode == "eventlet":
+            from psycogreen.eventlet import patch_psycopg
+        else:
+            from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        print("⚠️ psycogreen が無いため DB 待ちの間は他の接続も止まります（pip install psycogreen 推奨）")
+        return
+    patch_psycopg()
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Callable
+
+from flask import Response, request
+
+from .cache import MISSING, TTLCache
+from .config import HTTP_CACHE_SIZE, HTTP_CACHE_TTL_SEC
+
+
+# ETag -> rendered JSON body. An ETag names one representation (path, query
+# string and the versions of every resource it is built from), so entries
+# never need invalidation: a change bumps a version and yields a new ETag.
+responses = TTLCache(HTTP_CACHE_SIZE, HTTP_CACHE_TTL_SEC)
+
+
+def make_etag(versions: dict[str, int]) -> str:
+    """Strong ETag for the current request under ``versions``."""
+    query = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+    tag = ".".join(f"{name}{versions[name]}" for name in sorted(versions))
+    if query:
+        tag += "-" + hashlib.sha1(query.encode()).hexdigest()[:12]
+    return f"{request.path.strip('/').replace('/', '.')}.{tag}"
+
+
+def versioned_json(versions: dict[str, int], build: Callable[[], object]) -> Response:
+    """JSON response with ETag / If-None-Match handling.
+
+    ``build()`` is only called when no body for this ETag is cached; a client
+    that already holds it gets an empty 304. ``no-cache`` makes browsers
+    revalidate on every poll instead of reusing a stale copy.
+    """
+    etag = make_etag(versions)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = responses.get(etag)
+        if body is MISSING:
+            body = json.dumps(build(), ensure_ascii=False, separators=(",", ":"))
+            responses.set(etag, body)
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable
+
+from .config import JOURNAL_MAX_ATTEMPTS, JOURNAL_PATH, JOURNAL_RETRY_SEC
+
+
+class OfflineJournal:
+    """Station-local write-ahead journal of scan pairs (SQLite, WAL mode).
+
+    Scan pairs that could not reach PostgreSQL are appended here in tap order
+    and replayed later with their idempotency key, so a replay that is
+    interrupted half-way never toggles the same loan twice.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=FULL")  # Pis lose power; keep every tap
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pending(
+                  seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                  idempotency_key TEXT UNIQUE NOT NULL,
+                  user_uid TEXT NOT NULL,
+                  tool_uid TEXT NOT NULL,
+                  station_id TEXT NOT NULL,
+                  scanned_at TEXT NOT NULL,
+                  attempts INTEGER NOT NULL DEFAULT 0,
+                  last_error TEXT
+                )
+                """
+            )
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS failed(
+                  seq INTEGER PRIMARY KEY,
+                  idempotency_key TEXT NOT NULL,
+                  user_uid TEXT NOT NULL,
+                  tool_uid TEXT NOT NULL,
+                  station_id TEXT NOT NULL,
+                  scanned_at TEXT NOT NULL,
+                  attempts INTEGER NOT NULL,
+                  last_error TEXT
+                )
+                """
+            )
+        self.appended = 0
+        self.replayed = 0
+
+    def append(
+        self,
+        idempotency_key: str,
+        user_uid: str,
+        tool_uid: str,
+        station_id: str,
+        scanned_at: datetime,
+    ) -> None:
+        with self._lock:
+            self._db.execute(
+                """
+                INSERT OR IGNORE INTO pending(idempotency_key, user_uid, tool_uid, station_id, scanned_at)
+                VALUES (?,?,?,?,?)
+                """,
+                (idempotency_key, user_uid, tool_uid, station_id, scanned_at.isoformat()),
+            )
+            self.appended += 1
+
+    def peek(self, limit: int = 100) -> list[dict]:
+        with self._lock:
+            rows = self._db.execute(
+                """
+                SELECT seq, idempotency_key, user_uid, tool_uid, station_id, scanned_at, attempts
+                  FROM pending ORDER BY seq LIMIT ?
+                """,
+                (limit,),
+            ).fetchall()
+        return [
+            {
+                "seq": r[0],
+                "idempotency_key": r[1],
+                "user_uid": r[2],
+                "tool_uid": r[3],
+                "station_id": r[4],
+                "scanned_at": datetime.fromisoformat(r[5]),
+                "attempts": r[6],
+            }
+            for r in rows
+        ]
+
+    def remove(self, seq: int) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM pending WHERE seq=?", (seq,))
+            self.replayed += 1
+
+    def record_failure(self, seq: int, error: str, max_attempts: int) -> bool:
+        """Count a non-connectivity failure; returns True if moved to ``failed``."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "UPDATE pending SET attempts=attempts+1, last_error=? WHERE seq=?",
+                    (error, seq),
+                )
+                moved = self._db.execute(
+                    """
+                    INSERT INTO failed
+                    SELECT seq, idempotency_key, user_uid, tool_uid, station_id,
+                           scanned_at, attempts, last_error
+                      FROM pending WHERE seq=? AND attempts>=?
+                    """,
+                    (seq, max_attempts),
+                ).rowcount
+                if moved:
+                    self._db.execute("DELETE FROM pending WHERE seq=?", (seq,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return bool(moved)
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM pending").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            depth, oldest = self._db.execute(
+                "SELECT count(*), min(scanned_at) FROM pending"
+            ).fetchone()
+            failed = self._db.execute("SELECT count(*) FROM failed").fetchone()[0]
+        return {
+            "depth": depth,
+            "oldest_scanned_at": oldest,
+            "failed": failed,
+            "appended": self.appended,
+            "replayed": self.replayed,
+            "path": self.path,
+        }
+
+
+class JournalReplayer:
+    """Drains the journal into PostgreSQL in order once the DB is reachable.
+
+    ``process(entry)`` must raise ``is_outage`` errors while the DB is down;
+    any other error counts against the entry, which is parked in ``failed``
+    after JOURNAL_MAX_ATTEMPTS so one bad row can't block the queue forever.
+    """
+
+    def __init__(
+        self,
+        journal: OfflineJournal,
+        process: Callable[[dict], dict],
+        is_outage: Callable[[BaseException], bool],
+        on_replayed: Callable[[dict, dict], None] | None = None,
+        retry_sec: float = JOURNAL_RETRY_SEC,
+        max_attempts: int = JOURNAL_MAX_ATTEMPTS,
+    ):
+        self.journal = journal
+        self._process = process
+        self._is_outage = is_outage
+        self._on_replayed = on_replayed
+        self.retry_sec = retry_sec
+        self.max_attempts = max_attempts
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.db_reachable = True
+
+    def start(self) -> "JournalReplayer":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def nudge(self) -> None:
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.retry_sec)
+            self._wakeup.clear()
+            self.replay_pending()
+
+    def replay_pending(self) -> int:
+        replayed = 0
+        while True:
+            batch = self.journal.peek()
+            if not batch:
+                return replayed
+            for entry in batch:
+                try:
+                    result = self._process(entry)
+                except Exception as e:  # noqa: BLE001
+                    if self._is_outage(e):
+                        self.db_reachable = False
+                        return replayed
+                    if self.journal.record_failure(entry["seq"], str(e), self.max_attempts):
+                        print(f"❌ オフライン記録の再送を断念: {entry['idempotency_key']} ({e})")
+                    return replayed
+                self.db_reachable = True
+                self.journal.remove(entry["seq"])
+                replayed += 1
+                if self._on_replayed is not None:
+                    self._on_replayed(entry, result)
+
+
+_journal: OfflineJournal | None = None
+_journal_lock = threading.Lock()
+
+
+def get_journal() -> OfflineJournal:
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                _journal = OfflineJournal(JOURNAL_PATH)
+    return _journal
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import json
+import logging
+import logging.handlers
+import sys
+from datetime import datetime, timezone
+
+from .config import LOG_BACKUP_COUNT, LOG_FILE, LOG_FORMAT, LOG_LEVEL, LOG_MAX_BYTES
+
+
+# Structured events (transactions, slow queries, reader errors) go to this
+# logger; the console print() messages stay as they are for operators
+log = logging.getLogger("app")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, event plus the event's fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{k}={v}" for k, v in getattr(record, "fields", {}).items())
+        return f"{self.formatTime(record)} {record.levelname} {record.getMessage()} {fields}".rstrip()
+
+
+def log_event(event: str, level: int = logging.INFO, **fields) -> None:
+    """``log_event("transaction", station="pi1", ms=12.3)``"""
+    if log.isEnabledFor(level):
+        log.log(level, event, extra={"fields": fields})
+
+
+def setup_logging() -> None:
+    """Configure the ``app`` logger from LOG_* settings (idempotent).
+
+    LOG_FILE rotates at LOG_MAX_BYTES keeping LOG_BACKUP_COUNT files;
+    without it records go to stderr.
+    """
+    if getattr(log, "_configured", False):
+        return
+    if LOG_FILE:
+        handler: logging.Handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    log.addHandler(handler)
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+    log._configured = True  # type: ignore[attr-defined]
@@ -1,24 +1,32 @@
 from __future__ import annotations
 
 from . import create_app, socketio
-from .background import start_scan_thread
-from .config import HOST, PORT
-from .db import ensure_tables
+from .config import HOST, PORT, SERVER_MODE, STARTUP_MODE
+from .logs import setup_logging
+from .startup import get_startup
 
 
 def run():
+    setup_logging()
     app = create_app()
-    ensure_tables()
-    start_scan_thread(sock=socketio)
-
-    print("🚀 Flask 工具管理システムを開始します...")
-    print("📡 NFCスキャン監視スレッド開始")
+    startup = get_startup(socketio)
+    if STARTUP_MODE == "blocking":
+        if not startup.run():
+            raise SystemExit(1)
+    else:
+        # Serve the kiosk screen now; DB, caches and readers come up behind it
+        startup.start(socketio)
+
+    print(f"🚀 Flask 工具管理システムを開始します... ({SERVER_MODE}, 起動: {STARTUP_MODE})")
     print(f"🌐 http://{HOST}:{PORT} でアクセス可能")
     print("💡 タイムアウトエラーは正常動作（タグ待機中）なので無視してください")
 
-    socketio.run(app, host=HOST, port=PORT, debug=False)
+    # threading mode is the kiosk's own Werkzeug server; under systemd (no
+    # TTY) Flask-SocketIO would otherwise refuse to start it
+    socketio.run(
+        app, host=HOST, port=PORT, debug=False, allow_unsafe_werkzeug=SERVER_MODE == "threading"
+    )
 
 
 if __name__ == "__main__":
     run()
-
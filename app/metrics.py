@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable
+
+from .config import LOG_SLOW_MS
+from .logs import log_event
+
+
+# Seconds; tuned for LAN round trips (ms) up to a stuck reader/DB (s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in items
+        ]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram (Prometheus text format) per label set."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count], sum
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series[0]) if series else 0
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, (list(c), s[0])) for k, (c, s) in self._series.items())
+        lines = self.header()
+        names = self.labelnames + ("le",)
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_labels(names, key + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Metrics of this process; gauges are read from callbacks at scrape time."""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._gauges: list[tuple[str, str, tuple[str, ...], Callable[[], list[tuple[tuple, float]]]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (), **kw) -> Histogram:
+        metric = Histogram(name, help, labelnames, **kw)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...],
+        read: Callable[[], list[tuple[tuple, float]]],
+    ) -> None:
+        """``read()`` returns ``[(label values, value), ...]``; errors skip the gauge."""
+        with self._lock:
+            self._gauges.append((name, help, labelnames, read))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+            gauges = list(self._gauges)
+        lines: list[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, help, labelnames, read in gauges:
+            try:
+                samples = read()
+            except Exception:  # noqa: BLE001
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{_labels(labelnames, k)} {v:g}" for k, v in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+SCAN_TAPS = REGISTRY.counter(
+    "scan_taps_total", "Tags read by the scan loops", ("station", "role")
+)
+SCAN_DROPPED = REGISTRY.counter(
+    "scan_taps_dropped_total",
+    "Taps ignored by a station (debounce, not_waiting, no_user)",
+    ("station", "reason"),
+)
+SCAN_TRANSACTION_SECONDS = REGISTRY.histogram(
+    "scan_transaction_seconds",
+    "Tool tap to transaction_complete (borrow/return/duplicate/queued/error)",
+    ("station", "action"),
+)
+NFC_READ_SECONDS = REGISTRY.histogram(
+    "nfc_read_seconds", "Card connect + GET DATA once a tag is present", ("reader",)
+)
+NFC_TIMEOUTS = REGISTRY.counter(
+    "nfc_reader_timeouts_total", "Reader waits that ended without a tag", ("reader",)
+)
+NFC_ERRORS = REGISTRY.counter(
+    "nfc_reader_errors_total", "Reader errors (unplugged, pcscd restart)", ("reader",)
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "db_query_seconds", "Time spent in a DB helper (one call)", ("query",)
+)
+DB_ERRORS = REGISTRY.counter(
+    "db_errors_total", "DB helper failures (kind: outage/error)", ("query", "kind")
+)
+EMIT_SECONDS = REGISTRY.histogram(
+    "socketio_emit_seconds", "Socket.IO emit (incl. message-queue publish)", ("event",)
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "http_request_seconds", "HTTP request handling time", ("endpoint", "method", "status")
+)
+
+
+def timed_query(name: str):
+    """Decorator: time a DB helper into db_query_seconds, count its errors and
+    log calls slower than LOG_SLOW_MS."""
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                from .db import is_db_outage
+
+                DB_ERRORS.inc(query=name, kind="outage" if is_db_outage(e) else "error")
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                DB_QUERY_SECONDS.observe(elapsed, query=name)
+                if elapsed * 1000 >= LOG_SLOW_MS:
+                    log_event("slow_query", query=name, ms=round(elapsed * 1000, 2))
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,578 @@
+from __future__ import annotations
+
+
+# Arbitrary constant for pg_advisory_xact_lock (shared by every station)
+MIGRATION_LOCK_ID = 7_262_001
+
+# Versioned schema migrations applied by db.ensure_tables after the base DDL.
+# Entries are (version, description, statements), applied in order inside one
+# transaction guarded by an advisory lock so stations starting together don't
+# race. Never edit an applied migration; append a new one instead.
+MIGRATIONS: list[tuple[int, str, tuple[str, ...]]] = [
+    (
+        1,
+        "loan/scan_events indexes and one open loan per tool",
+        (
+            # Close older duplicate open loans so the unique index can be built
+            # (return_user_uid stays NULL to mark the system close)
+            """
+            UPDATE loans l
+               SET returned_at = now()
+             WHERE l.returned_at IS NULL
+               AND EXISTS (
+                   SELECT 1 FROM loans n
+                    WHERE n.tool_uid = l.tool_uid
+                      AND n.returned_at IS NULL
+                      AND (n.loaned_at, n.id) > (l.loaned_at, l.id)
+               )
+            """,
+            # 1工具1貸出の保証 + borrow/return lookup by tool
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS loans_open_tool_uidx
+                ON loans(tool_uid) WHERE returned_at IS NULL
+            """,
+            # fetch_open_loans: ORDER BY loaned_at DESC over open loans only
+            """
+            CREATE INDEX IF NOT EXISTS loans_open_loaned_at_idx
+                ON loans(loaned_at DESC) WHERE returned_at IS NULL
+            """,
+            # fetch_recent_history: ORDER BY COALESCE(returned_at, loaned_at) DESC
+            """
+            CREATE INDEX IF NOT EXISTS loans_history_idx
+                ON loans((COALESCE(returned_at, loaned_at)) DESC, id DESC)
+            """,
+            "CREATE INDEX IF NOT EXISTS scan_events_ts_idx ON scan_events(ts)",
+            """
+            CREATE INDEX IF NOT EXISTS scan_events_station_ts_idx
+                ON scan_events(station_id, ts)
+            """,
+        ),
+    ),
+    (
+        2,
+        "idempotency keys for scan pairs (offline journal replay)",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS scan_pair_requests(
+              idempotency_key TEXT PRIMARY KEY,
+              loan_id BIGINT,
+              action TEXT NOT NULL,
+              processed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS scan_pair_requests_processed_at_idx
+                ON scan_pair_requests(processed_at)
+            """,
+        ),
+    ),
+    (
+        3,
+        "loan station columns and per-user/per-tool history indexes",
+        (
+            # Which station lent / took back the tool (NULL for older loans)
+            "ALTER TABLE loans ADD COLUMN IF NOT EXISTS station_id TEXT",
+            "ALTER TABLE loans ADD COLUMN IF NOT EXISTS return_station_id TEXT",
+            # fetch_loans_page filtered by user / tool, keyset on the history order
+            """
+            CREATE INDEX IF NOT EXISTS loans_borrower_history_idx
+                ON loans(borrower_uid, (COALESCE(returned_at, loaned_at)) DESC, id DESC)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS loans_tool_history_idx
+                ON loans(tool_uid, (COALESCE(returned_at, loaned_at)) DESC, id DESC)
+            """,
+        ),
+    ),
+    (
+        4,
+        "per-resource version counters (ETags, loan deltas)",
+        (
+            # Bumped in the same transaction as the change it describes, so a
+            # reader never sees a version whose data is not yet visible
+            """
+            CREATE TABLE IF NOT EXISTS resource_versions(
+              resource TEXT PRIMARY KEY,
+              version BIGINT NOT NULL DEFAULT 0
+            )
+            """,
+            # loans continues from the loan_version_seq numbering
+            """
+            INSERT INTO resource_versions(resource, version)
+            SELECT 'loans', CASE WHEN is_called THEN last_value ELSE 0 END
+              FROM loan_version_seq
+            ON CONFLICT (resource) DO NOTHING
+            """,
+            """
+            INSERT INTO resource_versions(resource)
+            VALUES ('users'), ('tools'), ('tool_names')
+            ON CONFLICT (resource) DO NOTHING
+            """,
+        ),
+    ),
+    (
+        5,
+        "utilization rollups (app.analytics)",
+        (
+            # Loan-start hours whose loans changed since the last refresh;
+            # marked by process_scan_pair, drained by analytics.refresh_rollups
+            # (``changes`` tells a refresh whether the hour changed again meanwhile)
+            """
+            CREATE TABLE IF NOT EXISTS stats_dirty_hours(
+              hour TIMESTAMPTZ PRIMARY KEY,
+              changes BIGINT NOT NULL DEFAULT 1
+            )
+            """,
+            # Buckets are by loan start; duration stats cover returned loans
+            """
+            CREATE TABLE IF NOT EXISTS stats_tool_daily(
+              day DATE NOT NULL,
+              tool_uid TEXT NOT NULL,
+              loans INTEGER NOT NULL,
+              returned INTEGER NOT NULL,
+              total_sec DOUBLE PRECISION NOT NULL,
+              p95_sec DOUBLE PRECISION,
+              PRIMARY KEY (day, tool_uid)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stats_user_daily(
+              day DATE NOT NULL,
+              borrower_uid TEXT NOT NULL,
+              loans INTEGER NOT NULL,
+              returned INTEGER NOT NULL,
+              total_sec DOUBLE PRECISION NOT NULL,
+              p95_sec DOUBLE PRECISION,
+              PRIMARY KEY (day, borrower_uid)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stats_station_hourly(
+              hour TIMESTAMPTZ NOT NULL,
+              station_id TEXT NOT NULL,
+              loans INTEGER NOT NULL,
+              returned INTEGER NOT NULL,
+              total_sec DOUBLE PRECISION NOT NULL,
+              p95_sec DOUBLE PRECISION,
+              PRIMARY KEY (hour, station_id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS loans_loaned_at_idx ON loans(loaned_at)",
+            # Existing history is rolled up on the first refresh
+            """
+            INSERT INTO stats_dirty_hours(hour)
+            SELECT DISTINCT date_trunc('hour', loaned_at) FROM loans
+            ON CONFLICT DO NOTHING
+            """,
+        ),
+    ),
+    (
+        6,
+        "per-tool-name loan limits and overdue alerts",
+        (
+            # Hours a tool of this name may stay out (NULL: OVERDUE_AFTER_HOURS)
+            """
+            ALTER TABLE tool_master ADD COLUMN IF NOT EXISTS loan_limit_hours
+                DOUBLE PRECISION CHECK (loan_limit_hours > 0)
+            """,
+            # One alert per overdue loan; resolved_at is set once it is returned
+            """
+            CREATE TABLE IF NOT EXISTS overdue_alerts(
+              loan_id BIGINT PRIMARY KEY,
+              tool_uid TEXT NOT NULL,
+              borrower_uid TEXT NOT NULL,
+              loaned_at TIMESTAMPTZ NOT NULL,
+              limit_hours DOUBLE PRECISION NOT NULL,
+              detected_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+              resolved_at TIMESTAMPTZ
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS overdue_alerts_unresolved_idx
+                ON overdue_alerts(detected_at) WHERE resolved_at IS NULL
+            """,
+        ),
+    ),
+    (
+        7,
+        "scan pair details for near-duplicate suppression",
+        (
+            # A second (user, tool) pair within PAIR_DEDUP_SEC of a processed
+            # one is answered with its outcome instead of toggling the loan
+            # back (NULL for requests recorded before this migration)
+            "ALTER TABLE scan_pair_requests ADD COLUMN IF NOT EXISTS user_uid TEXT",
+            "ALTER TABLE scan_pair_requests ADD COLUMN IF NOT EXISTS tool_uid TEXT",
+            "ALTER TABLE scan_pair_requests ADD COLUMN IF NOT EXISTS station_id TEXT",
+            "ALTER TABLE scan_pair_requests ADD COLUMN IF NOT EXISTS scanned_at TIMESTAMPTZ",
+            """
+            CREATE INDEX IF NOT EXISTS scan_pair_requests_tool_scanned_idx
+                ON scan_pair_requests(tool_uid, scanned_at DESC) WHERE tool_uid IS NOT NULL
+            """,
+        ),
+    ),
+    (
+        8,
+        "scan_events partitioned by month",
+        (
+            # Rebuild as a partitioned table, keeping ids and the sequence
+            "ALTER TABLE scan_events RENAME TO scan_events_legacy",
+            "ALTER TABLE scan_events_legacy RENAME CONSTRAINT scan_events_pkey TO scan_events_legacy_pkey",
+            "ALTER SEQUENCE scan_events_id_seq OWNED BY NONE",
+            """
+            CREATE TABLE scan_events(
+              id BIGINT NOT NULL DEFAULT nextval('scan_events_id_seq'),
+              ts TIMESTAMPTZ NOT NULL DEFAULT now(),
+              station_id TEXT NOT NULL DEFAULT 'pi1',
+              tag_uid TEXT NOT NULL,
+              role_hint TEXT CHECK (role_hint IN ('user','tool') OR role_hint IS NULL),
+              PRIMARY KEY (id, ts)
+            ) PARTITION BY RANGE (ts)
+            """,
+            "ALTER SEQUENCE scan_events_id_seq OWNED BY scan_events.id",
+            # Rows outside every monthly partition (clock skew, a partition
+            # not created yet) land here instead of failing the insert
+            "CREATE TABLE scan_events_default PARTITION OF scan_events DEFAULT",
+            # Monthly partition scan_events_pYYYYMM for the UTC month of
+            # ``month_start``; rows of that month already in the default
+            # partition move into it. Idempotent (app.retention calls it ahead)
+            """
+            CREATE OR REPLACE FUNCTION scan_events_ensure_partition(month_start DATE)
+            RETURNS TEXT LANGUAGE plpgsql AS $$
+            DECLARE
+              lo TIMESTAMPTZ := date_trunc('month', month_start::timestamp) AT TIME ZONE 'UTC';
+              hi TIMESTAMPTZ := (date_trunc('month', month_start::timestamp) + interval '1 month')
+                                AT TIME ZONE 'UTC';
+              part TEXT := 'scan_events_p' || to_char(month_start, 'YYYYMM');
+            BEGIN
+              IF to_regclass(part) IS NOT NULL THEN
+                RETURN part;
+              END IF;
+              EXECUTE format(
+                'CREATE TABLE %I (LIKE scan_events INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part);
+              EXECUTE format(
+                'WITH moved AS (DELETE FROM scan_events_default WHERE ts >= %L AND ts < %L RETURNING *)
+                 INSERT INTO %I SELECT * FROM moved', lo, hi, part);
+              EXECUTE format(
+                'ALTER TABLE scan_events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                part, lo, hi);
+              RETURN part;
+            END
+            $$
+            """,
+            """
+            SELECT scan_events_ensure_partition(m::date)
+              FROM generate_series(
+                     date_trunc('month', COALESCE((SELECT min(ts) FROM scan_events_legacy), now())
+                                         AT TIME ZONE 'UTC'),
+                     date_trunc('month', now() AT TIME ZONE 'UTC') + interval '2 months',
+                     interval '1 month'
+                   ) AS m
+            """,
+            """
+            INSERT INTO scan_events(id, ts, station_id, tag_uid, role_hint)
+            SELECT id, ts, station_id, tag_uid, role_hint FROM scan_events_legacy
+            """,
+            "DROP TABLE scan_events_legacy",
+            # Same indexes as before, now per partition
+            "CREATE INDEX IF NOT EXISTS scan_events_ts_idx ON scan_events(ts)",
+            """
+            CREATE INDEX IF NOT EXISTS scan_events_station_ts_idx
+                ON scan_events(station_id, ts)
+            """,
+        ),
+    ),
+    (
+        9,
+        "loans_archive for old closed loans",
+        (
+            # Closed loans moved out of ``loans`` by app.retention (same ids)
+            """
+            CREATE TABLE IF NOT EXISTS loans_archive(
+              id BIGINT PRIMARY KEY,
+              tool_uid TEXT NOT NULL,
+              borrower_uid TEXT NOT NULL,
+              loaned_at TIMESTAMPTZ NOT NULL,
+              return_user_uid TEXT,
+              returned_at TIMESTAMPTZ NOT NULL,
+              station_id TEXT,
+              return_station_id TEXT,
+              archived_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """,
+            # Same history orderings as loans (fetch_loans_page with archived)
+            """
+            CREATE INDEX IF NOT EXISTS loans_archive_history_idx
+                ON loans_archive((COALESCE(returned_at, loaned_at)) DESC, id DESC)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS loans_archive_borrower_history_idx
+                ON loans_archive(borrower_uid, (COALESCE(returned_at, loaned_at)) DESC, id DESC)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS loans_archive_tool_history_idx
+                ON loans_archive(tool_uid, (COALESCE(returned_at, loaned_at)) DESC, id DESC)
+            """,
+            # Rollups rebuild whole days from loans_all (analytics)
+            "CREATE INDEX IF NOT EXISTS loans_archive_loaned_at_idx ON loans_archive(loaned_at)",
+            # Current and archived loans together
+            """
+            CREATE OR REPLACE VIEW loans_all AS
+            SELECT id, tool_uid, borrower_uid, loaned_at, return_user_uid, returned_at,
+                   station_id, return_station_id
+              FROM loans
+            UNION ALL
+            SELECT id, tool_uid, borrower_uid, loaned_at, return_user_uid, returned_at,
+                   station_id, return_station_id
+              FROM loans_archive
+            """,
+        ),
+    ),
+    (
+        10,
+        "UIDs stored as bytea",
+        (
+            # Raw tag bytes instead of hex text: half the size in every UID
+            # index (loans, scan_events, the users/tools keys) and bytewise
+            # comparisons. Hex with or without separators is decoded; any
+            # other legacy value keeps its text bytes. Kept for ad-hoc
+            # queries: WHERE uid = uid_to_bytea('04:A1:B2:C3')
+            """
+            CREATE OR REPLACE FUNCTION uid_to_bytea(uid TEXT)
+            RETURNS BYTEA LANGUAGE sql IMMUTABLE STRICT AS $$
+              SELECT CASE
+                       WHEN regexp_replace(uid, '[\\s:-]', '', 'g') ~ '^([0-9A-Fa-f]{2})+$'
+                       THEN decode(regexp_replace(uid, '[\\s:-]', '', 'g'), 'hex')
+                       ELSE convert_to(uid, 'UTF8')
+                     END
+            $$
+            """,
+            # The old reader path stored the same tag under several spellings
+            # (04a1b2c3 / 04A1B2C3 / 04:A1:B2:C3), which now become the same
+            # bytes. Registrations of one tag under different names can't be
+            # merged safely: stop with the list so they are fixed by hand
+            """
+            DO $$
+            DECLARE
+              report TEXT;
+            BEGIN
+              SELECT string_agg(format('%s %s: %s', kind, hex, entries), E'\\n' ORDER BY kind, hex)
+                INTO report
+                FROM (
+                  SELECT 'users' AS kind, upper(encode(uid_to_bytea(uid), 'hex')) AS hex,
+                         string_agg(format('%s=%s', uid, full_name), ', ' ORDER BY uid) AS entries
+                    FROM users GROUP BY uid_to_bytea(uid) HAVING count(DISTINCT full_name) > 1
+                  UNION ALL
+                  SELECT 'tools', upper(encode(uid_to_bytea(uid), 'hex')),
+                         string_agg(format('%s=%s', uid, name), ', ' ORDER BY uid)
+                    FROM tools GROUP BY uid_to_bytea(uid) HAVING count(DISTINCT name) > 1
+                ) conflicts;
+              IF report IS NOT NULL THEN
+                RAISE EXCEPTION 'UIDのbytea移行を中止: 同じタグが別々の名前で登録されています。不要な方を削除してから再起動してください'
+                  USING DETAIL = report;
+              END IF;
+            END
+            $$
+            """,
+            # Same name: keep one row per tag (the upper-case hex spelling
+            # if there is one), drop the other spellings
+            """
+            DELETE FROM users u
+             USING (
+                   SELECT uid, row_number() OVER (
+                            PARTITION BY uid_to_bytea(uid)
+                            ORDER BY uid = upper(regexp_replace(uid, '[\\s:-]', '', 'g')) DESC, uid
+                          ) AS n
+                     FROM users
+                   ) d
+             WHERE u.uid = d.uid AND d.n > 1
+            """,
+            """
+            DELETE FROM tools t
+             USING (
+                   SELECT uid, row_number() OVER (
+                            PARTITION BY uid_to_bytea(uid)
+                            ORDER BY uid = upper(regexp_replace(uid, '[\\s:-]', '', 'g')) DESC, uid
+                          ) AS n
+                     FROM tools
+                   ) d
+             WHERE t.uid = d.uid AND d.n > 1
+            """,
+            # One open loan per tag, as in migration 1: older duplicates are
+            # closed (return_user_uid stays NULL to mark the system close)
+            """
+            UPDATE loans l
+               SET returned_at = now()
+             WHERE l.returned_at IS NULL
+               AND EXISTS (
+                   SELECT 1 FROM loans n
+                    WHERE uid_to_bytea(n.tool_uid) = uid_to_bytea(l.tool_uid)
+                      AND n.returned_at IS NULL
+                      AND (n.loaned_at, n.id) > (l.loaned_at, l.id)
+               )
+            """,
+            # Rollups keyed by a tag spelling: drop the rows that would
+            # collide and have analytics.refresh_rollups rebuild the days of
+            # every loan of such a tag from loans_all
+            """
+            INSERT INTO stats_dirty_hours(hour)
+            SELECT DISTINCT date_trunc('hour', l.loaned_at)
+              FROM loans_all l
+             WHERE uid_to_bytea(l.tool_uid) IN (
+                     SELECT uid_to_bytea(tool_uid) FROM stats_tool_daily
+                   GROUP BY day, uid_to_bytea(tool_uid) HAVING count(*) > 1)
+                OR uid_to_bytea(l.borrower_uid) IN (
+                     SELECT uid_to_bytea(borrower_uid) FROM stats_user_daily
+                   GROUP BY day, uid_to_bytea(borrower_uid) HAVING count(*) > 1)
+            ON CONFLICT (hour) DO UPDATE SET changes = stats_dirty_hours.changes + 1
+            """,
+            """
+            DELETE FROM stats_tool_daily s
+             USING (
+                   SELECT day, uid_to_bytea(tool_uid) AS uid FROM stats_tool_daily
+                 GROUP BY day, uid_to_bytea(tool_uid) HAVING count(*) > 1
+                   ) c
+             WHERE s.day = c.day AND uid_to_bytea(s.tool_uid) = c.uid
+            """,
+            """
+            DELETE FROM stats_user_daily s
+             USING (
+                   SELECT day, uid_to_bytea(borrower_uid) AS uid FROM stats_user_daily
+                 GROUP BY day, uid_to_bytea(borrower_uid) HAVING count(*) > 1
+                   ) c
+             WHERE s.day = c.day AND uid_to_bytea(s.borrower_uid) = c.uid
+            """,
+            "DROP VIEW IF EXISTS loans_all",
+            """
+            ALTER TABLE users
+                ALTER COLUMN uid TYPE BYTEA USING uid_to_bytea(uid)
+            """,
+            """
+            ALTER TABLE tools
+                ALTER COLUMN uid TYPE BYTEA USING uid_to_bytea(uid)
+            """,
+            """
+            ALTER TABLE loans
+                ALTER COLUMN tool_uid TYPE BYTEA USING uid_to_bytea(tool_uid),
+                ALTER COLUMN borrower_uid TYPE BYTEA USING uid_to_bytea(borrower_uid),
+                ALTER COLUMN return_user_uid TYPE BYTEA USING uid_to_bytea(return_user_uid)
+            """,
+            """
+            ALTER TABLE loans_archive
+                ALTER COLUMN tool_uid TYPE BYTEA USING uid_to_bytea(tool_uid),
+                ALTER COLUMN borrower_uid TYPE BYTEA USING uid_to_bytea(borrower_uid),
+                ALTER COLUMN return_user_uid TYPE BYTEA USING uid_to_bytea(return_user_uid)
+            """,
+            """
+            ALTER TABLE scan_events
+                ALTER COLUMN tag_uid TYPE BYTEA USING uid_to_bytea(tag_uid)
+            """,
+            """
+            ALTER TABLE scan_pair_requests
+                ALTER COLUMN user_uid TYPE BYTEA USING uid_to_bytea(user_uid),
+                ALTER COLUMN tool_uid TYPE BYTEA USING uid_to_bytea(tool_uid)
+            """,
+            """
+            ALTER TABLE overdue_alerts
+                ALTER COLUMN tool_uid TYPE BYTEA USING uid_to_bytea(tool_uid),
+                ALTER COLUMN borrower_uid TYPE BYTEA USING uid_to_bytea(borrower_uid)
+            """,
+            """
+            ALTER TABLE stats_tool_daily
+                ALTER COLUMN tool_uid TYPE BYTEA USING uid_to_bytea(tool_uid)
+            """,
+            """
+            ALTER TABLE stats_user_daily
+                ALTER COLUMN borrower_uid TYPE BYTEA USING uid_to_bytea(borrower_uid)
+            """,
+            """
+            CREATE VIEW loans_all AS
+            SELECT id, tool_uid, borrower_uid, loaned_at, return_user_uid, returned_at,
+                   station_id, return_station_id
+              FROM loans
+            UNION ALL
+            SELECT id, tool_uid, borrower_uid, loaned_at, return_user_uid, returned_at,
+                   station_id, return_station_id
+              FROM loans_archive
+            """,
+        ),
+    ),
+    (
+        11,
+        "overdue count per rollup bucket",
+        (
+            # Loans open past their due time at the end of the bucket
+            """
+            ALTER TABLE stats_tool_daily
+                ADD COLUMN IF NOT EXISTS overdue INTEGER NOT NULL DEFAULT 0
+            """,
+            """
+            ALTER TABLE stats_user_daily
+                ADD COLUMN IF NOT EXISTS overdue INTEGER NOT NULL DEFAULT 0
+            """,
+            """
+            ALTER TABLE stats_station_hourly
+                ADD COLUMN IF NOT EXISTS overdue INTEGER NOT NULL DEFAULT 0
+            """,
+            # Rebuild every hour a loan may have been overdue in. The default
+            # limit lives in the app config, so a loan without a per-name
+            # limit counts from its start
+            """
+            INSERT INTO stats_dirty_hours(hour)
+            SELECT DISTINCT generate_series(
+                       date_trunc('hour', l.loaned_at
+                                  + COALESCE(m.loan_limit_hours, 0) * interval '1 hour'),
+                       date_trunc('hour', COALESCE(l.returned_at, now())),
+                       interval '1 hour'
+                   )
+              FROM loans_all l
+         LEFT JOIN tools t ON t.uid = l.tool_uid
+         LEFT JOIN tool_master m ON m.name = t.name
+            ON CONFLICT (hour) DO UPDATE SET changes = stats_dirty_hours.changes + 1
+            """,
+        ),
+    ),
+]
+
+# Version a fully migrated database records last in schema_migrations
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(cur) -> int | None:
+    """Highest applied migration, or None before the first one."""
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute("SELECT max(version) FROM schema_migrations")
+    return cur.fetchone()[0]
+
+
+def apply_migrations(cur) -> list[int]:
+    """Apply pending migrations with ``cur``; returns the versions applied.
+
+    The caller owns the transaction (commit/rollback).
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations(
+          version INTEGER PRIMARY KEY,
+          description TEXT NOT NULL,
+          applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    cur.execute("SELECT version FROM schema_migrations")
+    done = {r[0] for r in cur.fetchall()}
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in done:
+            continue
+        for sql in statements:
+            cur.execute(sql)
+        cur.execute(
+            "INSERT INTO schema_migrations(version, description) VALUES (%s,%s)",
+            (version, description),
+        )
+        applied.append(version)
+    return applied
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import json
+import select
+import threading
+import time
+from typing import Callable
+
+import socketio
+from flask_socketio import SocketIO
+from psycopg2 import sql
+
+from .metrics import EMIT_SECONDS
+
+
+# NOTIFY payloads must stay below 8000 bytes
+NOTIFY_PAYLOAD_MAX = 7900
+
+
+class PostgresManager(socketio.PubSubManager):
+    """Socket.IO client manager that fans events out over PostgreSQL NOTIFY.
+
+    Lets several server processes (and the standalone scanner) broadcast to
+    every connected browser without running Redis: each emit is one
+    ``pg_notify`` on ``channel`` and every process LISTENs on a dedicated
+    connection. While the DB is unreachable emits are dropped (logged) so a
+    scan is never blocked by UI fan-out; dashboards resync on reconnect.
+    """
+
+    name = "postgresql"
+
+    def __init__(
+        self,
+        connect: Callable,
+        channel: str = "socketio",
+        write_only: bool = False,
+        logger=None,
+        reconnect_delay: float = 5.0,
+    ):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._connect = connect
+        self.reconnect_delay = reconnect_delay
+        self._pub_conn = None
+        self._pub_lock = threading.Lock()
+        self.dropped = 0
+
+    def _publish(self, data) -> None:
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        if len(payload.encode()) > NOTIFY_PAYLOAD_MAX:
+            self.dropped += 1
+            print(f"⚠️ Socket.IO配信が大きすぎるため破棄: {data.get('event')} ({len(payload)}文字)")
+            return
+        with self._pub_lock:
+            for attempt in (1, 2):
+                try:
+                    if self._pub_conn is None or self._pub_conn.closed:
+                        self._pub_conn = self._connect()
+                        self._pub_conn.autocommit = True
+                    with self._pub_conn.cursor() as cur:
+                        cur.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+                    return
+                except Exception as e:  # noqa: BLE001
+                    self._close_pub()
+                    if attempt == 2:
+                        self.dropped += 1
+                        print(f"⚠️ Socket.IO配信に失敗（破棄）: {e}")
+
+    def _close_pub(self) -> None:
+        conn, self._pub_conn = self._pub_conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:  # noqa: BLE001
+                pass
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+                while True:
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        yield conn.notifies.pop(0).payload
+            except Exception as e:  # noqa: BLE001
+                print(f"⚠️ Socket.IO LISTEN接続エラー（{self.reconnect_delay:.0f}秒後に再接続）: {e}")
+                time.sleep(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:  # noqa: BLE001
+                        pass
+
+
+def make_client_manager(url: str, write_only: bool = False):
+    """Socket.IO client manager for SOCKETIO_MESSAGE_QUEUE (None: in-process)."""
+    if not url:
+        return None
+    if url in ("postgresql", "postgres", "pg"):
+        from .db import connect
+
+        return PostgresManager(connect, write_only=write_only)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return socketio.RedisManager(url, write_only=write_only)  # needs `redis`
+    return socketio.KombuManager(url, write_only=write_only)  # needs `kombu`
+
+
+class TimedSocketIO(SocketIO):
+    """SocketIO whose emits are timed per event into socketio_emit_seconds."""
+
+    def emit(self, event, *args, **kwargs):
+        with EMIT_SECONDS.time(event=event):
+            return super().emit(event, *args, **kwargs)
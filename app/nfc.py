@@ -1,27 +1,323 @@
-from smartcard.CardRequest import CardRequest
-from smartcard.util import toHexString
+from __future__ import annotations
+
+import queue
+import threading
+import time
+
+from .config import NFC_BACKEND, NFC_READER, NFC_READERS
+from .logs import log_event
+from .metrics import NFC_ERRORS, NFC_READ_SECONDS, NFC_TIMEOUTS
+from .uid import Uid
 
 
 GET_UID = [0xFF, 0xCA, 0x00, 0x00, 0x00]  # PC/SC: GET DATA (UID/IDm)
 
 
-def read_one_uid(timeout: int = 3) -> str | None:
-    """Read a single NFC tag UID via PC/SC.
+class NfcError(RuntimeError):
+    """Reader/PC/SC failure (no reader, pcscd restarted, reader unplugged...)."""
+
 
-    Returns uppercase hex string with no spaces or None on timeout.
+class PcscReader:
+    """PC/SC reader driven by blocking SCardGetStatusChange waits.
+
+    Keeps one long-lived context and reacts to the card-present transition the
+    moment pcscd reports it, instead of polling with short CardRequest timeouts.
+    Like ``CardRequest(newcardonly=True)``, a card already on the reader when
+    watching starts is ignored until it is removed and presented again.
     """
-    try:
-        cs = CardRequest(timeout=timeout, newcardonly=True).waitforcard()
-        if cs is None:
+
+    def __init__(self, reader: str | None = None):
+        from smartcard import scard  # lazy: pyscard is only needed with real hardware
+
+        self._sc = scard
+        self.reader_hint = reader or None
+        self.reader: str | None = None
+        self._ctx = None
+        self._state = scard.SCARD_STATE_UNAWARE
+
+    @property
+    def name(self) -> str:
+        return self.reader or self.reader_hint or "pcsc"
+
+    def _check(self, hr, what: str) -> None:
+        if hr != self._sc.SCARD_S_SUCCESS:
+            raise NfcError(f"{what}: {self._sc.SCardGetErrorMessage(hr)}")
+
+    def _ensure_context(self) -> None:
+        sc = self._sc
+        if self._ctx is None:
+            hr, ctx = sc.SCardEstablishContext(sc.SCARD_SCOPE_USER)
+            self._check(hr, "SCardEstablishContext")
+            self._ctx = ctx
+            self.reader = None
+        if self.reader is None:
+            hr, readers = sc.SCardListReaders(self._ctx, [])
+            if hr != sc.SCARD_S_SUCCESS or not readers:
+                raise NfcError("NFCリーダーが見つかりません")
+            matches = [r for r in readers if not self.reader_hint or self.reader_hint in r]
+            if not matches:
+                raise NfcError(f"NFCリーダー '{self.reader_hint}' が見つかりません: {readers}")
+            self.reader = matches[0]
+            self._state = sc.SCARD_STATE_UNAWARE
+
+    def wait_for_uid(self, timeout: float) -> str | None:
+        """Block until a new card is presented; returns its UID or None on timeout."""
+        sc = self._sc
+        self._ensure_context()
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining_ms = max(0, int((deadline - time.monotonic()) * 1000))
+            hr, states = sc.SCardGetStatusChange(
+                self._ctx, remaining_ms, [(self.reader, self._state)]
+            )
+            if hr in (sc.SCARD_E_TIMEOUT, sc.SCARD_E_CANCELLED):
+                return None
+            if hr != sc.SCARD_S_SUCCESS:
+                self.reset()
+                self._check(hr, "SCardGetStatusChange")
+
+            _reader, event_state, _atr = states[0]
+            previous = self._state
+            self._state = event_state & ~sc.SCARD_STATE_CHANGED
+            if event_state & (sc.SCARD_STATE_UNKNOWN | sc.SCARD_STATE_UNAVAILABLE):
+                self.reset()
+                raise NfcError(f"NFCリーダーが切断されました: {self.reader}")
+
+            present = event_state & sc.SCARD_STATE_PRESENT
+            if (
+                present
+                and previous != sc.SCARD_STATE_UNAWARE
+                and not previous & sc.SCARD_STATE_PRESENT
+                and not event_state & sc.SCARD_STATE_MUTE
+            ):
+                with NFC_READ_SECONDS.time(reader=self.name):
+                    uid = self._read_uid()
+                if uid:
+                    return uid
+            if remaining_ms == 0:
+                return None
+
+    def _read_uid(self) -> Uid | None:
+        sc = self._sc
+        hr, hcard, protocol = sc.SCardConnect(
+            self._ctx,
+            self.reader,
+            sc.SCARD_SHARE_SHARED,
+            sc.SCARD_PROTOCOL_T0 | sc.SCARD_PROTOCOL_T1,
+        )
+        if hr != sc.SCARD_S_SUCCESS:
+            return None  # tag already gone
+        try:
+            hr, response = sc.SCardTransmit(hcard, protocol, GET_UID)
+        finally:
+            sc.SCardDisconnect(hcard, sc.SCARD_LEAVE_CARD)
+        if hr != sc.SCARD_S_SUCCESS or len(response) <= 2:
             return None
-        cs.connection.connect()
-        data, sw1, sw2 = cs.connection.transmit(GET_UID)
-        cs.connection.disconnect()
-        if ((sw1 << 8) | sw2) == 0x9000 and data:
-            return toHexString(data).replace(" ", "")
-    except Exception as e:
-        # Expected timeouts shouldn't spam logs
-        if "Time-out" not in str(e) and "Command timeout" not in str(e):
-            print(f"スキャンエラー: {e}")
-    return None
+        data, sw = response[:-2], (response[-2] << 8) | response[-1]
+        if sw != 0x9000:
+            return None
+        try:
+            return Uid(data)
+        except ValueError:
+            # Not a 4/7/10-byte UID or an IDm: a misread, not a tag to act on
+            log_event("uid_invalid", reader=self.name, uid=bytes(data).hex().upper())
+            return None
+
+    def cancel(self) -> None:
+        """Wake up a blocked ``wait_for_uid`` (from another thread)."""
+        if self._ctx is not None:
+            self._sc.SCardCancel(self._ctx)
+
+    def reset(self) -> None:
+        ctx, self._ctx, self.reader = self._ctx, None, None
+        if ctx is not None:
+            try:
+                self._sc.SCardReleaseContext(ctx)
+            except Exception:  # noqa: BLE001
+                pass
+
+    close = reset
+
+
+class FakeReader:
+    """In-memory reader for development and tests: ``tap(uid)`` presents a tag."""
+
+    def __init__(self, name: str = "fake"):
+        self.name = name
+        self._taps: queue.Queue[str | None] = queue.Queue()
+
+    def tap(self, uid: str) -> None:
+        self._taps.put(Uid(uid))
+
+    def wait_for_uid(self, timeout: float) -> str | None:
+        try:
+            return self._taps.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def cancel(self) -> None:
+        self._taps.put(None)
+
+    def reset(self) -> None:
+        pass
+
+    close = reset
+
 
+def make_reader(backend: str = NFC_BACKEND, reader: str | None = NFC_READER):
+    if backend == "fake":
+        return FakeReader(reader or "fake")
+    if backend == "pcsc":
+        return PcscReader(reader)
+    raise ValueError(f"unknown NFC_BACKEND: {backend!r}")
+
+
+class ReaderSession:
+    """Owns one reader and pushes UIDs into a queue as soon as tags are presented.
+
+    A single daemon thread blocks on the reader; consumers call ``get()``.
+    Reader errors (unplugged, pcscd restart) are retried every
+    ``retry_delay`` seconds without spamming the log.
+    """
+
+    def __init__(self, reader, wait_timeout: float = 5.0, retry_delay: float = 3.0):
+        self.reader = reader
+        self.wait_timeout = wait_timeout
+        self.retry_delay = retry_delay
+        self._uids: queue.Queue[tuple[str, float]] = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.last_error = ""
+
+    def start(self) -> "ReaderSession":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.reader.cancel()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                uid = self.reader.wait_for_uid(self.wait_timeout)
+            except Exception as e:  # noqa: BLE001
+                NFC_ERRORS.inc(reader=self.reader.name)
+                if str(e) != self.last_error:
+                    print(f"スキャンエラー: {e}")
+                    log_event("reader_error", reader=self.reader.name, error=str(e))
+                    self.last_error = str(e)
+                self._stop.wait(self.retry_delay)
+                continue
+            if self.last_error:
+                print(f"✅ NFCリーダー復帰: {self.reader.name}")
+                log_event("reader_recovered", reader=self.reader.name)
+                self.last_error = ""
+            if uid:
+                self._uids.put((uid, time.monotonic()))
+            else:
+                NFC_TIMEOUTS.inc(reader=self.reader.name)
+
+    def get(self, timeout: float | None = None, max_age: float | None = None) -> str | None:
+        """Next UID, or None after ``timeout``; taps older than ``max_age`` are skipped."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                uid, at = self._uids.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if max_age is None or time.monotonic() - at <= max_age:
+                return uid
+
+    def drain(self) -> None:
+        """Discard taps made while nobody was listening."""
+        while True:
+            try:
+                self._uids.get_nowait()
+            except queue.Empty:
+                return
+
+
+def list_readers(backend: str = NFC_BACKEND) -> list[str]:
+    """Names of the attached readers (fake backend: the configured names)."""
+    if backend == "fake":
+        names = [n.strip().partition("=")[0] for n in NFC_READERS.split(",") if n.strip()]
+        return [n for n in names if n and n != "all"] or [NFC_READER or "fake"]
+    from smartcard import scard
+
+    hr, ctx = scard.SCardEstablishContext(scard.SCARD_SCOPE_USER)
+    if hr != scard.SCARD_S_SUCCESS:
+        raise NfcError(f"SCardEstablishContext: {scard.SCardGetErrorMessage(hr)}")
+    try:
+        hr, readers = scard.SCardListReaders(ctx, [])
+        return list(readers) if hr == scard.SCARD_S_SUCCESS else []
+    finally:
+        scard.SCardReleaseContext(ctx)
+
+
+def reader_specs(spec: str = NFC_READERS, backend: str = NFC_BACKEND) -> list[tuple[str, str | None]]:
+    """Parse NFC_READERS into ``(reader name, role)`` pairs.
+
+    - ""  -> the single reader selected by NFC_READER (previous behaviour)
+    - "all" -> every attached reader, each with its own scan state machine
+    - "RC-S300 (01)=user,RC-S300 (02)=tool,..." -> reader name substrings,
+      optionally pinned to the ``user`` or ``tool`` role
+    """
+    spec = spec.strip()
+    if not spec:
+        return [(NFC_READER, None)]
+    available = list_readers(backend)
+    if spec == "all":
+        if not available:
+            raise NfcError("NFCリーダーが見つかりません")
+        return [(name, None) for name in available]
+
+    specs = []
+    for item in spec.split(","):
+        hint, _, role = item.strip().partition("=")
+        hint, role = hint.strip(), (role.strip().lower() or None)
+        if not hint:
+            continue
+        if role not in (None, "user", "tool"):
+            raise ValueError(f"NFC_READERS: role must be 'user' or 'tool': {item!r}")
+        matches = [name for name in available if hint in name]
+        if not matches:
+            raise NfcError(f"NFCリーダー '{hint}' が見つかりません: {available}")
+        specs.append((matches[0], role))
+    return specs
+
+
+_sessions: dict[str, ReaderSession] = {}
+_default_reader: str | None = None
+_session_lock = threading.Lock()
+
+
+def get_session(reader: str | None = None) -> ReaderSession:
+    """Reader session for ``reader`` (default: the first configured reader).
+
+    Sessions are process-wide and started on first use, so the scan loop and
+    the manual scan endpoints share the same reader.
+    """
+    global _default_reader
+    with _session_lock:
+        if reader is None:
+            if _default_reader is None:
+                _default_reader = reader_specs()[0][0]
+            reader = _default_reader
+        session = _sessions.get(reader)
+        if session is None:
+            session = _sessions[reader] = ReaderSession(make_reader(reader=reader)).start()
+        return session
+
+
+def read_one_uid(timeout: int = 3) -> str | None:
+    """Read a single NFC tag UID via the shared reader session.
+
+    Returns the UID (uppercase hex, see ``app.uid.Uid``) or None on timeout.
+    """
+    session = get_session()
+    session.drain()
+    return session.get(timeout=timeout)
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import select
+import threading
+from typing import Callable
+
+
+class NotifyListener:
+    """Dedicated PostgreSQL connection that dispatches LISTEN/NOTIFY payloads.
+
+    Runs in a daemon thread and reconnects with a delay when the DB goes away.
+    ``on_reconnect`` callbacks fire after a reconnect (not the first connect) so
+    subscribers can drop state that may have missed notifications meanwhile.
+    Channels subscribed after ``start()`` are LISTENed within a second.
+    """
+
+    def __init__(self, connect: Callable, reconnect_delay: float = 5.0):
+        self._connect = connect
+        self.reconnect_delay = reconnect_delay
+        self._handlers: dict[str, list[Callable[[str], None]]] = {}
+        self._reconnect_handlers: list[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self.connected = False
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        with self._lock:
+            self._handlers.setdefault(channel, []).append(callback)
+
+    def on_reconnect(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            self._reconnect_handlers.append(callback)
+
+    def start(self) -> threading.Thread:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        first = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                with self._lock:
+                    channels = list(self._handlers)
+                    reconnect_handlers = list(self._reconnect_handlers)
+                listening = self._listen(conn, channels, set())
+                self.connected = True
+                if not first:
+                    for cb in reconnect_handlers:
+                        cb()
+                first = False
+
+                while not self._stop.is_set():
+                    with self._lock:
+                        channels = list(self._handlers)
+                    if len(channels) != len(listening):
+                        listening = self._listen(conn, channels, listening)
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        n = conn.notifies.pop(0)
+                        self._dispatch(n.channel, n.payload)
+            except Exception as e:  # noqa: BLE001
+                self.connected = False
+                print(f"⚠️ LISTEN接続エラー（{self.reconnect_delay:.0f}秒後に再接続）: {e}")
+                self._stop.wait(self.reconnect_delay)
+            finally:
+                self.connected = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:  # noqa: BLE001
+                        pass
+
+    @staticmethod
+    def _listen(conn, channels: list[str], listening: set[str]) -> set[str]:
+        with conn.cursor() as cur:
+            for channel in channels:
+                if channel not in listening:
+                    cur.execute(f'LISTEN "{channel}"')
+        return set(channels)
+
+    def _dispatch(self, channel: str, payload: str) -> None:
+        with self._lock:
+            handlers = list(self._handlers.get(channel, ()))
+        for cb in handlers:
+            try:
+                cb(payload)
+            except Exception as e:  # noqa: BLE001
+                print(f"⚠️ NOTIFY処理エラー ({channel}): {e}")
+
+
+_listener: NotifyListener | None = None
+_listener_lock = threading.Lock()
+
+
+def get_listener() -> NotifyListener:
+    """Process-wide listener (``start()`` is idempotent)."""
+    global _listener
+    if _listener is None:
+        with _listener_lock:
+            if _listener is None:
+                from .db import connect
+
+                _listener = NotifyListener(connect)
+    return _listener
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import threading
+
+from flask_socketio import SocketIO
+
+from .config import OVERDUE_AFTER_HOURS, OVERDUE_CHECK_SEC
+from .metrics import timed_query
+from .scheduler import PeriodicJob
+
+
+# One round trip per check. Candidates come from a range scan of the
+# open-loan index (loans_open_loaned_at_idx) up to the shortest configured
+# limit, so the cost grows with the number of long-open loans, not with the
+# size of ``loans``. Newly overdue loans are recorded (ON CONFLICT: once per
+# loan, even with several stations checking) and alerts of returned loans are
+# resolved in the same statement.
+_CHECK_SQL = """
+WITH horizon AS (
+    SELECT now() - LEAST(%(default)s, COALESCE(min(loan_limit_hours), %(default)s))
+                   * interval '1 hour' AS t
+      FROM tool_master
+), candidates AS (
+    SELECT l.id, l.tool_uid, l.borrower_uid, l.loaned_at,
+           COALESCE(m.loan_limit_hours, %(default)s) AS limit_hours
+      FROM loans l
+ LEFT JOIN tools t ON t.uid=l.tool_uid
+ LEFT JOIN tool_master m ON m.name=t.name
+     WHERE l.returned_at IS NULL
+       AND l.loaned_at < (SELECT t FROM horizon)
+), inserted AS (
+    INSERT INTO overdue_alerts(loan_id, tool_uid, borrower_uid, loaned_at, limit_hours)
+    SELECT id, tool_uid, borrower_uid, loaned_at, limit_hours
+      FROM candidates
+     WHERE loaned_at < now() - limit_hours * interval '1 hour'
+    ON CONFLICT (loan_id) DO NOTHING
+ RETURNING loan_id, tool_uid, borrower_uid, loaned_at, limit_hours
+), resolved AS (
+    UPDATE overdue_alerts a
+       SET resolved_at=l.returned_at
+      FROM loans l
+     WHERE a.resolved_at IS NULL
+       AND l.id=a.loan_id
+       AND l.returned_at IS NOT NULL
+ RETURNING a.loan_id
+)
+SELECT 'new', i.loan_id, COALESCE(t.name, upper(encode(i.tool_uid, 'hex'))),
+       COALESCE(u.full_name, upper(encode(i.borrower_uid, 'hex'))),
+       i.loaned_at, i.limit_hours
+  FROM inserted i
+  LEFT JOIN tools t ON t.uid=i.tool_uid
+  LEFT JOIN users u ON u.uid=i.borrower_uid
+UNION ALL
+SELECT 'resolved', loan_id, NULL, NULL, NULL, NULL FROM resolved
+UNION ALL
+SELECT 'scanned', count(*), NULL, NULL, NULL, NULL FROM candidates
+"""
+
+
+def _serialize_alert(loan_id, tool, borrower, loaned_at, limit_hours) -> dict:
+    return {
+        "loan_id": loan_id,
+        "tool": tool,
+        "borrower": borrower,
+        "loaned_at": loaned_at.isoformat(),
+        "limit_hours": limit_hours,
+    }
+
+
+@timed_query("check_overdue")
+def check_overdue(conn, default_hours: float = OVERDUE_AFTER_HOURS) -> dict:
+    """Record newly overdue loans and resolve returned ones.
+
+    Returns ``{"new": [alert...], "resolved": [loan_id...], "scanned": n}``
+    where ``scanned`` is the number of open loans the check had to look at.
+    """
+    result: dict = {"new": [], "resolved": [], "scanned": 0}
+    conn.rollback()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(_CHECK_SQL, {"default": default_hours})
+            rows = cur.fetchall()
+    finally:
+        conn.autocommit = autocommit
+    for kind, loan_id, tool, borrower, loaned_at, limit_hours in rows:
+        if kind == "new":
+            result["new"].append(_serialize_alert(loan_id, tool, borrower, loaned_at, limit_hours))
+        elif kind == "resolved":
+            result["resolved"].append(loan_id)
+        else:
+            result["scanned"] = loan_id
+    return result
+
+
+def fetch_open_alerts(conn, limit: int = 200) -> list[dict]:
+    """Unresolved alerts, oldest loan first."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT a.loan_id, COALESCE(t.name, upper(encode(a.tool_uid, 'hex'))),
+                   COALESCE(u.full_name, upper(encode(a.borrower_uid, 'hex'))),
+                   a.loaned_at, a.limit_hours, a.detected_at
+              FROM overdue_alerts a
+         LEFT JOIN tools t ON t.uid=a.tool_uid
+         LEFT JOIN users u ON u.uid=a.borrower_uid
+             WHERE a.resolved_at IS NULL
+          ORDER BY a.loaned_at
+             LIMIT %s
+            """,
+            (limit,),
+        )
+        rows = cur.fetchall()
+    return [
+        {**_serialize_alert(*r[:5]), "detected_at": r[5].isoformat()}
+        for r in rows
+    ]
+
+
+def set_loan_limit(conn, name: str, hours: float | None) -> bool:
+    """Set (or clear with None) the loan limit of a tool name; False if unknown."""
+    from .db import bump_versions
+
+    with conn, conn.cursor() as cur:
+        cur.execute("UPDATE tool_master SET loan_limit_hours=%s WHERE name=%s", (hours, name))
+        if not cur.rowcount:
+            return False
+        bump_versions(cur, "tool_names")
+    return True
+
+
+def list_loan_limits(conn) -> dict[str, float]:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT name, loan_limit_hours FROM tool_master WHERE loan_limit_hours IS NOT NULL"
+        )
+        return dict(cur.fetchall())
+
+
+_detector: PeriodicJob | None = None
+_detector_lock = threading.Lock()
+
+
+def get_overdue_detector(sock: SocketIO | None = None) -> PeriodicJob:
+    """Process-wide overdue check job; emits ``overdue`` / ``overdue_resolved``."""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                from . import socketio as socketio_ext
+                from .db import get_conn
+
+                sio = sock or socketio_ext
+
+                def _check() -> dict:
+                    with get_conn() as conn:
+                        result = check_overdue(conn)
+                    if result["new"]:
+                        for alert in result["new"]:
+                            print(f"⏰ 期限超過: {alert['tool']} / {alert['borrower']}")
+                        sio.emit("overdue", {"alerts": result["new"]})
+                    if result["resolved"]:
+                        sio.emit("overdue_resolved", {"loan_ids": result["resolved"]})
+                    return {
+                        "new": len(result["new"]),
+                        "resolved": len(result["resolved"]),
+                        "scanned": result["scanned"],
+                    }
+
+                _detector = PeriodicJob("期限超過チェック", _check, OVERDUE_CHECK_SEC)
+    return _detector
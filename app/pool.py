@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable
+
+
+class PoolExhausted(RuntimeError):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of DB-API connections.
+
+    - Holds at most ``maxconn`` connections (idle + checked out)
+    - Idle connections are health-checked on checkout when they have been
+      unused for ``check_after`` seconds, and dropped if broken (e.g. after a
+      PostgreSQL restart) so a fresh one is opened transparently
+    - Idle connections beyond ``minconn`` are closed after ``idle_timeout``
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        minconn: int = 1,
+        maxconn: int = 5,
+        timeout: float = 5.0,
+        idle_timeout: float = 300.0,
+        check_after: float = 30.0,
+        is_disconnect: Callable[[BaseException], bool] | None = None,
+    ):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError("invalid pool size: need 0 <= minconn <= maxconn, maxconn >= 1")
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self._is_disconnect = is_disconnect or (lambda _e: False)
+
+        self._cond = threading.Condition()
+        self._idle: deque[tuple[Any, float]] = deque()  # (conn, last_used)
+        self._size = 0  # idle + checked out + being opened
+        self._closed = False
+
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "evicted": 0,
+            "exhausted": 0,
+            "health_check_failures": 0,
+            "wait_time_total_sec": 0.0,
+            "wait_time_max_sec": 0.0,
+        }
+
+    # ------------------------------------------------------------------ checkout
+
+    def getconn(self):
+        """Check out a connection, waiting up to ``timeout`` seconds."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            conn, last_used, must_open = self._reserve(deadline)
+            if must_open:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+            elif not self._is_healthy(conn, last_used):
+                self._close_quietly(conn)
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                    self._stats["discarded"] += 1
+                    self._size -= 1
+                    self._cond.notify()
+                continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._stats["checkouts"] += 1
+                self._stats["wait_time_total_sec"] += waited
+                if waited > self._stats["wait_time_max_sec"]:
+                    self._stats["wait_time_max_sec"] = waited
+            return conn
+
+    def _reserve(self, deadline: float):
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("connection pool is closed")
+                self._evict_idle_locked()
+                if self._idle:
+                    conn, last_used = self._idle.pop()  # LIFO keeps hot connections warm
+                    return conn, last_used, False
+                if self._size < self.maxconn:
+                    self._size += 1
+                    return None, 0.0, True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["exhausted"] += 1
+                    raise PoolExhausted(
+                        f"DB接続プールが枯渇しました（最大 {self.maxconn} 接続, {self.timeout:.1f}秒待機）"
+                    )
+                self._cond.wait(remaining)
+
+    def _release_slot(self) -> None:
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if getattr(conn, "closed", 0):
+            return False
+        if time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            conn.rollback()
+            return True
+        except Exception:  # noqa: BLE001
+            return False
+
+    # ------------------------------------------------------------------ return
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        """Return a connection; broken or discarded connections are closed."""
+        if not discard and not getattr(conn, "closed", 0):
+            try:
+                # Never hand out a connection with a dangling transaction
+                if not getattr(conn, "autocommit", False):
+                    conn.rollback()
+            except Exception:  # noqa: BLE001
+                discard = True
+        else:
+            discard = True
+
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+                self._stats["discarded"] += 1
+                to_close = conn
+            else:
+                self._idle.append((conn, time.monotonic()))
+                to_close = None
+            self._cond.notify()
+        if to_close is not None:
+            self._close_quietly(to_close)
+
+    @contextmanager
+    def connection(self):
+        """``with pool.connection() as conn:`` — always returns the connection."""
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except Exception as e:
+            discard = self._is_disconnect(e) or bool(getattr(conn, "closed", 0))
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    # ------------------------------------------------------------------ maintenance
+
+    def fill(self) -> None:
+        """Open connections up to ``minconn`` (best effort)."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:  # noqa: BLE001
+                self._release_slot()
+                return
+            with self._cond:
+                self._stats["created"] += 1
+                self._idle.appendleft((conn, time.monotonic()))
+                self._cond.notify()
+
+    def _evict_idle_locked(self) -> None:
+        if not self.idle_timeout:
+            return
+        cutoff = time.monotonic() - self.idle_timeout
+        # Oldest idle connections sit at the left end
+        while self._idle and self._size > self.minconn and self._idle[0][1] < cutoff:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._stats["evicted"] += 1
+            self._close_quietly(conn)
+
+    def closeall(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            s = dict(self._stats)
+            s.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                min=self.minconn,
+                max=self.maxconn,
+            )
+        return s
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:  # noqa: BLE001
+            pass
+
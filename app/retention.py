@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import gzip
+import os
+import re
+import threading
+import time
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+import psycopg2
+import psycopg2.errors
+
+from .config import (
+    LOAN_ARCHIVE_BATCH,
+    LOAN_ARCHIVE_MONTHS,
+    PAIR_REQUEST_KEEP_DAYS,
+    RETENTION_CHECK_SEC,
+    SCAN_ARCHIVE_DIR,
+    SCAN_PARTITIONS_AHEAD,
+    SCAN_RETENTION_MONTHS,
+)
+from .logs import log_event
+from .metrics import timed_query
+from .scheduler import PeriodicJob
+
+
+# pg_try_advisory_lock key: one maintenance run at a time across all stations
+RETENTION_LOCK_ID = 7_262_004
+
+_PARTITION_NAME = re.compile(r"^scan_events_p(\d{4})(\d{2})$")
+
+
+def _month_start(today: date, months_back: int = 0) -> date:
+    """First day of the month ``months_back`` months before ``today``'s."""
+    index = today.year * 12 + today.month - 1 - months_back
+    return date(index // 12, index % 12 + 1, 1)
+
+
+@timed_query("ensure_scan_partitions")
+def ensure_scan_partitions(conn, ahead: int = SCAN_PARTITIONS_AHEAD, today: date | None = None) -> int:
+    """Create the monthly scan_events partitions up to ``ahead`` months out.
+
+    Returns how many were missing. Existing ones cost nothing; the SQL
+    function also moves rows that had landed in the default partition.
+    """
+    today = today or datetime.now(timezone.utc).date()
+    months = [_month_start(today, -n) for n in range(max(0, ahead) + 1)]
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT m FROM unnest(%s::date[]) AS m"
+            " WHERE to_regclass('scan_events_p' || to_char(m, 'YYYYMM')) IS NULL",
+            (months,),
+        )
+        missing = [r[0] for r in cur.fetchall()]
+        for month in missing:
+            cur.execute("SELECT scan_events_ensure_partition(%s)", (month,))
+    return len(missing)
+
+
+def list_scan_partitions(conn) -> list[tuple[str, date]]:
+    """Monthly scan_events partitions as ``(name, month)``, oldest first."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT c.relname
+              FROM pg_inherits i
+              JOIN pg_class c ON c.oid = i.inhrelid
+             WHERE i.inhparent = to_regclass('scan_events')
+            """
+        )
+        names = [r[0] for r in cur.fetchall()]
+    conn.rollback()
+    partitions = []
+    for name in names:
+        m = _PARTITION_NAME.match(name)
+        if m:
+            partitions.append((name, date(int(m.group(1)), int(m.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def _archive_to_file(conn, name: str, archive_dir: str) -> tuple[Path, int]:
+    """Write partition ``name`` to ``<archive_dir>/<name>.csv.gz`` (atomically)."""
+    directory = Path(archive_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{name}.csv.gz"
+    tmp = path.with_suffix(".gz.tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8", newline="") as f, conn.cursor() as cur:
+        cur.copy_expert(
+            f"COPY (SELECT id, ts, station_id, upper(encode(tag_uid, 'hex')) AS tag_uid, role_hint"
+            f" FROM {name} ORDER BY ts, id)"
+            " TO STDOUT WITH (FORMAT csv, HEADER)",
+            f,
+        )
+        rows = cur.rowcount
+    conn.rollback()
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path, rows
+
+
+@timed_query("drop_scan_partitions")
+def drop_old_scan_partitions(
+    conn,
+    months: int = SCAN_RETENTION_MONTHS,
+    archive_dir: str = SCAN_ARCHIVE_DIR,
+    today: date | None = None,
+) -> list[dict]:
+    """Drop partitions of months entirely older than ``months`` months.
+
+    With ``archive_dir`` each is first written to a gzip CSV; the partition
+    is only dropped once its file is complete on disk.
+    """
+    if months <= 0:
+        return []
+    today = today or datetime.now(timezone.utc).date()
+    cutoff = _month_start(today, months)  # keep this month and later
+    dropped = []
+    for name, month in list_scan_partitions(conn):
+        if month >= cutoff:
+            break
+        entry = {"partition": name, "month": month.isoformat()}
+        if archive_dir:
+            path, rows = _archive_to_file(conn, name, archive_dir)
+            entry.update(file=str(path), rows=rows)
+        with conn, conn.cursor() as cur:
+            cur.execute(f"ALTER TABLE scan_events DETACH PARTITION {name}")
+            cur.execute(f"DROP TABLE {name}")
+        log_event("scan_partition_dropped", **entry)
+        print(f"🗄️ scan_events {month:%Y-%m} を削除" + (f"（保存: {entry['file']}）" if archive_dir else ""))
+        dropped.append(entry)
+    return dropped
+
+
+@timed_query("archive_loans")
+def archive_loans(conn, months: int = LOAN_ARCHIVE_MONTHS, batch: int = LOAN_ARCHIVE_BATCH) -> int:
+    """Move loans returned more than ``months`` months ago to loans_archive.
+
+    Batches of ``batch`` rows, one transaction each, so a large first run
+    never holds locks for long. Bumps the loans version (history changed).
+    A loan whose id is already archived aborts its batch with ValueError
+    (both rows stay where they are) rather than being deleted unarchived.
+    """
+    if months <= 0:
+        return 0
+    from .db import bump_versions
+
+    moved = 0
+    while True:
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute(
+                    """
+                    WITH old AS (
+                        SELECT id FROM loans
+                         WHERE returned_at IS NOT NULL
+                           -- equals returned_at for closed loans: uses loans_history_idx
+                           AND COALESCE(returned_at, loaned_at) < now() - make_interval(months => %s)
+                         LIMIT %s
+                           FOR UPDATE SKIP LOCKED
+                    ), moved AS (
+                        DELETE FROM loans l USING old WHERE l.id = old.id
+                     RETURNING l.id, l.tool_uid, l.borrower_uid, l.loaned_at, l.return_user_uid,
+                               l.returned_at, l.station_id, l.return_station_id
+                    )
+                    INSERT INTO loans_archive(id, tool_uid, borrower_uid, loaned_at, return_user_uid,
+                                              returned_at, station_id, return_station_id)
+                    SELECT * FROM moved
+                    """,
+                    (months, batch),
+                )
+                count = cur.rowcount  # no ON CONFLICT: every deleted row is inserted
+                if count:
+                    bump_versions(cur, "loans")
+        except psycopg2.errors.UniqueViolation as e:
+            detail = e.diag.message_detail or e
+            raise ValueError(f"loans_archive に同じidの貸出があるため退避を中止しました: {detail}") from e
+        moved += count
+        if count < batch:
+            return moved
+
+
+@timed_query("prune_pair_requests")
+def prune_pair_requests(conn, keep_days: float = PAIR_REQUEST_KEEP_DAYS) -> int:
+    """Forget idempotency keys of scan pairs processed over ``keep_days`` ago."""
+    if keep_days <= 0:
+        return 0
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM scan_pair_requests WHERE processed_at < now() - %s * interval '1 day'",
+            (keep_days,),
+        )
+        return cur.rowcount
+
+
+def run_retention(conn) -> dict:
+    """One maintenance pass; skipped while another station runs one."""
+    started = time.perf_counter()
+    with conn, conn.cursor() as cur:
+        # Session lock: held across the transactions below
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (RETENTION_LOCK_ID,))
+        if not cur.fetchone()[0]:
+            return {"skipped": True}
+    try:
+        created = ensure_scan_partitions(conn)
+        dropped = drop_old_scan_partitions(conn)
+        archived = archive_loans(conn)
+        pruned = prune_pair_requests(conn)
+    finally:
+        conn.rollback()
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (RETENTION_LOCK_ID,))
+    return {
+        "skipped": False,
+        "partitions_created": created,
+        "partitions_dropped": [d["partition"] for d in dropped],
+        "loans_archived": archived,
+        "pair_requests_pruned": pruned,
+        "ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def _run_with_pool() -> dict:
+    from .db import get_conn
+
+    with get_conn() as conn:
+        return run_retention(conn)
+
+
+_job: PeriodicJob | None = None
+_job_lock = threading.Lock()
+
+
+def get_retention_job() -> PeriodicJob:
+    """Process-wide partition/retention job (thread started by main.run)."""
+    global _job
+    if _job is None:
+        with _job_lock:
+            if _job is None:
+                _job = PeriodicJob("保存期間の整理", _run_with_pool, RETENTION_CHECK_SEC)
+    return _job
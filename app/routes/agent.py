@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import hmac
+import logging
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request
+
+from .. import socketio
+from ..background import announce_transaction, lookup_name
+from ..config import AGENT_TOKEN
+from ..db import DB_OUTAGE_ERRORS, get_conn, insert_scans, is_db_outage, process_scan_pair
+from ..logs import log_event
+from ..uid import Uid, parse_uid
+
+
+agent_bp = Blueprint("agent", __name__)
+
+# UI events an agent may relay to the browsers (transaction results are
+# emitted here, from the outcome of process_scan_pair)
+RELAYED_EVENTS = frozenset({"scan_update", "state_reset", "error"})
+
+
+@agent_bp.before_request
+def _authorize():
+    if not AGENT_TOKEN:
+        return jsonify({"error": "AGENT_TOKEN が未設定のためエージェント接続は無効です"}), 404
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(supplied.encode(), AGENT_TOKEN.encode()):
+        return jsonify({"error": "認証に失敗しました"}), 401
+    return None
+
+
+def _db_down(e):
+    # The agent keeps the batch in its journal and retries
+    return jsonify({"error": f"DB接続不可: {e}"}), 503
+
+
+for _exc in DB_OUTAGE_ERRORS:
+    agent_bp.register_error_handler(_exc, _db_down)
+
+
+@agent_bp.route("/api/agent/pairs", methods=["POST"])
+def agent_pairs():
+    """Process a batch of scan pairs from a station agent, in order.
+
+    Each pair carries the agent's idempotency key, so a batch re-sent after a
+    lost response is answered from the first outcome without toggling again.
+    Returns one result per pair: ``{"key", "action", "duplicate"}`` or
+    ``{"key", "error"}`` for a pair that failed for a reason of its own
+    (invalid data, a constraint it violates); the agent retries and parks
+    those. Only a DB outage fails the whole batch (503), since a 5xx makes
+    the agent re-send the batch as is.
+    """
+    pairs = (request.json or {}).get("pairs") or []
+    results = []
+    with get_conn() as conn:
+        for pair in pairs:
+            key = pair.get("idempotency_key")
+            if not key:
+                # Without a key a re-sent pair would toggle the loan again
+                results.append({"key": key, "error": "idempotency_key がありません"})
+                continue
+            try:
+                user_uid = Uid(pair["user_uid"])
+                tool_uid = Uid(pair["tool_uid"])
+                station_id = pair["station_id"]
+                scanned_at = datetime.fromisoformat(pair["scanned_at"])
+            except (KeyError, TypeError, ValueError) as e:
+                results.append({"key": key, "error": f"不正なデータ: {e}"})
+                continue
+            try:
+                result = process_scan_pair(
+                    conn,
+                    user_uid,
+                    tool_uid,
+                    station_id=station_id,
+                    idempotency_key=key,
+                    scanned_at=scanned_at,
+                )
+            except Exception as e:  # noqa: BLE001
+                if is_db_outage(e):
+                    raise
+                log_event(
+                    "agent_pair_failed", logging.ERROR, key=key, station=station_id, error=str(e)
+                )
+                results.append({"key": key, "error": f"処理できません: {e}"})
+                continue
+            if not result["duplicate"]:
+                label = pair.get("label") or station_id
+                announce_transaction(socketio, result, user_uid, tool_uid, station_id, label)
+            results.append(
+                {"key": key, "action": result["action"], "duplicate": result["duplicate"]}
+            )
+    return jsonify({"results": results})
+
+
+@agent_bp.route("/api/agent/scans", methods=["POST"])
+def agent_scans():
+    """Append a batch of ``[ts, station_id, uid, role]`` rows to scan_events."""
+    rows = (request.json or {}).get("rows") or []
+    try:
+        parsed = [(datetime.fromisoformat(ts), sid, Uid(uid), role) for ts, sid, uid, role in rows]
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"不正なデータ: {e}"}), 400
+    if parsed:
+        with get_conn() as conn:
+            insert_scans(conn, parsed)
+    return jsonify({"written": len(parsed)})
+
+
+@agent_bp.route("/api/agent/emit", methods=["POST"])
+def agent_emit():
+    """Relay a station agent's UI events to the browsers."""
+    relayed = 0
+    for item in (request.json or {}).get("events") or []:
+        if item.get("event") in RELAYED_EVENTS:
+            socketio.emit(item["event"], item.get("data") or {})
+            relayed += 1
+    return jsonify({"relayed": relayed})
+
+
+@agent_bp.route("/api/agent/names")
+def agent_names():
+    """UID -> display name for an agent's scan messages (``kind``: user/tool)."""
+    kind = request.args.get("kind")
+    uid = parse_uid(request.args.get("uid"))
+    if kind not in ("user", "tool") or not uid:
+        return jsonify({"error": "kind (user/tool) と uid（16進数）は必須です"}), 400
+    return jsonify({"uid": uid, "name": lookup_name(kind, uid)})
@@ -1,89 +1,225 @@
 from __future__ import annotations
 
-from flask import Blueprint, jsonify, request
+import io
+import time
+from datetime import datetime
 
-from ..background import scan_state
-from ..config import SCAN_POLL_TIMEOUT_SEC
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+from ..background import get_replayer, scan_control
+from ..bulk import KINDS as BULK_KINDS
+from ..bulk import export_csv_chunks, export_json, guess_format, import_records, read_records
+from ..config import NFC_BACKEND, SCAN_POLL_TIMEOUT_SEC
 from ..db import (
     add_tool_name,
     delete_tool_name,
+    LOAN_PAGE_MAX,
+    decode_loan_cursor,
+    fetch_loans_page,
+    fetch_versions,
     fetch_open_loans,
-    fetch_recent_history,
     get_conn,
+    list_tool_names,
+    pool_stats,
+    serialize_history,
+    serialize_open_loan,
+    upsert_tool,
+    upsert_user,
 )
-from ..nfc import read_one_uid
+from ..httpcache import versioned_json
+from ..journal import get_journal
+from ..metrics import REGISTRY
+from ..scanlog import get_scan_writer
+from ..scheduler import get_scheduler
+from ..search import KINDS as SEARCH_KINDS
+from ..search import get_search_index
+from ..startup import get_startup
+from ..station import WAITING_MESSAGE, get_stations, read_tag, scanner_here
+from ..uid import Uid
 
 
 api_bp = Blueprint("api", __name__)
 
+REGISTRY.gauge(
+    "db_pool_connections",
+    "Pooled DB connections",
+    ("state",),
+    lambda: [(("idle",), pool_stats()["idle"]), (("in_use",), pool_stats()["in_use"])],
+)
+REGISTRY.gauge(
+    "scan_log_queue_depth",
+    "scan_events rows waiting to be written",
+    (),
+    lambda: [((), get_scan_writer().stats()["depth"])],
+)
+REGISTRY.gauge(
+    "offline_journal_depth",
+    "Scan pairs waiting in the offline journal",
+    (),
+    lambda: [((), get_journal().depth())],
+)
+REGISTRY.gauge(
+    "scheduler_timers_pending",
+    "Pending delayed callbacks",
+    (),
+    lambda: [((), get_scheduler().stats()["pending"])],
+)
+
+_SCANNER_ELSEWHERE = "NFC読取は別プロセス（python -m app.scanner）で動作しています"
+
 
 @api_bp.route("/api/start_scan", methods=["POST"])
 def start_scan():
-    scan_state["active"] = True
-    scan_state["user_uid"] = ""
-    scan_state["tool_uid"] = ""
-    scan_state["last_scanned_uid"] = ""
-    scan_state["last_scan_time"] = 0.0
-    scan_state["message"] = "📡 スキャン待機中... ユーザータグをかざしてください"
+    scan_control("start", message=WAITING_MESSAGE)
     print("🟢 自動スキャン開始")
-    return jsonify({"status": "started", "message": scan_state["message"]})
+    return jsonify({"status": "started", "message": WAITING_MESSAGE})
 
 
 @api_bp.route("/api/stop_scan", methods=["POST"])
 def stop_scan():
-    scan_state["active"] = False
-    scan_state["message"] = "⏹️ スキャン停止"
+    message = "⏹️ スキャン停止"
+    scan_control("stop", message=message)
     print("🔴 自動スキャン停止")
-    return jsonify({"status": "stopped", "message": scan_state["message"]})
+    return jsonify({"status": "stopped", "message": message})
 
 
 @api_bp.route("/api/reset", methods=["POST"])
 def reset_state():
-    scan_state["user_uid"] = ""
-    scan_state["tool_uid"] = ""
-    scan_state["last_scanned_uid"] = ""
-    scan_state["last_scan_time"] = 0.0
-    scan_state["message"] = "🔄 リセット完了"
+    scan_control("reset", message="🔄 リセット完了")
     print("🧹 状態リセット")
     return jsonify({"status": "reset"})
 
 
-@api_bp.route("/api/loans")
-def get_loans():
-    conn = get_conn()
-    try:
-        open_loans = fetch_open_loans(conn)
-        history = fetch_recent_history(conn)
-        return jsonify(
+@api_bp.route("/api/stations")
+def stations():
+    """Configured scan stations and the readers feeding them."""
+    if not scanner_here():
+        return jsonify({"error": _SCANNER_ELSEWHERE}), 409
+    return jsonify(
+        [
             {
-                "open_loans": [
-                    {
-                        "tool": r[0],
-                        "borrower": r[1],
-                        "loaned_at": r[2].isoformat(),
-                    }
-                    for r in open_loans
-                ],
-                "history": [
-                    {
-                        "action": r[0],
-                        "tool": r[1],
-                        "borrower": r[2],
-                        "loaned_at": r[3].isoformat(),
-                        "returned_at": r[4].isoformat() if r[4] else None,
-                    }
-                    for r in history
+                **station.snapshot(),
+                "readers": [
+                    {"name": r.name, "role": r.role, "station_id": r.station_id}
+                    for r in station.readers
                 ],
             }
-        )
-    finally:
-        conn.close()
+            for station in get_stations()
+        ]
+    )
+
+
+def _parse_time(value: str | None, name: str):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} は ISO 8601 形式で指定してください: {value}") from None
+
+
+def _parse_uid(value: str | None) -> Uid | None:
+    return Uid(value) if value else None
+
+
+def _page_size(value: str | None, default: int) -> int:
+    if not value:
+        return default
+    try:
+        size = int(value)
+    except ValueError:
+        raise ValueError(f"limit は整数で指定してください: {value}") from None
+    return max(1, min(size, LOAN_PAGE_MAX))
+
+
+@api_bp.route("/api/loans")
+def get_loans():
+    """Open loans + one page of history.
+
+    Query: ``limit`` (history page size, default 50), ``cursor`` (the
+    ``next_cursor`` of the previous page; open loans are only returned on the
+    first page), ``open_limit`` (default 100), and the filters ``user``
+    (borrower UID), ``tool`` (tool UID), ``tool_name``, ``station``,
+    ``since`` / ``until`` (ISO 8601, on the latest loan/return time), and
+    ``archived=1`` to include loans moved to loans_archive in the history.
+    """
+    args = request.args
+    try:
+        filters = {
+            "user": _parse_uid(args.get("user")),
+            "tool": _parse_uid(args.get("tool")),
+            "tool_name": args.get("tool_name") or None,
+            "station": args.get("station") or None,
+            "since": _parse_time(args.get("since"), "since"),
+            "until": _parse_time(args.get("until"), "until"),
+        }
+        limit = _page_size(args.get("limit"), 50)
+        open_limit = _page_size(args.get("open_limit"), 100)
+        archived = args.get("archived", "").lower() in ("1", "true", "yes")
+        cursor = args.get("cursor") or None
+        if cursor:
+            decode_loan_cursor(cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with get_conn() as conn:
+        # Read the versions first: the data can only be newer, and deltas
+        # racing the snapshot are re-applied idempotently (by loan id) on the
+        # client. Names are part of the rows, so users/tools count too.
+        versions = fetch_versions(conn, "loans", "users", "tools")
+
+        def build() -> dict:
+            payload = {"version": versions["loans"]}
+            if not cursor:
+                open_loans = fetch_open_loans(conn, open_limit, **filters)
+                payload["open_loans"] = [serialize_open_loan(r) for r in open_loans]
+            history, next_cursor = fetch_loans_page(conn, cursor, limit, archived, **filters)
+            payload["history"] = [serialize_history(r) for r in history]
+            payload["next_cursor"] = next_cursor
+            return payload
+
+        return versioned_json(versions, build)
+
+
+@api_bp.route("/api/search")
+def search():
+    """Users, tools and tool names by name or UID (prefix, then fuzzy).
+
+    Query: ``q``, ``kind`` (comma-separated user/tool/tool_name, default all),
+    ``limit`` (default 20). Width, case and katakana/hiragana are ignored.
+    """
+    args = request.args
+    query = (args.get("q") or "").strip()
+    kinds = tuple(k for k in (args.get("kind") or "").split(",") if k) or SEARCH_KINDS
+    unknown = [k for k in kinds if k not in SEARCH_KINDS]
+    if unknown:
+        return jsonify({"error": f"kind は {'/'.join(SEARCH_KINDS)} で指定してください: {unknown[0]}"}), 400
+    try:
+        limit = _page_size(args.get("limit"), 20)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not query:
+        return jsonify({"query": query, "results": []})
+
+    with get_conn() as conn:
+        index = get_search_index(conn)
+    started = time.perf_counter()
+    results = index.search(query, kinds, limit)
+    return jsonify(
+        {
+            "query": query,
+            "results": results,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+    )
 
 
 @api_bp.route("/api/scan_tag", methods=["POST"])
 def scan_tag():
+    if not scanner_here():
+        return jsonify({"error": _SCANNER_ELSEWHERE}), 409
     print("📡 手動スキャン実行中...")
-    uid = read_one_uid(timeout=int(SCAN_POLL_TIMEOUT_SEC) or 5)
+    uid = read_tag(timeout=int(SCAN_POLL_TIMEOUT_SEC) or 5)
     if uid:
         print(f"✅ 手動スキャン成功: {uid}")
         return jsonify({"uid": uid, "status": "success"})
@@ -92,6 +228,26 @@ def scan_tag():
         return jsonify({"uid": None, "status": "timeout"})
 
 
+@api_bp.route("/api/debug/tap", methods=["POST"])
+def debug_tap():
+    """Present a tag on a fake reader (NFC_BACKEND=fake only).
+
+    ``reader`` selects one of the NFC_READERS names (default: the first one).
+    """
+    data = request.json or {}
+    if NFC_BACKEND != "fake":
+        return jsonify({"error": "NFC_BACKEND=fake のときのみ利用できます"}), 404
+    uid = data.get("uid")
+    if not uid:
+        return jsonify({"error": "UID は必須です"}), 400
+    try:
+        uid = Uid(uid)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    scan_control("tap", reader=data.get("reader") or None, uid=uid)
+    return jsonify({"status": "success", "uid": uid})
+
+
 @api_bp.route("/api/register_user", methods=["POST"])
 def register_user():
     data = request.json or {}
@@ -100,25 +256,19 @@ def register_user():
 
     if not uid or not name:
         return jsonify({"error": "UID と 氏名 は必須です"}), 400
+    try:
+        uid = Uid(uid)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
 
-    conn = get_conn()
     try:
-        with conn, conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO users(uid, full_name)
-                VALUES(%s,%s)
-                ON CONFLICT(uid) DO UPDATE SET full_name=EXCLUDED.full_name
-                """,
-                (uid, name.strip()),
-            )
+        with get_conn() as conn:
+            upsert_user(conn, uid, name.strip())
         print(f"👤 ユーザー登録: {name} ({uid})")
         return jsonify({"status": "success", "message": "ユーザーを登録/更新しました"})
     except Exception as e:  # noqa: BLE001
         print(f"❌ ユーザー登録エラー: {e}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @api_bp.route("/api/register_tool", methods=["POST"])
@@ -129,39 +279,81 @@ def register_tool():
 
     if not uid or not name:
         return jsonify({"error": "UID と 工具名 は必須です"}), 400
+    try:
+        uid = Uid(uid)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
 
-    conn = get_conn()
     try:
-        with conn, conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO tools(uid, name)
-                VALUES(%s,%s)
-                ON CONFLICT(uid) DO UPDATE SET name=EXCLUDED.name
-                """,
-                (uid, name),
-            )
+        with get_conn() as conn:
+            upsert_tool(conn, uid, name)
         print(f"🛠️ 工具登録: {name} ({uid})")
         return jsonify({"status": "success", "message": "工具を登録/更新しました"})
     except Exception as e:  # noqa: BLE001
         print(f"❌ 工具登録エラー: {e}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+
+
+@api_bp.route("/api/bulk/<kind>/import", methods=["POST"])
+def bulk_import(kind: str):
+    """Upsert users / tools / tool_names from CSV or JSON.
+
+    The file comes as multipart ``file`` or as the raw request body;
+    ``format`` (csv/json) defaults from the file name, ``dry_run=1`` only
+    validates. Per-row problems are listed in ``errors``.
+    """
+    if kind not in BULK_KINDS:
+        return jsonify({"error": f"不明な種別です: {kind}"}), 404
+    upload = request.files.get("file")
+    fmt = request.args.get("format") or guess_format(upload.filename if upload else None)
+    if fmt not in ("csv", "json"):
+        return jsonify({"error": f"format は csv または json で指定してください: {fmt}"}), 400
+    raw = upload.stream if upload else request.stream
+    stream = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    dry_run = request.args.get("dry_run", "").lower() in ("1", "true", "yes")
+    try:
+        with get_conn() as conn:
+            result = import_records(conn, kind, read_records(stream, fmt), dry_run=dry_run)
+    except ValueError as e:  # malformed CSV/JSON (csv.Error is mapped to ValueError)
+        return jsonify({"error": f"ファイルを読み取れません: {e}"}), 400
+    except Exception as e:  # noqa: BLE001
+        print(f"❌ 一括取込エラー: {e}")
+        return jsonify({"error": str(e)}), 500
+    print(
+        f"📥 一括取込 {kind}{'（検証のみ）' if dry_run else ''}: "
+        f"{result['written']}/{result['total']}件 エラー{len(result['errors'])}件"
+    )
+    return jsonify(result)
+
+
+@api_bp.route("/api/bulk/<kind>/export")
+def bulk_export(kind: str):
+    """Download users / tools / tool_names as CSV or JSON (streamed)."""
+    if kind not in BULK_KINDS:
+        return jsonify({"error": f"不明な種別です: {kind}"}), 404
+    fmt = request.args.get("format", "csv")
+    headers = {"Content-Disposition": f"attachment; filename={kind}.{fmt}"}
+    exporters = {"csv": (export_csv_chunks, "text/csv"), "json": (export_json, "application/json")}
+    if fmt in exporters:
+        export, mimetype = exporters[fmt]
+
+        def generate():
+            # Streamed from a server-side cursor: memory stays flat for any size
+            with get_conn() as conn:
+                yield from export(conn, kind)
+
+        return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+    return jsonify({"error": f"format は csv または json で指定してください: {fmt}"}), 400
 
 
 @api_bp.route("/api/tool_names")
 def get_tool_names():
-    conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT name FROM tool_master ORDER BY name ASC")
-            names = [r[0] for r in cur.fetchall()]
-        return jsonify({"names": names})
+        with get_conn() as conn:
+            versions = fetch_versions(conn, "tool_names")
+            return versioned_json(versions, lambda: {"names": list_tool_names(conn)})
     except Exception as e:  # noqa: BLE001
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @api_bp.route("/api/add_tool_name", methods=["POST"])
@@ -172,16 +364,14 @@ def add_tool_name_api():
     if not name:
         return jsonify({"error": "工具名を入力してください"}), 400
 
-    conn = get_conn()
     try:
-        add_tool_name(conn, name.strip())
+        with get_conn() as conn:
+            add_tool_name(conn, name.strip())
         print(f"📚 工具名追加: {name}")
         return jsonify({"status": "success", "message": "追加しました"})
     except Exception as e:  # noqa: BLE001
         print(f"❌ 工具名追加エラー: {e}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @api_bp.route("/api/delete_tool_name", methods=["POST"])
@@ -192,49 +382,76 @@ def delete_tool_name_api():
     if not name:
         return jsonify({"error": "工具名を指定してください"}), 400
 
-    conn = get_conn()
     try:
-        delete_tool_name(conn, name)
+        with get_conn() as conn:
+            delete_tool_name(conn, name)
         print(f"🗑️ 工具名削除: {name}")
         return jsonify({"status": "success", "message": "削除しました"})
     except Exception as e:  # noqa: BLE001
         print(f"❌ 工具名削除エラー: {e}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @api_bp.route("/api/check_tag", methods=["POST"])
 def check_tag():
+    if not scanner_here():
+        return jsonify({"error": _SCANNER_ELSEWHERE}), 409
     print("📡 タグ情報確認スキャン実行中...")
-    uid = read_one_uid(timeout=int(SCAN_POLL_TIMEOUT_SEC) or 5)
+    uid = read_tag(timeout=int(SCAN_POLL_TIMEOUT_SEC) or 5)
     if uid:
         print(f"✅ タグ情報確認成功: {uid}")
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT full_name FROM users WHERE uid=%s", (uid,))
-                user_result = cur.fetchone()
-                cur.execute("SELECT name FROM tools WHERE uid=%s", (uid,))
-                tool_result = cur.fetchone()
-
-            result = {"uid": uid, "status": "success"}
-            if user_result:
-                result["type"] = "user"
-                result["name"] = user_result[0]
-                result["message"] = f"👤 ユーザー: {user_result[0]}"
-            elif tool_result:
-                result["type"] = "tool"
-                result["name"] = tool_result[0]
-                result["message"] = f"🛠️ 工具: {tool_result[0]}"
-            else:
-                result["type"] = "unregistered"
-                result["name"] = ""
-                result["message"] = "❓ 未登録のタグです"
-
-            return jsonify(result)
-        finally:
-            conn.close()
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute("SELECT full_name FROM users WHERE uid=%s", (uid,))
+            user_result = cur.fetchone()
+            cur.execute("SELECT name FROM tools WHERE uid=%s", (uid,))
+            tool_result = cur.fetchone()
+
+        result = {"uid": uid, "status": "success"}
+        if user_result:
+            result["type"] = "user"
+            result["name"] = user_result[0]
+            result["message"] = f"👤 ユーザー: {user_result[0]}"
+        elif tool_result:
+            result["type"] = "tool"
+            result["name"] = tool_result[0]
+            result["message"] = f"🛠️ 工具: {tool_result[0]}"
+        else:
+            result["type"] = "unregistered"
+            result["name"] = ""
+            result["message"] = "❓ 未登録のタグです"
+
+        return jsonify(result)
     else:
         print("❌ タグ情報確認 タイムアウト")
         return jsonify({"uid": None, "status": "timeout"})
+
+
+@api_bp.route("/api/db_pool")
+def get_db_pool():
+    return jsonify(pool_stats())
+
+
+@api_bp.route("/api/scan_log")
+def get_scan_log_stats():
+    return jsonify(get_scan_writer().stats())
+
+
+@api_bp.route("/api/journal")
+def get_journal_stats():
+    replayer = get_replayer()
+    stats = replayer.journal.stats()
+    stats["db_reachable"] = replayer.db_reachable
+    return jsonify(stats)
+
+
+@api_bp.route("/api/ready")
+def get_ready():
+    """Readiness: 200 once startup (schema, caches, readers, jobs) is done, else 503."""
+    status = get_startup().status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+@api_bp.route("/metrics")
+def metrics():
+    """Prometheus text exposition of this process's metrics."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from flask import Blueprint, jsonify, request
+
+from ..analytics import (
+    daily_totals,
+    get_refresher,
+    overdue_summary,
+    station_stats,
+    tool_stats,
+    user_stats,
+)
+from ..config import ANALYTICS_TZ, LOAN_ARCHIVE_MONTHS, SCAN_ARCHIVE_DIR, SCAN_RETENTION_MONTHS
+from ..db import get_conn
+from ..overdue import fetch_open_alerts, get_overdue_detector, list_loan_limits, set_loan_limit
+from ..retention import get_retention_job, list_scan_partitions
+
+
+stats_bp = Blueprint("stats", __name__)
+
+
+def _range() -> tuple[date, date]:
+    """``since`` / ``until`` (ISO dates, until exclusive); default: last 30 days."""
+    today = datetime.now(ZoneInfo(ANALYTICS_TZ)).date()
+    since = request.args.get("since")
+    until = request.args.get("until")
+    try:
+        return (
+            date.fromisoformat(since) if since else today - timedelta(days=29),
+            date.fromisoformat(until) if until else today + timedelta(days=1),
+        )
+    except ValueError:
+        raise ValueError("since / until は YYYY-MM-DD 形式で指定してください") from None
+
+
+def _limit(default: int = 50) -> int:
+    try:
+        return max(1, min(int(request.args.get("limit", default)), 500))
+    except ValueError:
+        raise ValueError("limit は整数で指定してください") from None
+
+
+@stats_bp.errorhandler(ValueError)
+def _bad_request(e: ValueError):
+    return jsonify({"error": str(e)}), 400
+
+
+@stats_bp.route("/api/stats/tools")
+def stats_tools():
+    since, until = _range()
+    with get_conn() as conn:
+        rows = tool_stats(conn, since, until, _limit())
+    return jsonify({"since": since.isoformat(), "until": until.isoformat(), "tools": rows})
+
+
+@stats_bp.route("/api/stats/users")
+def stats_users():
+    since, until = _range()
+    with get_conn() as conn:
+        rows = user_stats(conn, since, until, _limit())
+    return jsonify({"since": since.isoformat(), "until": until.isoformat(), "users": rows})
+
+
+@stats_bp.route("/api/stats/stations")
+def stats_stations():
+    since, until = _range()
+    station = request.args.get("station") or None
+    with get_conn() as conn:
+        rows = station_stats(conn, since, until, station)
+    return jsonify({"since": since.isoformat(), "until": until.isoformat(), "hours": rows})
+
+
+@stats_bp.route("/api/stats/daily")
+def stats_daily():
+    since, until = _range()
+    with get_conn() as conn:
+        rows = daily_totals(conn, since, until)
+    return jsonify({"since": since.isoformat(), "until": until.isoformat(), "days": rows})
+
+
+@stats_bp.route("/api/stats/summary")
+def stats_summary():
+    with get_conn() as conn:
+        summary = overdue_summary(conn)
+    summary["refresher"] = get_refresher().stats()
+    return jsonify(summary)
+
+
+@stats_bp.route("/api/stats/refresh", methods=["POST"])
+def stats_refresh():
+    """Fold pending loan changes into the rollups now."""
+    result = get_refresher().run_now()
+    if result is None:
+        return jsonify({"error": get_refresher().last_error}), 503
+    return jsonify(result)
+
+
+@stats_bp.route("/api/overdue")
+def overdue():
+    """Open overdue alerts, per-tool-name limits and the detector's run cost."""
+    with get_conn() as conn:
+        alerts = fetch_open_alerts(conn)
+        limits = list_loan_limits(conn)
+    return jsonify(
+        {"alerts": alerts, "limits": limits, "detector": get_overdue_detector().stats()}
+    )
+
+
+@stats_bp.route("/api/overdue/limits", methods=["POST"])
+def overdue_limit():
+    """Set the loan limit (hours) of a tool name; ``hours: null`` resets it."""
+    data = request.json or {}
+    name = (data.get("name") or "").strip()
+    hours = data.get("hours")
+    if not name:
+        return jsonify({"error": "工具名は必須です"}), 400
+    if hours is not None:
+        try:
+            hours = float(hours)
+        except (TypeError, ValueError):
+            return jsonify({"error": "hours は数値で指定してください"}), 400
+        if hours <= 0:
+            return jsonify({"error": "hours は正の数で指定してください"}), 400
+    with get_conn() as conn:
+        if not set_loan_limit(conn, name, hours):
+            return jsonify({"error": f"工具名 '{name}' は登録されていません"}), 404
+    print(f"⏰ 貸出期限設定: {name} = {hours if hours is not None else '既定'}")
+    get_overdue_detector().nudge()
+    return jsonify({"status": "success", "name": name, "hours": hours})
+
+
+@stats_bp.route("/api/retention")
+def retention():
+    """scan_events partitions, the retention policy and the job's last run."""
+    with get_conn() as conn:
+        partitions = list_scan_partitions(conn)
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM loans_archive")
+            archived_loans = cur.fetchone()[0]
+    return jsonify(
+        {
+            "partitions": [{"name": n, "month": m.isoformat()} for n, m in partitions],
+            "scan_retention_months": SCAN_RETENTION_MONTHS,
+            "scan_archive_dir": SCAN_ARCHIVE_DIR or None,
+            "loan_archive_months": LOAN_ARCHIVE_MONTHS,
+            "archived_loans": archived_loans,
+            "job": get_retention_job().stats(),
+        }
+    )
+
+
+@stats_bp.route("/api/retention/run", methods=["POST"])
+def retention_run():
+    """Create upcoming partitions and apply the retention policy now."""
+    result = get_retention_job().run_now()
+    if result is None:
+        return jsonify({"error": get_retention_job().last_error}), 503
+    return jsonify(result)
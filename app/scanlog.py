@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+from .config import SCAN_LOG_BATCH, SCAN_LOG_FLUSH_SEC, SCAN_LOG_QUEUE_MAX, STATION_ID
+
+
+class ScanEventWriter:
+    """Background writer for ``scan_events``.
+
+    ``submit()`` never blocks the scan thread: rows go into a bounded queue and
+    a daemon thread writes them in batches once ``batch_size`` rows are pending
+    or ``flush_interval`` seconds have passed. When the queue is full (DB slow
+    or down for a long time) new rows are dropped and counted. A failed batch
+    is retried with backoff; ``stop()`` flushes what is left.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[list[tuple]], None],
+        max_queue: int = 10000,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+    ):
+        self._flush = flush
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue[tuple | None] = queue.Queue(maxsize=max_queue)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "batches": 0,
+            "failures": 0,
+            "max_depth": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    def start(self) -> "ScanEventWriter":
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(
+        self, uid: str, role: str | None = None, station_id: str = STATION_ID
+    ) -> bool:
+        """Queue one scan row (timestamped now); returns False if it was dropped."""
+        row = (datetime.now(timezone.utc), station_id, uid, role)
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+            return False
+        with self._lock:
+            self._stats["enqueued"] += 1
+            depth = self._queue.qsize()
+            if depth > self._stats["max_depth"]:
+                self._stats["max_depth"] = depth
+        return True
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Flush pending rows and stop the writer thread."""
+        if self._thread is None or self._stopping.is_set():
+            return
+        self._stopping.set()
+        try:
+            self._queue.put(None, timeout=timeout)  # wake the writer
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        batch: list[tuple] = []
+        backoff = 1.0
+        while True:
+            stop = self._collect(batch)
+            if batch:
+                if self._write(batch):
+                    batch = []
+                    backoff = 1.0
+                elif stop:
+                    print(f"⚠️ スキャンログ {len(batch)}件を書き込めずに終了します")
+                    return
+                else:
+                    self._stopping.wait(backoff)
+                    backoff = min(backoff * 2, 30.0)
+            if stop:
+                return
+
+    def _collect(self, batch: list[tuple]) -> bool:
+        """Fill ``batch`` up to batch_size / flush_interval; True once stopping."""
+        deadline = None
+        while len(batch) < self.batch_size:
+            try:
+                if not batch:
+                    item = self._queue.get()  # idle: block until work arrives
+                else:
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return False
+            if item is None:
+                # Take whatever is left for the final flush
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        return True
+                    if item is not None:
+                        batch.append(item)
+            batch.append(item)
+        return False
+
+    def _write(self, batch: list[tuple]) -> bool:
+        started = time.perf_counter()
+        try:
+            self._flush(batch)
+        except Exception as e:  # noqa: BLE001
+            with self._lock:
+                self._stats["failures"] += 1
+            print(f"⚠️ スキャンログ書込エラー（{len(batch)}件保留）: {e}")
+            return False
+        with self._lock:
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["last_batch_size"] = len(batch)
+            self._stats["last_flush_ms"] = (time.perf_counter() - started) * 1000
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        s["depth"] = self._queue.qsize()
+        s["capacity"] = self._queue.maxsize
+        return s
+
+
+_writer: ScanEventWriter | None = None
+_writer_lock = threading.Lock()
+
+
+def _flush_to_db(rows: list[tuple]) -> None:
+    from .db import get_conn, insert_scans
+
+    with get_conn() as conn:
+        insert_scans(conn, rows)
+
+
+def get_scan_writer() -> ScanEventWriter:
+    """Process-wide scan_events writer (started on first use, flushed at exit)."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                writer = ScanEventWriter(
+                    _flush_to_db,
+                    max_queue=SCAN_LOG_QUEUE_MAX,
+                    batch_size=SCAN_LOG_BATCH,
+                    flush_interval=SCAN_LOG_FLUSH_SEC,
+                ).start()
+                atexit.register(writer.stop)
+                _writer = writer
+    return _writer
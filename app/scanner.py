@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import json
+import logging
+import socket
+import threading
+import time
+
+from .background import SCAN_CONTROL_CHANNEL, apply_scan_control, get_replayer
+from .cache import NAME_CACHE_CHANNEL, apply_name_notification, clear_names
+from .config import SCANNER_LOCK_KEY, SOCKETIO_MESSAGE_QUEUE, STATION_ID
+from .db import connect, ensure_tables, get_conn, is_db_outage, warm_name_cache
+from .logs import log_event, setup_logging
+from .mq import TimedSocketIO, make_client_manager
+from .notify import get_listener
+from .station import start_scan_threads, stop_stations
+
+
+# pg_try_advisory_lock(SCANNER_LOCK_ID, hashtext(<key>)): one scan loop per
+# host, whichever process (web server or app.scanner) gets there first
+SCANNER_LOCK_ID = 7_262_003
+
+# The lock key, evaluated on the caller's connection: SCANNER_LOCK_KEY, else
+# "<client address>/<hostname>" (cloned Pi images share a hostname, not an
+# address; a Unix-socket connection has no address and counts as "local")
+SCANNER_KEY_SQL = (
+    "COALESCE(NULLIF(%s, ''), COALESCE(host(inet_client_addr()), 'local') || '/' || %s)"
+)
+
+
+def scanner_key_params() -> tuple[str, str]:
+    return (SCANNER_LOCK_KEY, socket.gethostname())
+
+
+class ScannerClaim:
+    """Session advisory lock on this host's scan loop.
+
+    The lock lives on a dedicated connection, so it silently goes away when
+    that connection does (DB restart); ``recheck`` runs on every LISTEN
+    reconnect and takes it again, or stops the stations if another process
+    got there first. ``apply_control`` is the ``scan_control`` subscriber:
+    commands addressed to another host's scanner are ignored.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.key: str | None = None
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        conn = connect()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT {SCANNER_KEY_SQL}", scanner_key_params())
+                key = cur.fetchone()[0]
+                cur.execute(
+                    "SELECT pg_try_advisory_lock(%s, hashtext(%s))", (SCANNER_LOCK_ID, key)
+                )
+                got = cur.fetchone()[0]
+        except Exception:
+            conn.close()
+            raise
+        self.key = key
+        if not got:
+            conn.close()
+            return False
+        self.conn = conn
+        return True
+
+    def held(self) -> bool:
+        if self.conn is None:
+            return False
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE pid = pg_backend_pid()"
+                    " AND locktype = 'advisory' AND classid = %s::oid"
+                    " AND objid = hashtext(%s)::oid AND objsubid = 2 AND granted)",
+                    (SCANNER_LOCK_ID, self.key),
+                )
+                return cur.fetchone()[0]
+        except Exception:  # noqa: BLE001
+            return False
+
+    def holder(self) -> str:
+        """Who holds the lock for our key ("pid=… addr=… app=…"), for reports."""
+        with get_conn() as conn, conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT a.pid, host(a.client_addr), a.application_name"
+                " FROM pg_locks l JOIN pg_stat_activity a USING (pid)"
+                " WHERE l.locktype = 'advisory' AND l.classid = %s::oid"
+                " AND l.objid = hashtext(%s)::oid AND l.objsubid = 2 AND l.granted",
+                (SCANNER_LOCK_ID, self.key),
+            )
+            row = cur.fetchone()
+        if row is None:
+            return "不明（解放済み）"
+        pid, addr, app = row
+        return f"pid={pid} addr={addr or 'local'}" + (f" app={app}" if app else "")
+
+    def recheck(self) -> None:
+        with self._lock:
+            if self.held():
+                return
+            self.close()
+            try:
+                if self.acquire():
+                    log_event("scanner_lock_reclaimed", key=self.key)
+                    print(f"🔒 NFCスキャンのロックを再取得しました ({self.key})")
+                    return
+                holder = self.holder()
+            except Exception as e:  # noqa: BLE001
+                holder = f"確認できません: {e}"
+            stop_stations("別プロセスがこの端末のNFC読取を引き継いだため停止しました")
+            log_event("scanner_lock_lost", logging.ERROR, key=self.key, holder=holder)
+            print(f"❌ NFCスキャンのロックを失いました ({self.key}, 保持: {holder})")
+
+    def apply_control(self, payload: str) -> None:
+        target = json.loads(payload).get("scanner")
+        if self.conn is None or (target and target != self.key):
+            return
+        apply_scan_control(payload)
+
+    def close(self) -> None:
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:  # noqa: BLE001
+                pass
+            self.conn = None
+
+
+def wait_for_claim(retry_sec: float = 5.0) -> ScannerClaim:
+    """Block until this process owns the host's scan loop."""
+    claim = ScannerClaim()
+    waiting = False
+    while True:
+        try:
+            if claim.acquire():
+                return claim
+            if not waiting:
+                print(f"⏳ 別プロセスがスキャン中です（{claim.holder()}）。解放を待ちます...")
+                waiting = True
+        except Exception as e:  # noqa: BLE001
+            if not is_db_outage(e):
+                raise
+            print(f"⚠️ DB接続待ち（{retry_sec:.0f}秒後に再試行）: {e}")
+        time.sleep(retry_sec)
+
+
+def make_emitter(url: str = SOCKETIO_MESSAGE_QUEUE) -> TimedSocketIO:
+    """Write-only Socket.IO server: emits reach browsers via the message queue."""
+    if not url:
+        raise SystemExit("SOCKETIO_MESSAGE_QUEUE が未設定です（例: postgresql）")
+    emitter = TimedSocketIO()
+    emitter.init_app(
+        None, async_mode="threading", client_manager=make_client_manager(url, write_only=True)
+    )
+    return emitter
+
+
+def main() -> None:
+    setup_logging()
+    emitter = make_emitter()
+    claim = wait_for_claim()
+    ensure_tables()
+    with get_conn() as conn:
+        warmed = warm_name_cache(conn)
+    print(f"🗂️ 名前キャッシュ読込: {warmed}件")
+
+    listener = get_listener()
+    listener.subscribe(NAME_CACHE_CHANNEL, apply_name_notification)
+    listener.subscribe(SCAN_CONTROL_CHANNEL, claim.apply_control)
+    listener.on_reconnect(clear_names)
+    listener.on_reconnect(claim.recheck)
+    listener.start()
+
+    workers = start_scan_threads(sock=emitter)
+    get_replayer(emitter).nudge()  # flush scans journaled before a restart
+    print(f"📡 NFCスキャンプロセス開始 ({STATION_ID}, {claim.key}, リーダー{len(workers)}台)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        claim.close()
+
+
+if __name__ == "__main__":
+    main()
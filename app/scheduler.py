@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable
+
+
+class Timer:
+    """Handle returned by ``Scheduler.call_later``."""
+
+    __slots__ = ("deadline", "fn", "args", "cancelled")
+
+    def __init__(self, deadline: float, fn: Callable, args: tuple):
+        self.deadline = deadline
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class Scheduler:
+    """One daemon thread running delayed callbacks in deadline order.
+
+    Replaces a sleeping OS thread per delayed action: timers sit in a heap
+    and cost one entry each. Callbacks run on the scheduler thread, so they
+    must be short; cancelled timers are dropped when they come due.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, Timer]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self.fired = 0
+
+    def start(self) -> "Scheduler":
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return self
+
+    def call_later(self, delay: float, fn: Callable, *args) -> Timer:
+        timer = Timer(time.monotonic() + max(0.0, delay), fn, args)
+        with self._cond:
+            heapq.heappush(self._heap, (timer.deadline, next(self._seq), timer))
+            if self._heap[0][2] is timer:
+                self._cond.notify()  # new earliest deadline
+        return timer
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                _deadline, _seq, timer = heapq.heappop(self._heap)
+            if timer.cancelled:
+                continue
+            try:
+                timer.fn(*timer.args)
+            except Exception as e:  # noqa: BLE001
+                print(f"⚠️ タイマー処理エラー: {e}")
+            self.fired += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending = sum(1 for _d, _s, t in self._heap if not t.cancelled)
+        return {"pending": pending, "fired": self.fired}
+
+
+_scheduler: Scheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    """Process-wide timer thread (started on first use)."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = Scheduler().start()
+    return _scheduler
+
+
+class PeriodicJob:
+    """Runs ``fn()`` every ``interval`` seconds on its own daemon thread.
+
+    For background DB jobs (rollups, overdue checks) that may block on the
+    network and so must not run on the shared timer thread. ``run_now()``
+    runs the job synchronously (and is what the thread calls); each run is
+    timed so the job's cost can be watched via ``stats()``.
+    """
+
+    def __init__(self, name: str, fn: Callable[[], object], interval: float):
+        self.name = name
+        self._fn = fn
+        self.interval = interval
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()  # one run at a time
+        self._thread: threading.Thread | None = None
+        self.runs = 0
+        self.failures = 0
+        self.last_result: object = None
+        self.last_error = ""
+        self.last_ms = 0.0
+        self.total_ms = 0.0
+        self.last_run_at: float | None = None
+
+    def start(self) -> "PeriodicJob":
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def nudge(self) -> None:
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.run_now()
+
+    def run_now(self):
+        """Run once; returns the job's result, or None if it raised."""
+        with self._lock:
+            started = time.perf_counter()
+            try:
+                result = self._fn()
+            except Exception as e:  # noqa: BLE001
+                if str(e) != self.last_error:
+                    print(f"⚠️ {self.name} に失敗: {e}")
+                self.last_error = str(e)
+                self.failures += 1
+                return None
+            finally:
+                self.last_ms = (time.perf_counter() - started) * 1000
+                self.total_ms += self.last_ms
+                self.last_run_at = time.time()
+            self.last_error = ""
+            self.last_result = result
+            self.runs += 1
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "interval_sec": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_ms": round(self.last_ms, 2),
+            "avg_ms": round(self.total_ms / (self.runs + self.failures), 2)
+            if self.runs + self.failures
+            else 0.0,
+            "last_run_at": self.last_run_at,
+            "last_result": self.last_result,
+            "last_error": self.last_error or None,
+        }
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+
+from .db import fetch_versions
+from .metrics import timed_query
+
+
+# What /api/search can look for: users (UID + full_name), tools (UID + tool
+# name) and tool_master names
+KINDS = ("user", "tool", "tool_name")
+# resource_versions that invalidate the index
+RESOURCES = ("users", "tools", "tool_names")
+
+SEARCH_LIMIT_MAX = 100
+
+# Match quality, best first
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING, FUZZY = range(5)
+MATCH_NAMES = ("exact", "prefix", "word_prefix", "substring", "fuzzy")
+_KIND_ORDER = {"tool_name": 0, "user": 1, "tool": 2}
+
+# Katakana -> hiragana, so "ドライバー" and "どらいばー" find each other
+_KANA = {c: c - 0x60 for c in range(ord("ァ"), ord("ヶ") + 1)}
+
+
+def normalize(text: str) -> str:
+    """Search key: NFKC (full/half width), case-folded, hiragana, no spaces."""
+    text = unicodedata.normalize("NFKC", text or "").casefold().translate(_KANA)
+    return "".join(text.split())
+
+
+def _words(text: str) -> list[str]:
+    folded = unicodedata.normalize("NFKC", text or "").casefold().translate(_KANA)
+    return folded.split()
+
+
+def _grams(key: str) -> list[str]:
+    """Character bigrams; bigrams rather than trigrams because Japanese names
+    are short and two kanji already discriminate well."""
+    return [key[i : i + 2] for i in range(len(key) - 1)]
+
+
+class SearchIndex:
+    """Immutable in-memory index over one snapshot of the catalog.
+
+    Entries are ``(kind, uid, name)``; ``uid`` is None for tool_master names.
+    Prefix lookups bisect a sorted list of normalized keys (whole name, each
+    space-separated word, UID); fuzzy lookups count shared character bigrams
+    through an inverted index and rank by Dice similarity. Tens of thousands
+    of entries take a few ms to search and well under a second to build.
+    """
+
+    def __init__(self, entries: list[tuple[str, str | None, str]], versions: dict[str, int]):
+        self.entries = entries
+        self.versions = versions
+        self._keys: list[tuple[str, int, int]] = []  # (key, match kind, entry)
+        self._norm: list[str] = []
+        self._grams: dict[str, list[int]] = {}
+        self._chars: dict[str, list[int]] = {}  # 1-character queries
+        self._gram_counts: list[int] = []
+        for i, (_kind, uid, name) in enumerate(entries):
+            key = normalize(name)
+            self._norm.append(key)
+            self._keys.append((key, PREFIX, i))
+            words = _words(name)
+            if len(words) > 1:
+                self._keys.extend((w, WORD_PREFIX, i) for w in words[1:])
+            if uid:
+                self._keys.append((normalize(uid), PREFIX, i))
+            grams = set(_grams(key))
+            self._gram_counts.append(len(grams))
+            for g in grams:
+                self._grams.setdefault(g, []).append(i)
+            for c in set(key):
+                self._chars.setdefault(c, []).append(i)
+        self._keys.sort()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _prefix_matches(self, q: str) -> dict[int, int]:
+        found: dict[int, int] = {}
+        keys = self._keys
+        for pos in range(bisect_left(keys, (q,)), len(keys)):
+            key, match, i = keys[pos]
+            if not key.startswith(q):
+                break
+            if match == PREFIX and key == q:
+                match = EXACT
+            if match < found.get(i, FUZZY + 1):
+                found[i] = match
+        return found
+
+    def _fuzzy_matches(self, q: str, min_similarity: float) -> dict[int, float]:
+        if len(q) == 1:
+            return {i: 1 / max(1, len(self._norm[i])) for i in self._chars.get(q, ())}
+        grams = set(_grams(q))
+        shared: Counter[int] = Counter()
+        for g in grams:
+            shared.update(self._grams.get(g, ()))
+        scores = {}
+        for i, n in shared.items():
+            similarity = 2 * n / (len(grams) + self._gram_counts[i])
+            if similarity >= min_similarity or n == len(grams):
+                scores[i] = similarity
+        return scores
+
+    def search(
+        self,
+        query: str,
+        kinds: tuple[str, ...] = KINDS,
+        limit: int = 20,
+        min_similarity: float = 0.3,
+    ) -> list[dict]:
+        """Best ``limit`` entries for ``query``, best match first."""
+        q = normalize(query)
+        if not q:
+            return []
+        ranked: dict[int, tuple[int, float]] = {}
+        for i, match in self._prefix_matches(q).items():
+            ranked[i] = (match, 1.0)
+        for i, similarity in self._fuzzy_matches(q, min_similarity).items():
+            if i in ranked:
+                continue
+            match = SUBSTRING if q in self._norm[i] else FUZZY
+            ranked[i] = (match, similarity)
+        # Ties: a tool name before the (many) tools carrying it, then shorter
+        hits = [
+            (match, -similarity, _KIND_ORDER[self.entries[i][0]], len(self._norm[i]), self._norm[i], i)
+            for i, (match, similarity) in ranked.items()
+            if self.entries[i][0] in kinds
+        ]
+        hits.sort()
+        results = []
+        for match, similarity, _kind, _len, _key, i in hits[: max(1, min(limit, SEARCH_LIMIT_MAX))]:
+            kind, uid, name = self.entries[i]
+            results.append(
+                {
+                    "kind": kind,
+                    "uid": uid,
+                    "name": name,
+                    "match": MATCH_NAMES[match],
+                    "score": round(-similarity, 3),
+                }
+            )
+        return results
+
+
+@timed_query("load_search_entries")
+def load_search_entries(conn) -> list[tuple[str, str | None, str]]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT 'user', uid, full_name FROM users
+            UNION ALL
+            SELECT 'tool', uid, name FROM tools
+            UNION ALL
+            SELECT 'tool_name', NULL, name FROM tool_master
+            """
+        )
+        return cur.fetchall()
+
+
+_index: SearchIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_search_index(conn) -> SearchIndex:
+    """Index for the current catalog, rebuilt after users/tools/names change.
+
+    Each call reads resource_versions (one indexed query); only a version
+    that moved since the last build reloads the catalog, so writes from any
+    process or station are picked up on the next search.
+    """
+    global _index
+    versions = fetch_versions(conn, *RESOURCES)
+    index = _index
+    if index is not None and index.versions == versions:
+        return index
+    with _index_lock:
+        if _index is None or _index.versions != versions:
+            # Versions read before the rows: the snapshot can only be newer
+            _index = SearchIndex(load_search_entries(conn), versions)
+        return _index
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Callable
+
+from .config import NAME_CACHE_NOTIFY, RUN_SCANNER, STARTUP_RETRY_SEC
+from .logs import log_event
+
+
+# Step states reported by GET /api/ready
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+RETRYING = "retrying"  # DB unreachable, tried again every STARTUP_RETRY_SEC
+FAILED = "failed"
+
+
+class Startup:
+    """Brings up the DB-backed parts of the web process, step by step.
+
+    Steps run in order; one that fails because the DB is unreachable is
+    retried every ``retry_sec`` (a kiosk may boot before PostgreSQL), any
+    other error stops the sequence. ``ready`` is true once every step is
+    done. The steps hold the waits of startup: connecting to (and migrating)
+    the DB, warming caches, opening the readers (pyscard is imported there)
+    and starting jobs, so the server can answer its first request before
+    they finish. Module imports are not deferred: ``create_app`` already
+    imports the routes and, through them, psycopg2 and the DB, journal and
+    NFC modules.
+    """
+
+    def __init__(self, sock=None, retry_sec: float = STARTUP_RETRY_SEC):
+        self.sock = sock
+        self.retry_sec = retry_sec
+        self.steps: list[tuple[str, Callable[[], str | None]]] = [
+            ("schema", self._schema),
+            ("name_cache", self._name_cache),
+            ("listener", self._listener),
+            ("scanner", self._scanner),
+            ("jobs", self._jobs),
+        ]
+        self._lock = threading.Lock()
+        self._status = {name: {"state": PENDING} for name, _ in self.steps}
+        self.started_at = time.monotonic()
+        self.ready_after_sec: float | None = None
+        self.scan_workers: list = []
+        self.scanner_lock = None  # ScannerClaim, held while we scan
+
+    # -- steps ----------------------------------------------------------------
+
+    def _schema(self) -> str:
+        from .db import ensure_tables
+
+        return "migrated" if ensure_tables() else "current"
+
+    def _name_cache(self) -> str:
+        from .db import get_conn, warm_name_cache
+
+        with get_conn() as conn:
+            warmed = warm_name_cache(conn)
+        print(f"🗂️ 名前キャッシュ読込: {warmed}件")
+        return f"{warmed}件"
+
+    def _listener(self) -> str:
+        if not NAME_CACHE_NOTIFY:
+            return "disabled"
+        from .cache import NAME_CACHE_CHANNEL, apply_name_notification, clear_names
+        from .notify import get_listener
+
+        listener = get_listener()
+        listener.subscribe(NAME_CACHE_CHANNEL, apply_name_notification)
+        listener.on_reconnect(clear_names)
+        listener.start()
+        return "started"
+
+    def _scanner(self) -> str:
+        if not RUN_SCANNER:
+            print("⏭️ NFC読取は python -m app.scanner で起動してください")
+            return "disabled"
+        from .background import SCAN_CONTROL_CHANNEL, get_replayer
+        from .notify import get_listener
+        from .scanner import ScannerClaim
+        from .station import start_scan_threads
+
+        if self.scanner_lock is None:  # kept across retries of this step
+            claim = ScannerClaim()
+            if not claim.acquire():
+                holder = claim.holder()
+                log_event("scanner_elsewhere", logging.WARNING, key=claim.key, holder=holder)
+                print(f"⏭️ この端末では別プロセスがNFCスキャン中のため読取を行いません（{holder}）")
+                return f"elsewhere: {holder}"
+            self.scanner_lock = claim
+            # start/stop/reset from other processes, and the lock re-check
+            # after the DB comes back (the lock dies with its connection)
+            listener = get_listener()
+            listener.subscribe(SCAN_CONTROL_CHANNEL, claim.apply_control)
+            listener.on_reconnect(claim.recheck)
+            listener.start()
+        self.scan_workers = start_scan_threads(sock=self.sock)
+        get_replayer(self.sock).nudge()  # flush scans journaled before a restart
+        print(f"📡 NFCスキャン監視スレッド開始 (リーダー{len(self.scan_workers)}台)")
+        return f"readers={len(self.scan_workers)}"
+
+    def _jobs(self) -> str:
+        from .analytics import get_refresher
+        from .overdue import get_overdue_detector
+        from .retention import get_retention_job
+
+        get_refresher().start().nudge()  # fold in loans changed while we were down
+        get_overdue_detector(self.sock).start().nudge()
+        get_retention_job().start().nudge()  # next months' scan_events partitions
+        return "started"
+
+    # -- running --------------------------------------------------------------
+
+    def _set(self, name: str, state: str, detail: str | None = None) -> None:
+        entry = {"state": state}
+        if detail:
+            entry["detail"] = detail
+        with self._lock:
+            self._status[name] = entry
+
+    def run(self) -> bool:
+        """Run every step (blocking); returns whether startup completed."""
+        from .db import is_db_outage
+
+        for name, step in self.steps:
+            attempts = 0
+            while True:
+                attempts += 1
+                self._set(name, RUNNING)
+                try:
+                    detail = step()
+                except Exception as e:  # noqa: BLE001
+                    if not is_db_outage(e):
+                        self._set(name, FAILED, str(e))
+                        log_event("startup_failed", logging.ERROR, step=name, error=str(e))
+                        print(f"❌ 起動処理に失敗 ({name}): {e}")
+                        return False
+                    self._set(name, RETRYING, str(e))
+                    if attempts == 1:
+                        print(f"⚠️ DB接続待ち（{self.retry_sec:.0f}秒ごとに再試行）: {e}")
+                    time.sleep(self.retry_sec)
+                    continue
+                self._set(name, DONE, detail)
+                break
+        self.ready_after_sec = time.monotonic() - self.started_at
+        log_event("startup_ready", seconds=round(self.ready_after_sec, 3))
+        print(f"✅ 起動完了（{self.ready_after_sec:.1f}秒）")
+        return True
+
+    def start(self, sio) -> None:
+        """Run the steps in a background task of ``sio`` (any async mode)."""
+        sio.start_background_task(self.run)
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return all(s["state"] == DONE for s in self._status.values())
+
+    def status(self) -> dict:
+        with self._lock:
+            steps = {name: dict(s) for name, s in self._status.items()}
+        return {
+            "ready": all(s["state"] == DONE for s in steps.values()),
+            "uptime_sec": round(time.monotonic() - self.started_at, 3),
+            "ready_after_sec": (
+                round(self.ready_after_sec, 3) if self.ready_after_sec is not None else None
+            ),
+            "steps": steps,
+        }
+
+
+_startup: Startup | None = None
+_startup_lock = threading.Lock()
+
+
+def get_startup(sock=None) -> Startup:
+    """Process-wide startup sequence (run by main.run)."""
+    global _startup
+    if _startup is None:
+        with _startup_lock:
+            if _startup is None:
+                if sock is None:
+                    from . import socketio as sock
+                _startup = Startup(sock)
+    return _startup
@@ -0,0 +1,573 @@
+"""Scan stations: the user -> tool state machine and the NFC scan loops.
+
+Kept free of Flask, Socket.IO and the DB driver so the station agent
+(``python -m app.agent``) loads only this; the DB-backed side effects live in
+``app.background`` and are imported on first use.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Callable
+
+from .cache import MISSING, TTLCache
+from .config import (
+    SCAN_DEBOUNCE_SEC,
+    SCAN_DEDUP_SIZE,
+    SCAN_POLL_TIMEOUT_SEC,
+    SCAN_RESET_SEC,
+    SCAN_SESSION_BATCH,
+    SCAN_SESSION_SEC,
+    STATION_ID,
+)
+from .logs import log_event
+from .metrics import SCAN_DROPPED, SCAN_TAPS, SCAN_TRANSACTION_SECONDS
+from .nfc import get_session, read_one_uid, reader_specs
+from .scheduler import Timer, get_scheduler
+
+if TYPE_CHECKING:
+    from flask_socketio import SocketIO
+
+
+WAITING_MESSAGE = "📡 スキャン待機中... ユーザータグをかざしてください"
+
+# Station phases
+IDLE = "idle"  # scanning stopped
+WAIT_USER = "wait_user"
+WAIT_TOOL = "wait_tool"
+PROCESSING = "processing"  # scan pair being written
+DONE = "done"  # result on screen until the reset timer fires
+SESSION = "session"  # bulk lending: every tool tap is for the session's user
+
+
+class TapFilter:
+    """Drops a tag read again at the same station within ``window`` seconds.
+
+    Keyed per (station, UID), so alternating two tags can't defeat it, and
+    kept outside the transaction state so a reset doesn't forget it. Every
+    read (accepted or not) restarts the window, so a tag bouncing on the
+    reader stays suppressed until it is taken away. Memory is bounded by
+    ``maxsize`` entries, each expiring after ``window``.
+    """
+
+    def __init__(self, window: float = SCAN_DEBOUNCE_SEC, maxsize: int = SCAN_DEDUP_SIZE):
+        self.window = window
+        self._recent = TTLCache(maxsize, window)
+        self._lock = threading.Lock()
+
+    def is_duplicate(self, station_id: str, uid: str) -> bool:
+        if self.window <= 0:
+            return False
+        key = (station_id, uid)
+        with self._lock:
+            duplicate = self._recent.get(key) is not MISSING
+            self._recent.set(key, True)
+        return duplicate
+
+
+_recent_taps = TapFilter()
+
+
+class ReaderBinding:
+    """One physical reader feeding a station, optionally pinned to a role."""
+
+    def __init__(self, name: str, role: str | None, station_id: str):
+        self.name = name
+        self.role = role  # "user" / "tool" / None (user then tool)
+        self.station_id = station_id  # recorded in scan_events.station_id
+
+
+# Default side effects of a ScanStation: the DB-backed versions in
+# app.background, imported on first call
+def _db_lookup_name(kind: str, uid: str) -> str:
+    from .background import lookup_name
+
+    return lookup_name(kind, uid)
+
+
+def _db_log_scan(uid: str, role: str | None, station_id: str) -> bool:
+    from .background import _log_scan
+
+    return _log_scan(uid, role, station_id)
+
+
+def _db_complete(sio, user_uid: str, tool_uid: str, station_id: str, label: str) -> str:
+    from .background import _complete_transaction
+
+    return _complete_transaction(sio, user_uid, tool_uid, station_id, label)
+
+
+def _db_complete_many(sio, pairs: list[tuple[str, str, str, str]]) -> list[str]:
+    from .background import _complete_transactions
+
+    return _complete_transactions(sio, pairs)
+
+
+class ScanStation:
+    """User -> tool scan state machine for one bench, fed by one or more readers.
+
+    A plain reader walks user -> tool itself; a bench with a dedicated badge
+    reader (role "user") and tool reader (role "tool") shares one machine, so
+    both tags can be read in parallel.
+
+    With ``session_sec`` (SCAN_SESSION_SEC) a user tap opens a bulk-lending
+    session instead: tool taps are accepted back to back, each a borrow or
+    return for that user, and queued to a committer thread that writes
+    whatever has piled up in one transaction. The session ends
+    ``session_sec`` after the last tap, when the same badge is read again,
+    or when another badge opens a session of its own (with a single reader
+    a tag counts as a badge if it is a registered user).
+
+    Every transition happens under ``lock``. Anything that ends the current
+    transaction (start/stop/reset, the post-transaction reset) bumps
+    ``generation``; delayed work carries the generation it was scheduled in
+    and is a no-op once it no longer matches, so a stale reset can never wipe
+    the next worker's user tag.
+    """
+
+    def __init__(
+        self, station_id: str, readers: list[ReaderBinding], session_sec: float = SCAN_SESSION_SEC
+    ):
+        self.station_id = station_id
+        self.readers = readers
+        self.session_sec = session_sec
+        self.lock = threading.Lock()
+        self.phase = WAIT_USER if scan_active() else IDLE
+        self.generation = 0
+        self.user_uid = ""
+        self.tool_uid = ""
+        self.message = ""
+        self.session_tools = 0  # tool taps in the current session
+        self._reset_timer: Timer | None = None
+        # Session tool taps waiting for the committer: (user, tool, reader
+        # station_id, tap time)
+        self._pending: list[tuple[str, str, str, float]] = []
+        self._committing = False
+        # Side effects of a transaction; the station agent (app.agent) swaps
+        # these for versions that go through the central server
+        self.lookup_name: Callable[[str, str], str] = _db_lookup_name
+        self.log_scan: Callable[[str, str | None, str], object] = _db_log_scan
+        self.complete: Callable[..., str | None] = _db_complete
+        self.complete_many: Callable[..., list[str]] = _db_complete_many
+
+    # -- transitions (callers hold self.lock) --------------------------------
+
+    def _begin(self, phase: str, message: str) -> None:
+        self.generation += 1
+        if self._reset_timer is not None:
+            self._reset_timer.cancel()
+            self._reset_timer = None
+        self.phase = phase
+        self.user_uid = ""
+        self.tool_uid = ""
+        self.message = message
+        self.session_tools = 0
+
+    def start(self, message: str = WAITING_MESSAGE) -> None:
+        with self.lock:
+            self._begin(WAIT_USER, message)
+
+    def stop(self, message: str = "") -> None:
+        with self.lock:
+            self._begin(IDLE, message)
+
+    def reset(self, message: str = "") -> None:
+        with self.lock:
+            self._begin(IDLE if self.phase == IDLE else WAIT_USER, message)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "station_id": self.station_id,
+                "phase": self.phase,
+                "generation": self.generation,
+                "user_uid": self.user_uid,
+                "tool_uid": self.tool_uid,
+                "message": self.message,
+                "session_tools": self.session_tools,
+                "pending": len(self._pending),
+            }
+
+    def _payload(self, **extra) -> dict:
+        payload = {
+            "station_id": self.station_id,
+            "user_uid": self.user_uid,
+            "tool_uid": self.tool_uid,
+            "message": self.message,
+        }
+        payload.update(extra)
+        return payload
+
+    # -- taps -----------------------------------------------------------------
+
+    def handle_tap(self, sio, uid: str, reader: ReaderBinding) -> None:
+        if _recent_taps.is_duplicate(self.station_id, uid):
+            SCAN_DROPPED.inc(station=self.station_id, reason="debounce")
+            return
+        badge = False
+        if reader.role is None and self.phase == SESSION:
+            # One reader for both: a registered user ends/replaces the session
+            # (asked second: most taps are tools, whose names are cached)
+            badge = self.lookup_name("tool", uid) == uid and self.lookup_name("user", uid) != uid
+        session_tap = False
+        closed = None  # state_reset payload of a session this tap ends
+        rejected = None  # scan_update payload of a tool read before any user
+        with self.lock:
+            if self.phase not in (WAIT_USER, WAIT_TOOL, SESSION):
+                SCAN_DROPPED.inc(station=self.station_id, reason="not_waiting")
+                return  # stopped, or a transaction is still on screen
+
+            if self.phase == SESSION:
+                wants_tool = reader.role == "tool" or (reader.role is None and not badge)
+            else:
+                wants_tool = reader.role == "tool" or (reader.role is None and self.phase == WAIT_TOOL)
+            if not wants_tool:
+                same_badge = False
+                if self.phase == SESSION:
+                    user_uid, tools = self.user_uid, self.session_tools
+                    self._begin(WAIT_USER, WAITING_MESSAGE)
+                    same_badge = uid == user_uid  # the same badge again: done
+                    closed = self._session_closed(
+                        user_uid, tools, "badge" if same_badge else "next_user"
+                    )
+                if not same_badge:
+                    if self.session_sec > 0:
+                        self.phase = SESSION
+                        self._arm_session_timer(sio)
+                    else:
+                        self.phase = WAIT_TOOL  # a new badge replaces the user until a tool is read
+                    self.user_uid = uid
+                    generation = self.generation
+            elif self.phase == WAIT_USER:
+                SCAN_DROPPED.inc(station=self.station_id, reason="no_user")
+                self.message = "👤 先にユーザータグをかざしてください"
+                rejected = self._payload(tool_uid=uid)
+            elif self.phase == SESSION:
+                self.tool_uid = uid
+                self.session_tools += 1
+                self._arm_session_timer(sio)
+                self._pending.append((self.user_uid, uid, reader.station_id, time.perf_counter()))
+                start_committer = not self._committing
+                self._committing = True
+                session_tap, generation = True, self.generation
+            else:
+                self.tool_uid = uid
+                self.phase = PROCESSING
+                user_uid, generation = self.user_uid, self.generation
+
+        if rejected is not None:
+            sio.emit("scan_update", rejected)
+            return
+        if closed is not None:
+            sio.emit("state_reset", closed)
+            if same_badge:
+                return
+        SCAN_TAPS.inc(station=self.station_id, role="tool" if wants_tool else "user")
+        # Name lookups and DB writes happen outside the lock
+        if not wants_tool:
+            self._on_user(sio, uid, reader, generation)
+        elif session_tap:
+            if start_committer:
+                threading.Thread(target=self._commit_pending, args=(sio,), daemon=True).start()
+            self._on_session_tool(sio, uid, generation)
+        else:
+            self._on_tool(sio, user_uid, uid, reader, generation)
+
+    def _on_user(self, sio, uid: str, reader: ReaderBinding, generation: int) -> None:
+        user_name = self.lookup_name("user", uid)
+        self.log_scan(uid, "user", reader.station_id)
+        with self.lock:
+            if generation != self.generation or self.user_uid != uid:
+                return  # reset, or another badge was read meanwhile
+            self.message = f"👤 ユーザー読取: {user_name} ({uid})"
+            if self.phase == SESSION:
+                self.message += " — 工具を続けてかざしてください"
+            payload = self._payload(user_name=user_name, tool_name="")
+        sio.emit("scan_update", payload)
+
+    def _on_tool(
+        self, sio, user_uid: str, uid: str, reader: ReaderBinding, generation: int
+    ) -> None:
+        started = time.perf_counter()
+        action = "error"
+        try:
+            # Resolved before taking the lock (may query the DB); inside the
+            # try so a failed lookup still ends in DONE and the reset below
+            tool_name = self.lookup_name("tool", uid)
+            with self.lock:
+                if generation == self.generation:
+                    self.message = f"🛠️ 工具読取: {tool_name} ({uid})"
+            action = self.complete(sio, user_uid, uid, reader.station_id, self.station_id) or "done"
+        except Exception as e:  # noqa: BLE001
+            error_msg = f"❌ エラー: {e}"
+            print(error_msg)
+            sio.emit("error", {"station_id": self.station_id, "message": error_msg})
+        elapsed = time.perf_counter() - started
+        SCAN_TRANSACTION_SECONDS.observe(elapsed, station=self.station_id, action=action)
+        log_event(
+            "transaction",
+            station=self.station_id,
+            reader=reader.station_id,
+            user_uid=user_uid,
+            tool_uid=uid,
+            action=action,
+            ms=round(elapsed * 1000, 2),
+        )
+        with self.lock:
+            if generation != self.generation:
+                return  # stopped/reset while the pair was being written
+            self.phase = DONE
+            self._reset_timer = get_scheduler().call_later(
+                SCAN_RESET_SEC, self._reset_after_transaction, sio, generation
+            )
+
+    def _reset_after_transaction(self, sio, generation: int) -> None:
+        with self.lock:
+            if generation != self.generation:
+                return  # stale timer
+            self._begin(WAIT_USER, WAITING_MESSAGE)
+        sio.emit("state_reset", {"station_id": self.station_id, "message": WAITING_MESSAGE})
+        print("🔄 次の処理待ち")
+
+    # -- bulk lending sessions ------------------------------------------------
+
+    def _arm_session_timer(self, sio) -> None:
+        """(Re)start the idle timeout; caller holds the lock."""
+        if self._reset_timer is not None:
+            self._reset_timer.cancel()
+        self._reset_timer = get_scheduler().call_later(
+            self.session_sec, self._end_session, sio, self.generation, self.session_tools
+        )
+
+    def _end_session(self, sio, generation: int, tools: int) -> None:
+        with self.lock:
+            if generation != self.generation or tools != self.session_tools:
+                return  # stale timer (reset, or a tap re-armed it)
+            user_uid = self.user_uid
+            self._begin(WAIT_USER, WAITING_MESSAGE)
+            closed = self._session_closed(user_uid, tools, "timeout")
+        sio.emit("state_reset", closed)
+
+    def _session_closed(self, user_uid: str, tools: int, reason: str) -> dict:
+        """End-of-session message (caller holds the lock, phase reset);
+        returns the ``state_reset`` payload to emit once the lock is released."""
+        log_event("session_closed", station=self.station_id, user_uid=user_uid, tools=tools, reason=reason)
+        message = f"🔚 まとめ処理終了（工具{tools}件） — {WAITING_MESSAGE}"
+        self.message = message
+        print(f"🔚 まとめ処理終了: {user_uid} 工具{tools}件 ({reason})")
+        return {"station_id": self.station_id, "message": message}
+
+    def _on_session_tool(self, sio, uid: str, generation: int) -> None:
+        tool_name = self.lookup_name("tool", uid)
+        with self.lock:
+            if generation != self.generation or self.tool_uid != uid:
+                return  # session ended, or the next tool was read meanwhile
+            self.message = f"🛠️ 工具読取: {tool_name} ({uid})（{self.session_tools}件目）"
+            payload = self._payload(tool_name=tool_name)
+        sio.emit("scan_update", payload)
+
+    def _commit_pending(self, sio) -> None:
+        """Write queued session taps until none are left, a batch at a time.
+
+        Taps read while a batch commits form the next one, so a quick run of
+        taps costs a few transactions while a single tap is written at once.
+        Runs on its own thread: the scan loop keeps reading meanwhile.
+        """
+        while True:
+            with self.lock:
+                batch = self._pending[:SCAN_SESSION_BATCH]
+                del self._pending[:SCAN_SESSION_BATCH]
+                if not batch:
+                    self._committing = False
+                    return
+            pairs = [(user_uid, tool_uid, sid, self.station_id) for user_uid, tool_uid, sid, _t in batch]
+            try:
+                actions = self.complete_many(sio, pairs)
+            except Exception as e:  # noqa: BLE001
+                actions = ["error"] * len(batch)
+                error_msg = f"❌ エラー: {e}"
+                print(error_msg)
+                sio.emit("error", {"station_id": self.station_id, "message": error_msg})
+            done = time.perf_counter()
+            for (user_uid, tool_uid, sid, tapped), action in zip(batch, actions):
+                SCAN_TRANSACTION_SECONDS.observe(done - tapped, station=self.station_id, action=action)
+                log_event(
+                    "transaction",
+                    station=self.station_id,
+                    reader=sid,
+                    user_uid=user_uid,
+                    tool_uid=tool_uid,
+                    action=action,
+                    ms=round((done - tapped) * 1000, 2),
+                    batch=len(batch),
+                )
+
+
+_stations: list[ScanStation] | None = None
+_stations_lock = threading.Lock()
+
+
+def get_stations() -> list[ScanStation]:
+    """Scan stations built from NFC_READERS (one per reader, plus one shared
+    station for role-pinned readers). A single reader keeps STATION_ID as is."""
+    global _stations
+    if _stations is None:
+        with _stations_lock:
+            if _stations is None:
+                specs = reader_specs()
+                if len(specs) == 1:
+                    name, role = specs[0]
+                    stations = [ScanStation(STATION_ID, [ReaderBinding(name, None, STATION_ID)])]
+                else:
+                    stations = []
+                    bench = [
+                        ReaderBinding(name, role, f"{STATION_ID}:{name}")
+                        for name, role in specs
+                        if role
+                    ]
+                    if bench:
+                        stations.append(ScanStation(STATION_ID, bench))
+                    for name, role in specs:
+                        if not role:
+                            sid = f"{STATION_ID}:{name}"
+                            stations.append(ScanStation(sid, [ReaderBinding(name, None, sid)]))
+                _stations = stations
+    return _stations
+
+
+# Set while scanning is active; the scan loops block on it instead of polling
+_scan_wakeup = threading.Event()
+
+
+def scan_active() -> bool:
+    return _scan_wakeup.is_set()
+
+
+def set_scan_active(active: bool) -> None:
+    if active:
+        _scan_wakeup.set()
+    else:
+        _scan_wakeup.clear()
+
+
+def start_stations(message: str = WAITING_MESSAGE) -> None:
+    for station in get_stations():
+        station.start(message)
+    set_scan_active(True)
+
+
+def stop_stations(message: str = "") -> None:
+    set_scan_active(False)
+    for station in get_stations():
+        station.stop(message)
+
+
+def reset_stations(message: str = "") -> None:
+    for station in get_stations():
+        station.reset(message)
+
+
+class TapCapture:
+    """Hands the next tap of the running scan loops to a one-shot read.
+
+    Registering or checking a tag reads a single UID. While the scan loops
+    consume the reader queues, reading a queue directly would race them:
+    the check could take a worker's tap away from the station or return
+    another worker's tap. The request waits here instead, and the next tap
+    any loop reads goes to it rather than to the station.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: list[queue.Queue] = []
+
+    def offer(self, uid: str) -> bool:
+        """Give ``uid`` to the oldest waiting read; False if none is waiting."""
+        with self._lock:
+            if not self._waiters:
+                return False
+            self._waiters.pop(0).put_nowait(uid)
+        return True
+
+    def wait(self, timeout: float) -> str | None:
+        waiter: queue.Queue = queue.Queue(maxsize=1)
+        with self._lock:
+            self._waiters.append(waiter)
+        try:
+            return waiter.get(timeout=timeout)
+        except queue.Empty:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    return None
+            return waiter.get_nowait()  # offered just as the wait timed out
+
+
+_tap_capture = TapCapture()
+
+
+def read_tag(timeout: float) -> str | None:
+    """One tag for the register/check screens, without disturbing scanning.
+
+    Only valid where the readers live (``scanner_here()``).
+    """
+    if scan_active():
+        return _tap_capture.wait(timeout)
+    return read_one_uid(timeout=timeout)
+
+
+def scan_monitor(
+    sock: SocketIO | None = None,
+    station: ScanStation | None = None,
+    reader: ReaderBinding | None = None,
+):
+    """Background NFC scan loop for one reader.
+
+    Emits Socket.IO events to update UI.
+    """
+    if sock is None:
+        from . import socketio as sock
+    sio = sock
+    station = station or get_stations()[0]
+    reader = reader or station.readers[0]
+    session = get_session(reader.name)
+
+    while True:
+        if not scan_active():
+            _scan_wakeup.wait()
+            session.drain()  # taps made while stopped are not transactions
+            continue
+
+        try:
+            # Blocks until the reader session delivers a tag (no polling)
+            uid = session.get(timeout=SCAN_POLL_TIMEOUT_SEC)
+            if uid and not _tap_capture.offer(uid):
+                station.handle_tap(sio, uid, reader)
+        except Exception as e:  # noqa: BLE001
+            print(f"スキャンループエラー ({reader.name}): {e}")
+            time.sleep(1)
+
+
+_scan_threads: list[threading.Thread] = []
+
+
+def scanner_here() -> bool:
+    """True if this process runs the scan loops (owns the readers)."""
+    return bool(_scan_threads)
+
+
+def start_scan_threads(sock: SocketIO | None = None) -> list[threading.Thread]:
+    """One scan worker per configured reader."""
+    threads = _scan_threads
+    for station in get_stations():
+        for reader in station.readers:
+            t = threading.Thread(
+                target=scan_monitor,
+                kwargs={"sock": sock, "station": station, "reader": reader},
+                daemon=True,
+            )
+            t.start()
+            threads.append(t)
+    return list(threads)
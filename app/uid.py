@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import re
+
+
+# Tag identifiers the readers produce, by length in bytes
+UID_LENGTHS = {
+    4: "ISO 14443 single-size UID (NUID)",
+    7: "ISO 14443 double-size UID",
+    8: "FeliCa IDm",
+    10: "ISO 14443 triple-size UID",
+}
+
+_SEPARATORS = re.compile(r"[\s:\-]")
+
+
+class Uid(str):
+    """A tag UID in canonical form: uppercase hex of the raw bytes.
+
+    Normalized once where a UID enters the system (reader, API, import,
+    agent payload); afterwards it is an ordinary ``str`` (hashes and
+    compares like its text, so caches and dedup keys need nothing special)
+    that PostgreSQL receives as ``bytea`` (``app.db`` registers the adapter).
+
+    ``Uid(raw)`` accepts hex text with any case and ``:``/``-``/space
+    separators, bytes, or a list of byte values, and raises ``ValueError``
+    unless it is 4, 7 or 10 bytes (ISO 14443) or 8 (FeliCa IDm).
+    ``Uid.from_bytes`` wraps stored values without validation.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, raw) -> "Uid":
+        if isinstance(raw, Uid):
+            return raw
+        if isinstance(raw, (bytes, bytearray, memoryview, list, tuple)):
+            data = bytes(raw)
+        elif isinstance(raw, str):
+            text = _SEPARATORS.sub("", raw)
+            try:
+                data = bytes.fromhex(text)
+            except ValueError:
+                raise ValueError(f"UIDは16進数で指定してください: {raw!r}") from None
+        else:
+            raise TypeError(f"UID must be str or bytes, not {type(raw).__name__}")
+        if len(data) not in UID_LENGTHS:
+            raise ValueError(f"UIDの長さが不正です（{len(data)}バイト、4/7/8/10バイトのみ）: {raw!r}")
+        return str.__new__(cls, data.hex().upper())
+
+    @classmethod
+    def from_bytes(cls, data) -> "Uid":
+        """Stored value (``bytea``) as a Uid; not validated (older rows may not be)."""
+        return str.__new__(cls, bytes(data).hex().upper())
+
+    @property
+    def bytes(self) -> bytes:
+        return bytes.fromhex(self)
+
+    @property
+    def kind(self) -> str:
+        return UID_LENGTHS.get(len(self) // 2, "unknown")
+
+
+def parse_uid(raw) -> Uid | None:
+    """``Uid(raw)``, or None for a missing/invalid value."""
+    if raw is None or raw == "":
+        return None
+    try:
+        return Uid(raw)
+    except (TypeError, ValueError):
+        return None
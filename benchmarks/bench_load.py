@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""Load test: N virtual stations tapping through the real scan path.
+
+Every virtual station is a real ``ScanStation`` fed by its own scan_monitor
+thread and a fake reader; a driver thread per station taps user -> tool ->
+(wait for the result) -> next pair, so borrows and returns go through
+process_scan_pair, the pool, the scan_events writer and Socket.IO exactly as
+on a Pi. Reports tap-to-``transaction_complete`` latency percentiles,
+throughput and DB round trips per transaction.
+
+``--session`` drives bulk lending instead: one user tap, then every tool
+tapped ``--think-ms`` apart without waiting for results (taps that pile up
+while a batch commits share the next transaction).
+
+Runs in a throw-away schema (``bench_load`` by default) of the configured
+DB, e.g. the docker-compose PostgreSQL (``make db-up``):
+
+    python -m benchmarks.bench_load --stations 20 --pairs 50 --clients 10
+    python -m benchmarks.bench_load --stations 20 --pairs 50 --session
+"""
+
+from __future__ import annotations
+
+import os
+
+# Fake readers, and a short result screen so each station turns over quickly
+os.environ.setdefault("NFC_BACKEND", "fake")
+os.environ.setdefault("SCAN_RESET_SEC", "0.05")
+# Drivers re-tap the same badge/tool pair far faster than people do
+os.environ.setdefault("SCAN_DEBOUNCE_SEC", "0")
+os.environ.setdefault("PAIR_DEDUP_SEC", "0")
+
+import argparse  # noqa: E402
+import queue  # noqa: E402
+import statistics  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+
+import psycopg2  # noqa: E402
+import psycopg2.extensions  # noqa: E402
+
+from app import create_app, socketio  # noqa: E402
+from app import db  # noqa: E402
+from app.station import ReaderBinding, ScanStation, scan_monitor, set_scan_active  # noqa: E402
+from app.config import DB_CONFIG, NFC_BACKEND  # noqa: E402
+from app.nfc import get_session  # noqa: E402
+from app.scanlog import get_scan_writer  # noqa: E402
+
+
+class RoundTrips:
+    """Client-side count of statements sent to PostgreSQL (incl. BEGIN/COMMIT)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, n: int = 1) -> None:
+        with self._lock:
+            self.count += n
+
+
+round_trips = RoundTrips()
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        conn = self.connection
+        if not conn.autocommit and conn.status == psycopg2.extensions.STATUS_READY:
+            round_trips.add()  # implicit BEGIN
+        round_trips.add()
+        return super().execute(query, vars)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = CountingCursor
+
+    def commit(self):
+        if self.status == psycopg2.extensions.STATUS_IN_TRANSACTION:
+            round_trips.add()
+        return super().commit()
+
+    def rollback(self):
+        if self.status == psycopg2.extensions.STATUS_IN_TRANSACTION:
+            round_trips.add()
+        return super().rollback()
+
+
+def _counting_connect():
+    return psycopg2.connect(**DB_CONFIG, connection_factory=CountingConnection)
+
+
+class Probe:
+    """Stands in for the Socket.IO server in the scan loops.
+
+    Forwards every emit to the real server (so connected clients receive it)
+    and hands ``(event, data, t)`` to the driver of the emitting station.
+    """
+
+    def __init__(self, sio):
+        self._sio = sio
+        self.inboxes: dict[str, queue.Queue] = {}
+
+    def emit(self, event: str, data: dict | None = None, **kwargs) -> None:
+        now = time.perf_counter()
+        self._sio.emit(event, data, **kwargs)
+        inbox = self.inboxes.get((data or {}).get("station_id"))
+        if inbox is not None:
+            inbox.put((event, data, now))
+
+
+# Synthetic tags: 4-byte user UIDs, 7-byte tool UIDs (station, tool number)
+_USER_BASE = 0x01000000
+_TOOL_BASE = 0x02 << 48
+
+
+def _user_uid(station: int) -> str:
+    return f"{_USER_BASE + station:08X}"
+
+
+def _tool_uid(station: int, tool: int) -> str:
+    return f"{_TOOL_BASE + (station << 24) + tool:014X}"
+
+
+def _seed(schema: str, stations: int, tools: int) -> None:
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        cur.execute(f"CREATE SCHEMA {schema}")
+    conn.close()
+    DB_CONFIG["options"] = f"-c search_path={schema}"
+    db.ensure_tables()
+    with db.get_conn() as conn, conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO tool_master(name) VALUES ('負荷試験工具') ON CONFLICT DO NOTHING")
+        cur.execute(
+            """
+            INSERT INTO users(uid, full_name)
+            SELECT decode(lpad(to_hex(%s + g), 8, '0'), 'hex'), '利用者' || g
+              FROM generate_series(0, %s) g
+            """,
+            (_USER_BASE, stations - 1),
+        )
+        cur.execute(
+            """
+            INSERT INTO tools(uid, name)
+            SELECT decode(lpad(to_hex(%s + (s::bigint << 24) + t), 14, '0'), 'hex'), '負荷試験工具'
+              FROM generate_series(0, %s) s, generate_series(0, %s) t
+            """,
+            (_TOOL_BASE, stations - 1, tools - 1),
+        )
+    with db.get_conn() as conn:
+        db.warm_name_cache(conn)
+
+
+def _wait_for(inbox: queue.Queue, event: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        name, data, t = inbox.get(timeout=max(0.0, deadline - time.monotonic()))
+        if name == event:
+            return data, t
+        if name == "error":
+            raise RuntimeError(data.get("message"))
+
+
+def _drive(index: int, station: ScanStation, probe: Probe, pairs: int, tools: int,
+           think: float, latencies: list[float], errors: list[str]) -> None:
+    reader = get_session(station.readers[0].name).reader
+    inbox = probe.inboxes[station.station_id]
+    user = _user_uid(index)
+    for n in range(pairs):
+        try:
+            reader.tap(user)
+            _wait_for(inbox, "scan_update")
+            time.sleep(think)
+            t0 = time.perf_counter()
+            reader.tap(_tool_uid(index, n % tools))
+            _data, t1 = _wait_for(inbox, "transaction_complete")
+            latencies.append((t1 - t0) * 1000)
+            _wait_for(inbox, "state_reset")
+            time.sleep(think)
+        except Exception as e:  # noqa: BLE001
+            errors.append(f"{station.station_id}: {e!r}")
+            return
+
+
+def _drive_session(index: int, station: ScanStation, probe: Probe, pairs: int, tools: int,
+                   think: float, latencies: list[float], errors: list[str]) -> None:
+    reader = get_session(station.readers[0].name).reader
+    inbox = probe.inboxes[station.station_id]
+    user = _user_uid(index)
+    try:
+        reader.tap(user)
+        _wait_for(inbox, "scan_update")
+        tapped = []
+        for n in range(pairs):
+            tapped.append(time.perf_counter())
+            reader.tap(_tool_uid(index, n % tools))
+            time.sleep(think)
+        for t0 in tapped:
+            _data, t1 = _wait_for(inbox, "transaction_complete")
+            latencies.append((t1 - t0) * 1000)
+        reader.tap(user)  # same badge again: end of session
+        _wait_for(inbox, "state_reset")
+    except Exception as e:  # noqa: BLE001
+        errors.append(f"{station.station_id}: {e!r}")
+
+
+def _percentile(samples: list[float], p: int) -> float:
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method="inclusive")[p - 1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stations", type=int, default=10)
+    parser.add_argument("--pairs", type=int, default=50, help="transactions per station")
+    parser.add_argument("--tools", type=int, default=5, help="tools per station (borrow/return alternate)")
+    parser.add_argument("--clients", type=int, default=0, help="Socket.IO test clients receiving every event")
+    parser.add_argument("--think-ms", type=float, default=20.0, help="pause between taps")
+    parser.add_argument("--session", action="store_true", help="bulk lending: one user tap, then all tools")
+    parser.add_argument("--schema", default="bench_load")
+    parser.add_argument("--keep", action="store_true", help="keep the bench schema")
+    args = parser.parse_args()
+    if NFC_BACKEND != "fake":
+        raise SystemExit("NFC_BACKEND=fake で実行してください")
+
+    db.connect = _counting_connect  # every pooled connection counts its round trips
+    _seed(args.schema, args.stations, args.tools)
+    app = create_app()
+    clients = [socketio.test_client(app) for _ in range(args.clients)]
+    probe = Probe(socketio)
+
+    set_scan_active(True)
+    stations = []
+    for i in range(args.stations):
+        sid = f"load{i}"
+        station = ScanStation(
+            sid, [ReaderBinding(sid, None, sid)], session_sec=30.0 if args.session else 0.0
+        )
+        station.start()
+        probe.inboxes[sid] = queue.Queue()
+        threading.Thread(
+            target=scan_monitor,
+            kwargs={"sock": probe, "station": station, "reader": station.readers[0]},
+            daemon=True,
+        ).start()
+        stations.append(station)
+
+    latencies: list[float] = []
+    errors: list[str] = []
+    drivers = [
+        threading.Thread(
+            target=_drive_session if args.session else _drive,
+            args=(i, st, probe, args.pairs, args.tools, args.think_ms / 1000, latencies, errors),
+        )
+        for i, st in enumerate(stations)
+    ]
+    trips_before = round_trips.count
+    started = time.perf_counter()
+    for d in drivers:
+        d.start()
+    for d in drivers:
+        d.join()
+    elapsed = time.perf_counter() - started
+    get_scan_writer().stop()  # flush scan_events so their cost is counted
+    trips = round_trips.count - trips_before
+
+    done = len(latencies)
+    mode = "まとめ貸出, " if args.session else ""
+    print(f"\n🏁 {args.stations}台 × {args.pairs}件 ({mode}クライアント{args.clients}) {elapsed:.1f}s")
+    print(f"{'transactions':<28}{done:>10}")
+    print(f"{'throughput (tx/s)':<28}{done / elapsed:>10.1f}")
+    print(f"{'throughput (tx/min)':<28}{done / elapsed * 60:>10.0f}")
+    for p in (50, 95, 99):
+        print(f"{f'tap→complete p{p} (ms)':<28}{_percentile(latencies, p):>10.2f}")
+    print(f"{'tap→complete max (ms)':<28}{max(latencies, default=0):>10.2f}")
+    print(f"{'DB round trips / tx':<28}{trips / done if done else 0:>10.2f}")
+    pool = db.pool_stats()
+    print(f"{'pool wait max (ms)':<28}{pool['wait_time_max_sec'] * 1000:>10.2f}")
+    if clients:
+        received = sum(len(c.get_received()) for c in clients)
+        print(f"{'events / client':<28}{received / len(clients):>10.0f}")
+    for e in errors[:10]:
+        print(f"❌ {e}")
+
+    set_scan_active(False)
+    if not args.keep:
+        DB_CONFIG.pop("options", None)
+        conn = psycopg2.connect(**DB_CONFIG)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
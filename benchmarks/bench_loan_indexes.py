@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Measure hot query latency on a large loans/scan_events data set,
+before and after the indexes from schema migration 1.
+
+Builds a throw-away schema (``bench_idx`` by default) next to the real
+tables, so it is safe to run against the development DB:
+
+    python -m benchmarks.bench_loan_indexes --rows 1000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+
+import psycopg2
+
+from app.config import DB_CONFIG
+from app.db import fetch_open_loans, fetch_recent_history
+from app.migrations import MIGRATIONS
+
+
+def _build(cur, schema: str, rows: int, tools: int) -> None:
+    cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    cur.execute(f"CREATE SCHEMA {schema}")
+    cur.execute(f"SET search_path TO {schema}, public")
+    cur.execute(
+        """
+        CREATE TABLE loans(
+          id BIGINT PRIMARY KEY,
+          tool_uid TEXT NOT NULL,
+          borrower_uid TEXT NOT NULL,
+          loaned_at TIMESTAMPTZ NOT NULL,
+          return_user_uid TEXT,
+          returned_at TIMESTAMPTZ
+        )
+        """
+    )
+    # One row per minute going back in time; the newest `tools` loans stay open
+    # (one per tool), everything older was returned 0-8 hours later.
+    cur.execute(
+        """
+        INSERT INTO loans
+        SELECT g,
+               'T' || (g %% %(tools)s),
+               'U' || (g %% 500),
+               now() - (%(rows)s - g) * interval '1 minute',
+               CASE WHEN g > %(rows)s - %(tools)s THEN NULL ELSE 'U' || (g %% 500) END,
+               CASE WHEN g > %(rows)s - %(tools)s THEN NULL
+                    ELSE now() - (%(rows)s - g) * interval '1 minute'
+                         + (g %% 480) * interval '1 minute' END
+          FROM generate_series(1, %(rows)s) AS g
+        """,
+        {"rows": rows, "tools": tools},
+    )
+    cur.execute(
+        """
+        CREATE TABLE scan_events(
+          id BIGINT PRIMARY KEY,
+          ts TIMESTAMPTZ NOT NULL,
+          station_id TEXT NOT NULL,
+          tag_uid TEXT NOT NULL,
+          role_hint TEXT
+        )
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO scan_events
+        SELECT g,
+               now() - (%(rows)s - g) * interval '30 seconds',
+               'pi' || (g %% 20 + 1),
+               CASE WHEN g %% 2 = 0 THEN 'U' || (g %% 500) ELSE 'T' || (g %% %(tools)s) END,
+               CASE WHEN g %% 2 = 0 THEN 'user' ELSE 'tool' END
+          FROM generate_series(1, %(rows)s) AS g
+        """,
+        {"rows": rows, "tools": tools},
+    )
+    cur.execute("ANALYZE loans")
+    cur.execute("ANALYZE scan_events")
+
+
+def _timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def _run_queries(conn, repeat: int, tools: int) -> dict[str, float]:
+    def borrow_lookup():
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, borrower_uid FROM loans
+                WHERE tool_uid=%s AND returned_at IS NULL
+                ORDER BY loaned_at DESC LIMIT 1
+                """,
+                (f"T{tools // 2}",),
+            )
+            cur.fetchall()
+
+    def station_last_seen():
+        with conn.cursor() as cur:
+            cur.execute("SELECT max(ts) FROM scan_events WHERE station_id=%s", ("pi7",))
+            cur.fetchall()
+
+    def scans_last_hour():
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT count(*) FROM scan_events WHERE ts > now() - interval '1 hour'"
+            )
+            cur.fetchall()
+
+    return {
+        "borrow_or_return lookup": _timed(borrow_lookup, repeat),
+        "fetch_open_loans(100)": _timed(lambda: fetch_open_loans(conn), repeat),
+        "fetch_recent_history(50)": _timed(lambda: fetch_recent_history(conn), repeat),
+        "station last_seen": _timed(station_last_seen, repeat),
+        "scans in last hour": _timed(scans_last_hour, repeat),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--tools", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--schema", default="bench_idx")
+    parser.add_argument("--keep", action="store_true", help="keep the bench schema")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            t0 = time.perf_counter()
+            _build(cur, args.schema, args.rows, args.tools)
+            print(f"⏱️ {args.rows:,}件の貸出/スキャンを生成: {time.perf_counter() - t0:.1f}s")
+
+        before = _run_queries(conn, args.repeat, args.tools)
+
+        with conn.cursor() as cur:
+            for version, _description, statements in MIGRATIONS:
+                if version != 1:
+                    continue
+                for sql in statements:
+                    cur.execute(sql)
+            cur.execute("ANALYZE loans")
+            cur.execute("ANALYZE scan_events")
+
+        after = _run_queries(conn, args.repeat, args.tools)
+
+        print(f"\n{'query':<28}{'no index (ms)':>15}{'indexed (ms)':>15}{'speedup':>10}")
+        for name in before:
+            b, a = before[name], after[name]
+            print(f"{name:<28}{b:>15.2f}{a:>15.2f}{b / a if a else 0:>9.0f}x")
+    finally:
+        if not args.keep:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
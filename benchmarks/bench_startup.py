@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Cold-start benchmark: import time of the web server and time to first screen.
+
+Import time comes from ``python -X importtime -c "import app.main"`` in a
+fresh interpreter (median of ``--runs``), with the modules costing the most
+on their own. Then ``python -m app.main`` is started on a free port and
+polled until ``GET /`` answers (first usable screen) and ``GET /api/ready``
+reports 200 (DB, caches and readers up). ``--db-down`` points the server at
+a closed port to check the screen still comes up while the DB is missing.
+
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --budget-ms 400   # exit 1 if slower
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def _env(**extra) -> dict:
+    env = dict(os.environ)
+    env.setdefault("NFC_BACKEND", "fake")
+    env.update(extra)
+    return env
+
+
+def measure_imports(module: str = "app.main") -> tuple[float, list[tuple[float, float, str]]]:
+    """Total import ms of ``module`` and ``[(self ms, cumulative ms, name)]``."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=_env(),
+        check=True,
+    )
+    rows = []
+    total = 0.0
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        if not m:
+            continue
+        self_us, cumulative_us, _indent, name = m.groups()
+        rows.append((int(self_us) / 1000, int(cumulative_us) / 1000, name))
+        if name == module:
+            total = int(cumulative_us) / 1000
+    return total, rows
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _status(port: int, path: str) -> int | None:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+    try:
+        conn.request("GET", path)
+        return conn.getresponse().status
+    except OSError:
+        return None
+    finally:
+        conn.close()
+
+
+def measure_serving(db_down: bool, timeout: float) -> dict:
+    """Seconds from process start to the first screen and to readiness."""
+    port = _free_port()
+    extra = {"HOST": "127.0.0.1", "PORT": str(port), "STARTUP_MODE": "deferred"}
+    if db_down:
+        extra.update(DB_PORT="1", STARTUP_RETRY_SEC="1")
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "app.main"],
+        env=_env(**extra),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    result: dict = {"first_screen_sec": None, "ready_sec": None}
+    try:
+        deadline = started + timeout
+        while time.perf_counter() < deadline and proc.poll() is None:
+            if result["first_screen_sec"] is None and _status(port, "/") == 200:
+                result["first_screen_sec"] = time.perf_counter() - started
+            if result["first_screen_sec"] is not None:
+                if db_down or _status(port, "/api/ready") == 200:
+                    if not db_down:
+                        result["ready_sec"] = time.perf_counter() - started
+                    break
+            time.sleep(0.01)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    if db_down:
+        result["ready_sec"] = "DB停止中（未完了が正常）"
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters for import time")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list (self time)")
+    parser.add_argument("--db-down", action="store_true", help="start the server with the DB unreachable")
+    parser.add_argument("--no-serve", action="store_true", help="import time only")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--budget-ms", type=float, default=0.0, help="fail if median import time exceeds this")
+    args = parser.parse_args()
+
+    totals = []
+    rows: list[tuple[float, float, str]] = []
+    for _ in range(max(1, args.runs)):
+        total, rows = measure_imports()
+        totals.append(total)
+    median = statistics.median(totals)
+
+    print(f"\n⏱️ import app.main ({len(totals)}回)")
+    print(f"{'median (ms)':<28}{median:>10.1f}")
+    print(f"{'min / max (ms)':<28}{min(totals):>10.1f} / {max(totals):.1f}")
+    print(f"{'modules imported':<28}{len(rows):>10}")
+    print(f"\n{'self (ms)':>10}{'cumul. (ms)':>13}  module")
+    for self_ms, cumulative_ms, name in sorted(rows, reverse=True)[: args.top]:
+        print(f"{self_ms:>10.1f}{cumulative_ms:>13.1f}  {name}")
+    app_rows = [r for r in rows if r[2].startswith("app")]
+    print(f"\n{'app.* self total (ms)':<28}{sum(r[0] for r in app_rows):>10.1f}")
+
+    if not args.no_serve:
+        served = measure_serving(args.db_down, args.timeout)
+        print(f"\n🌐 python -m app.main{'（DB停止）' if args.db_down else ''}")
+        for label, key in (("first screen GET / (s)", "first_screen_sec"), ("GET /api/ready 200 (s)", "ready_sec")):
+            value = served[key]
+            shown = f"{value:>10.2f}" if isinstance(value, float) else f"{'-':>10}  {value or '時間切れ'}"
+            print(f"{label:<28}{shown}")
+
+    if args.budget_ms and median > args.budget_ms:
+        print(f"❌ import時間が予算超過: {median:.1f}ms > {args.budget_ms:.0f}ms")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()